@@ -0,0 +1,71 @@
+"""
+Parse the shared objects of a prefix with pyldd and with LIEF.
+
+The prefix is $CONDA_BUILD_BENCH_PREFIX, else the one asv runs in.  To compare pyldd with
+the parser of another commit, run e.g. ``asv continuous <commit> HEAD -b time_pyldd``.
+"""
+import glob
+import os
+import sys
+
+from conda_build.os_utils import pyldd
+
+_patterns = ('lib/*.so*', 'lib/*.dylib', 'lib/python*/lib-dynload/*.so', 'bin/*')
+
+
+def _shared_objects():
+    prefix = os.environ.get('CONDA_BUILD_BENCH_PREFIX', sys.prefix)
+    files = set()
+    for pattern in _patterns:
+        for path in glob.glob(os.path.join(prefix, pattern)):
+            if os.path.isfile(path) and not os.path.islink(path) and pyldd.codefile_type(path):
+                files.add(path)
+    return sorted(files)
+
+
+class TimePyldd:
+    timeout = 600
+
+    def setup(self):
+        self.files = _shared_objects()
+        if not self.files:
+            raise NotImplementedError("no shared objects to parse")
+
+    def time_codefile(self):
+        for path in self.files:
+            with open(path, 'rb') as f:
+                pyldd.codefile(f)
+
+    def time_inspect_linkages(self):
+        for path in self.files:
+            pyldd.inspect_linkages(path, resolve_filenames=False, recurse=False)
+
+    def time_get_elf_rpath(self):
+        for path in self.files:
+            pyldd.get_elf_rpath(path)
+
+    def time_get_exports(self):
+        for path in self.files:
+            pyldd.get_exports(path)
+
+
+class TimeLief:
+    timeout = 600
+
+    def setup(self):
+        try:
+            import lief
+        except ImportError:
+            raise NotImplementedError("lief is not installed")
+        self.parse = lief.parse
+        self.files = _shared_objects()
+        if not self.files:
+            raise NotImplementedError("no shared objects to parse")
+
+    def time_parse(self):
+        for path in self.files:
+            self.parse(path)
+
+    def time_get_exports(self):
+        for path in self.files:
+            [str(e) for e in self.parse(path).exported_functions]
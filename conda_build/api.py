@@ -88,8 +88,10 @@ def get_output_file_paths(recipe_path_or_metadata, no_download_source=False, con
     """Get output file paths for any packages that would be created by a recipe
 
     Both split packages (recipes with more than one output) and build matrices,
-    created with variants, contribute to the list of file paths here.
+    created with variants, contribute to the list of file paths here.  With skip_existing,
+    outputs that are already built are reported as skipped.
     """
+    from conda_build.build import find_built_packages, package_key
     from conda_build.render import bldpkg_path
     from conda_build.conda_interface import string_types
     from conda_build.utils import get_skip_message
@@ -113,15 +115,52 @@ def get_output_file_paths(recipe_path_or_metadata, no_download_source=False, con
                                                             .format(recipe_path_or_metadata))
         metadata = [(recipe_path_or_metadata, None, None)]
     #    Next, loop over outputs that each metadata defines
+    built = find_built_packages([m for m, _, _ in metadata
+                                 if m.config.skip_existing and not m.skip()], 'host')
     outs = []
     for (m, _, _) in metadata:
-        if m.skip():
+        if m.skip() or package_key(m) in built:
             outs.append(get_skip_message(m))
         else:
             outs.append(bldpkg_path(m))
     return sorted(list(set(outs)))
 
 
+def plan(recipe_paths_or_metadata, no_download_source=False, config=None, variants=None,
+         **kwargs):
+    """Describe what building recipes would do, without building anything.
+
+    Returns a list with one dict per output: its name, version, build string and package path,
+    whether it would be skipped (``skip`` is 'recipe', 'existing' with skip_existing, or None),
+    the requirements of the build, host and test environments it needs, and estimated seconds
+    for each phase from the stats of earlier builds (see ``stats_history``).  Everything in it
+    can be serialized to JSON.
+    """
+    from conda_build.build import find_built_packages, plan_output
+    from conda_build.conda_interface import string_types
+    from conda_build.stats_history import StatsHistory, history_path
+    config = get_or_merge_config(config, **kwargs)
+
+    if (isinstance(recipe_paths_or_metadata, string_types) or
+            hasattr(recipe_paths_or_metadata, 'config')):
+        recipe_paths_or_metadata = [recipe_paths_or_metadata]
+    metadata = []
+    for recipe in recipe_paths_or_metadata:
+        if hasattr(recipe, 'config'):
+            metadata.append(recipe)
+        else:
+            metadata.extend(m for m, _, _ in render(recipe, no_download_source=no_download_source,
+                                                    variants=variants, config=config,
+                                                    finalize=True, **kwargs))
+    built = find_built_packages([m for m in metadata
+                                 if m.config.skip_existing and not m.skip()], 'host')
+    history = StatsHistory(history_path(config))
+    try:
+        return [plan_output(m, history, built=built) for m in metadata]
+    finally:
+        history.close()
+
+
 def get_output_file_path(recipe_path_or_metadata, no_download_source=False, config=None,
                          variants=None, **kwargs):
     """Get output file paths for any packages that would be created by a recipe
@@ -235,6 +274,19 @@ def test(recipedir_or_package_or_metadata, move_broken=True, config=None, stats=
     return test_result
 
 
+def test_packages(packages, move_broken=True, config=None, stats=None, **kwargs):
+    """Run tests on several packages (or recipe folders), ``config.test_workers`` at a time.
+
+    Returns an ordered dict mapping each package to a dict with 'passed', 'elapsed' and 'log'
+    (the path to its test output) entries."""
+    from conda_build.build import test_packages
+
+    config = get_or_merge_config(config, **kwargs)
+    if stats is None:
+        stats = {}
+    return test_packages(packages, config=config, stats=stats, move_broken=move_broken)
+
+
 def list_skeletons():
     """List available skeletons for generating conda recipes from external sources.
 
@@ -325,11 +377,13 @@ def test_installable(channel='defaults'):
 
 
 def inspect_linkages(packages, prefix=_sys.prefix, untracked=False, all_packages=False,
-                     show_files=False, groupby='package', sysroot=''):
+                     show_files=False, groupby='package', sysroot='', config=None, **kwargs):
     from .inspect_pkg import inspect_linkages
+    config = get_or_merge_config(config, **kwargs)
     packages = _ensure_list(packages)
     return inspect_linkages(packages, prefix=prefix, untracked=untracked, all_packages=all_packages,
-                            show_files=show_files, groupby=groupby, sysroot=sysroot)
+                            show_files=show_files, groupby=groupby, sysroot=sysroot,
+                            owners_cache_dir=config.prefix_owners_cache_dir)
 
 
 def inspect_objects(packages, prefix=_sys.prefix, groupby='filename'):
@@ -4,11 +4,18 @@ Module that does most of the heavy lifting for the ``conda build`` command.
 from __future__ import absolute_import, division, print_function
 
 from collections import deque, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+try:
+    from concurrent.futures.process import BrokenProcessPool
+except ImportError:
+    # the python 2 backport of concurrent.futures has no such error
+    BrokenProcessPool = RuntimeError
 import fnmatch
 from glob import glob
 import io
 import json
 import libarchive
+import multiprocessing
 import os
 from os.path import isdir, isfile, islink, join, dirname
 import random
@@ -19,6 +26,7 @@ import string
 import subprocess
 import sys
 import time
+import traceback
 from tempfile import NamedTemporaryFile
 
 # this is to compensate for a requests idna encoding error.  Conda is a better place to fix,
@@ -60,8 +68,10 @@ from .conda_interface import pkgs_dirs
 from .utils import env_var, tmp_chdir
 
 from conda_build import __version__
-from conda_build import environ, source, tarcheck, utils
-from conda_build.index import get_build_index, update_index
+from conda_build import (build_cache, build_journal, env_templates, environ, source,
+                         stats_history, tarcheck, trace, trash, utils)
+from conda_build.file_table import get_file_table
+from conda_build.index import get_build_index, update_index, update_index_for_package
 from conda_build.render import (output_yaml, bldpkg_path, render_recipe, reparse, finalize_metadata,
                                 distribute_variants, expand_outputs, try_download,
                                 add_upstream_pins, execute_download_actions)
@@ -72,7 +82,7 @@ from conda_build.post import (post_process, post_build,
 
 from conda_build.exceptions import indent, DependencyNeedsBuildingError, CondaBuildException
 from conda_build.variants import (set_language_env_vars, dict_of_lists_to_list_of_dicts,
-                                  get_package_variants)
+                                  get_package_variants, find_used_variables_in_text)
 from conda_build.create_test import create_all_test_files
 
 import conda_build.noarch_python as noarch_python
@@ -91,9 +101,19 @@ else:
     shell_path = '/bin/bash'
 
 
-def stats_key(metadata, desc):
+def stats_key(metadata, desc, recipe=False):
     # get the build string from whatever conda-build makes of the configuration
-    used_loop_vars = metadata.get_used_loop_vars()
+    if recipe:
+        # phases build() runs once for the whole recipe (creating the environments, running the
+        #    build script) are keyed by the recipe, so that each of its outputs finds them too
+        parent = metadata.meta.get('extra', {}).get('parent_recipe', {})
+        used_loop_vars = find_used_variables_in_text(
+            metadata.get_loop_vars(), metadata.get_recipe_text(force_top_level=True))
+        name, version = (parent['name'], parent.get('version')) if parent.get('name') else (
+            metadata.name(), metadata.version())
+    else:
+        used_loop_vars = metadata.get_used_loop_vars()
+        name, version = metadata.name(), metadata.version()
     build_vars = '-'.join([k + '_' + str(metadata.config.variant[k]) for k in used_loop_vars
                           if k != 'target_platform'])
     # kind of a special case.  Target platform determines a lot of output behavior, but may not be
@@ -101,7 +121,7 @@ def stats_key(metadata, desc):
     tp = metadata.config.variant.get('target_platform')
     if tp and tp != metadata.config.subdir and 'target_platform' not in build_vars:
         build_vars += '-target_' + tp
-    key = [metadata.name(), metadata.version()]
+    key = [name, version]
     if build_vars:
         key.append(build_vars)
     key = "-".join(key)
@@ -162,73 +182,63 @@ def create_post_scripts(m):
             os.chmod(dst, 0o775)
 
 
-def have_prefix_files(files, prefix):
+def have_prefix_files(files, prefix, file_table=None):
     '''
     Yields files that contain the current prefix in them, and modifies them
     to replace the prefix with a placeholder.
 
     :param files: Filenames to check for instances of prefix
     :type files: list of tuples containing strings (prefix, mode, filename)
+    :param file_table: FileTable of prefix to look the files up in (by default that of this process)
     '''
 
     prefix_bytes = prefix.encode(utils.codec)
     prefix_placeholder_bytes = prefix_placeholder.encode(utils.codec)
-    if utils.on_win:
-        forward_slash_prefix = prefix.replace('\\', '/')
-        forward_slash_prefix_bytes = forward_slash_prefix.encode(utils.codec)
-        double_backslash_prefix = prefix.replace('\\', '\\\\')
-        double_backslash_prefix_bytes = double_backslash_prefix.encode(utils.codec)
+    file_table = file_table or get_file_table(prefix)
+    files = [f for f in files if not f.endswith(('.pyc', '.pyo'))]
+    file_table.update(files)
 
     for f in files:
-        if f.endswith(('.pyc', '.pyo')):
-            continue
         path = join(prefix, f)
-        if not isfile(path):
+        info = file_table.get(f)
+        if not info.is_file:
             continue
-        if sys.platform != 'darwin' and islink(path):
+        if sys.platform != 'darwin' and info.is_link:
             # OSX does not allow hard-linking symbolic links, so we cannot
             # skip symbolic links (as we can on Linux)
             continue
 
         # dont try to mmap an empty file
-        if os.stat(path).st_size == 0:
+        if info.size == 0:
             continue
 
-        try:
-            fi = open(path, 'rb+')
-        except IOError:
+        if info.error or not os.access(path, os.R_OK | os.W_OK):
             log = utils.get_logger(__name__)
             log.warn("failed to open %s for detecting prefix.  Skipping it." % f)
             continue
-        try:
-            mm = utils.mmap_mmap(fi.fileno(), 0, tagname=None, flags=utils.mmap_MAP_PRIVATE)
-        except OSError:
-            mm = fi.read()
 
-        mode = 'binary' if mm.find(b'\x00') != -1 else 'text'
+        mode = info.mode
         if mode == 'text':
-            if not utils.on_win and mm.find(prefix_bytes) != -1:
+            if not utils.on_win and prefix in info.prefix_hits:
                 # Use the placeholder for maximal backwards compatibility, and
                 # to minimize the occurrences of usernames appearing in built
                 # packages.
-                data = mm[:]
-                mm.close()
-                fi.close()
+                with open(path, 'rb') as fi:
+                    data = fi.read()
                 rewrite_file_with_new_prefix(path, data, prefix_bytes, prefix_placeholder_bytes)
-                fi = open(path, 'rb+')
-                mm = utils.mmap_mmap(fi.fileno(), 0, tagname=None, flags=utils.mmap_MAP_PRIVATE)
-        if mm.find(prefix_bytes) != -1:
+                info = file_table.get(f)
+        # the other spellings are only looked for on windows, see file_table.prefix_spellings
+        spellings = file_table.spellings
+        if spellings[0] in info.prefix_hits:
             yield (prefix, mode, f)
-        if utils.on_win and mm.find(forward_slash_prefix_bytes) != -1:
+        if utils.on_win and spellings[1] in info.prefix_hits:
             # some windows libraries use unix-style path separators
-            yield (forward_slash_prefix, mode, f)
-        elif utils.on_win and mm.find(double_backslash_prefix_bytes) != -1:
+            yield (spellings[1], mode, f)
+        elif utils.on_win and spellings[2] in info.prefix_hits:
             # some windows libraries have double backslashes as escaping
-            yield (double_backslash_prefix, mode, f)
-        if mm.find(prefix_placeholder_bytes) != -1:
+            yield (spellings[2], mode, f)
+        if prefix_placeholder in info.prefix_hits:
             yield (prefix_placeholder, mode, f)
-        mm.close()
-        fi.close()
 
 
 def rewrite_file_with_new_prefix(path, data, old_prefix, new_prefix):
@@ -434,6 +444,25 @@ def write_hash_input(m):
         json.dump(recipe_input, f, indent=2)
 
 
+def _solved_envs(m):
+    # where solving the build and host envs records the solutions, when they are to be written
+    return m.config.solved_envs if m.config.write_lockfile else None
+
+
+def write_solved_envs(m):
+    # the solutions used for the build and host envs, in the format that --lockfile accepts
+    if not m.config.write_lockfile:
+        return
+    solved = {}
+    for env, prefix in (('build', m.config.build_prefix), ('host', m.config.host_prefix)):
+        entry = m.config.solved_envs.get(prefix)
+        if entry and entry not in solved.values():
+            solved[env] = entry
+    if solved:
+        with open(os.path.join(m.config.info_dir, 'solved_envs.json'), 'w') as f:
+            json.dump(solved, f, indent=2, sort_keys=True)
+
+
 def get_files_with_prefix(m, files, prefix):
     files_with_prefix = sorted(have_prefix_files(files, prefix))
 
@@ -452,6 +481,7 @@ def get_files_with_prefix(m, files, prefix):
     return files_with_prefix
 
 
+@trace.traced('detect prefix files', args=lambda m, files, prefix: {'files': len(files)})
 def detect_and_record_prefix_files(m, files, prefix):
     files_with_prefix = get_files_with_prefix(m, files, prefix)
     binary_has_prefix_files = m.binary_has_prefix_files()
@@ -637,6 +667,7 @@ def write_run_exports(m):
             json.dump(run_exports, f)
 
 
+@trace.traced('create info files', args=lambda m, files, prefix: trace.file_args(files, prefix))
 def create_info_files(m, files, prefix):
     '''
     Creates the metadata files that will be stored in the built package.
@@ -656,6 +687,7 @@ def create_info_files(m, files, prefix):
     write_about_json(m)
     write_link_json(m)
     write_run_exports(m)
+    write_solved_envs(m)
 
     copy_recipe(m)
     copy_readme(m)
@@ -736,16 +768,21 @@ def path_type(path):
 def build_info_files_json_v1(m, prefix, files, files_with_prefix):
     no_link_files = m.get_value('build/no_link')
     files_json = []
+    # the hashes and sizes recorded in the package are of the final files: read them all again
+    #    (in parallel) rather than trust the stat of entries classified earlier in the build
+    file_table = get_file_table(prefix)
+    file_table.update(files, fresh=True)
     for fi in sorted(files):
         prefix_placeholder, file_mode = has_prefix(fi, files_with_prefix)
         path = os.path.join(prefix, fi)
+        info = file_table.get(fi)
         short_path = get_short_path(m, fi)
         if short_path:
             short_path = short_path.replace('\\', '/').replace('\\\\', '/')
         file_info = {
             "_path": short_path,
-            "sha256": utils.sha256_checksum(path),
-            "size_in_bytes": os.path.getsize(path),
+            "sha256": info.sha256 if info.error is None else utils.sha256_checksum(path),
+            "size_in_bytes": info.size if info.is_file else os.path.getsize(path),
             "path_type": path_type(path),
         }
         no_link = is_no_link(no_link_files, fi)
@@ -785,7 +822,8 @@ def create_info_files_json_v1(m, info_dir, prefix, files, files_with_prefix):
     return checksums
 
 
-def post_process_files(m, initial_prefix_files):
+@trace.traced('post-process files')
+def post_process_files(m, initial_prefix_files, stats=None):
     get_build_metadata(m)
     create_post_scripts(m)
 
@@ -796,13 +834,15 @@ def post_process_files(m, initial_prefix_files):
 
     python = (m.config.build_python if os.path.isfile(m.config.build_python) else
               m.config.host_python)
-    post_process(m.get_value('package/name'), m.get_value('package/version'),
-                 sorted(current_prefix_files - initial_prefix_files),
-                 prefix=m.config.host_prefix,
-                 config=m.config,
-                 preserve_egg_dir=bool(m.get_value('build/preserve_egg_dir')),
-                 noarch=m.get_value('build/noarch'),
-                 skip_compile_pyc=m.get_value('build/skip_compile_pyc'))
+    pyc_stats = post_process(m.get_value('package/name'), m.get_value('package/version'),
+                             sorted(current_prefix_files - initial_prefix_files),
+                             prefix=m.config.host_prefix,
+                             config=m.config,
+                             preserve_egg_dir=bool(m.get_value('build/preserve_egg_dir')),
+                             noarch=m.get_value('build/noarch'),
+                             skip_compile_pyc=m.get_value('build/skip_compile_pyc'))
+    if pyc_stats and stats is not None:
+        stats[stats_key(m, 'compile_pyc_{}'.format(m.name()))] = pyc_stats
 
     # The post processing may have deleted some files (like easy-install.pth)
     current_prefix_files = utils.prefix_files(prefix=m.config.host_prefix)
@@ -837,6 +877,7 @@ can lead to packages that include their dependencies.""" % meta_files))
     return new_files
 
 
+@trace.traced(args=lambda output, metadata, *a, **kw: {'dist': metadata.dist()})
 def bundle_conda(output, metadata, env, stats, **kw):
     log = utils.get_logger(__name__)
     log.info('Packaging %s', metadata.dist())
@@ -900,8 +941,9 @@ def bundle_conda(output, metadata, env, stats, **kw):
             _write_activation_text(dest_file, metadata)
 
         bundle_stats = {}
-        utils.check_call_env(interpreter_and_args + [dest_file],
-                             cwd=metadata.config.work_dir, env=env_output, stats=bundle_stats)
+        with trace.span('output script', cat='script'):
+            utils.check_call_env(interpreter_and_args + [dest_file],
+                                 cwd=metadata.config.work_dir, env=env_output, stats=bundle_stats)
         log_stats(bundle_stats, "bundling {}".format(metadata.name()))
         if stats is not None:
             stats[stats_key(metadata, 'bundle_{}'.format(metadata.name()))] = bundle_stats
@@ -909,15 +951,24 @@ def bundle_conda(output, metadata, env, stats, **kw):
     elif files:
         # Files is specified by the output
         # we exclude the list of files that we want to keep, so post-process picks them up as "new"
-        keep_files = set(os.path.normpath(pth)
-                         for pth in utils.expand_globs(files, metadata.config.host_prefix))
         pfx_files = set(utils.prefix_files(metadata.config.host_prefix))
-        initial_files = set(item for item in (pfx_files - keep_files)
-                            if not any(keep_file.startswith(item + os.path.sep)
-                                       for keep_file in keep_files))
-        initial_files = set(item for item in (pfx_files - keep_files)
-                            if not any(keep_file.startswith(item + os.path.sep)
-                                       for keep_file in keep_files))
+        # the files of the top-level build are the same for every output; only the files of
+        #    this output's env need indexing here
+        new_files_index = kw.get('new_files_index')
+        if new_files_index:
+            index = utils.PrefixFileIndex(pfx_files - new_files_index.files,
+                                          base=new_files_index)
+        else:
+            index = utils.PrefixFileIndex(pfx_files)
+        keep_files = set(index.select(files, metadata.config.host_prefix))
+        # folders holding kept files (symlinks to folders, in prefix_files) have to stay too
+        keep_dirs = set()
+        for keep_file in keep_files:
+            keep_dir = os.path.dirname(keep_file)
+            while keep_dir and keep_dir not in keep_dirs:
+                keep_dirs.add(keep_dir)
+                keep_dir = os.path.dirname(keep_dir)
+        initial_files = pfx_files - keep_files - keep_dirs
     else:
         if not metadata.always_include_files():
             log.warn("No files or script found for output {}".format(output.get('name')))
@@ -942,16 +993,23 @@ def bundle_conda(output, metadata, env, stats, **kw):
                                               "info." .format(dep, link))
         initial_files = set(utils.prefix_files(metadata.config.host_prefix))
 
-    for pat in metadata.always_include_files():
-        has_matches = False
-        for f in set(initial_files):
-            if fnmatch.fnmatch(f, pat):
+    always_include_files = metadata.always_include_files()
+    if always_include_files:
+        # these are already expanded into paths, so they are mostly looked up rather than matched
+        by_normcase = {os.path.normcase(f): f for f in initial_files}
+        for pat in always_include_files:
+            if utils.has_glob_magic(pat):
+                matches = [f for f in initial_files if fnmatch.fnmatch(f, pat)]
+            else:
+                matches = [by_normcase[os.path.normcase(pat)]] if os.path.normcase(pat) in \
+                    by_normcase else []
+            for f in matches:
                 print("Including in package existing file", f)
-                initial_files.remove(f)
-                has_matches = True
-        if not has_matches:
-            log.warn("Glob %s from always_include_files does not match any files", pat)
-    files = post_process_files(metadata, initial_files)
+                initial_files.discard(f)
+                by_normcase.pop(os.path.normcase(f), None)
+            if not matches:
+                log.warn("Glob %s from always_include_files does not match any files", pat)
+    files = post_process_files(metadata, initial_files, stats=stats)
 
     if output.get('name') and output.get('name') != 'conda':
         assert 'bin/conda' not in files and 'Scripts/conda.exe' not in files, ("Bug in conda-build "
@@ -1017,15 +1075,19 @@ def bundle_conda(output, metadata, env, stats, **kw):
             # possible large binary or data files
             fullpath = tmp_path + ext
             print("Compressing to {}".format(fullpath))
-            with tmp_chdir(metadata.config.host_prefix):
+            with tmp_chdir(metadata.config.host_prefix), \
+                    trace.span('compress', format=ext,
+                               **trace.file_args(files_list, metadata.config.host_prefix)) as span_args:
                 with libarchive.file_writer(fullpath, 'gnutar', filter_name=filter, options=opts) as archive:
                     archive.add_files(*files_list)
                 tmp_archives.append(fullpath)
+                span_args['compressed_bytes'] = os.path.getsize(fullpath)
 
         # we're done building, perform some checks
         for tmp_path in tmp_archives:
             if tmp_path.endswith('.tar.bz2'):
-                tarcheck.check_all(tmp_path, metadata.config)
+                with trace.span('tarcheck'):
+                    tarcheck.check_all(tmp_path, metadata.config)
             output_filename = os.path.basename(tmp_path)
 
             # we do the import here because we want to respect logger level context
@@ -1040,8 +1102,10 @@ def bundle_conda(output, metadata, env, stats, **kw):
                 checks_to_ignore = (utils.ensure_list(metadata.config.ignore_verify_codes) +
                                     metadata.ignore_verify_codes())
                 try:
-                    verifier.verify_package(path_to_package=tmp_path, checks_to_ignore=checks_to_ignore,
-                                            exit_on_error=metadata.config.exit_on_verify_error)
+                    with trace.span('conda-verify'):
+                        verifier.verify_package(path_to_package=tmp_path,
+                                                checks_to_ignore=checks_to_ignore,
+                                                exit_on_error=metadata.config.exit_on_verify_error)
                 except KeyError as e:
                     log.warn("Package doesn't have necessary files.  It might be too old to inspect."
                              "Legacy noarch packages are known to fail.  Full message was {}".format(e))
@@ -1069,12 +1133,13 @@ def bundle_conda(output, metadata, env, stats, **kw):
     # clean out host prefix so that this output's files don't interfere with other outputs
     #   We have a backup of how things were before any output scripts ran.  That's
     #   restored elsewhere.
-    utils.rm_rf(metadata.config.host_prefix)
+    trash.discard(metadata.config.host_prefix, metadata.config)
 
     return final_outputs
 
 
-def bundle_wheel(output, metadata, env, stats):
+@trace.traced(args=lambda output, metadata, *a, **kw: {'dist': metadata.dist()})
+def bundle_wheel(output, metadata, env, stats, **kw):
     ext = ".bat" if utils.on_win else ".sh"
     with TemporaryDirectory() as tmpdir, utils.tmp_chdir(metadata.config.work_dir):
         dest_file = os.path.join(metadata.config.work_dir, 'wheel_output' + ext)
@@ -1208,7 +1273,14 @@ def _write_activation_text(script_path, m):
         fh.write(data)
 
 
-def create_build_envs(m, notest):
+@trace.traced('solve build envs', cat='env')
+def _solve_build_envs(m, timings=None):
+    """Get install actions for the host env (only when it is separate) and the build env.
+
+    Both are solved before either environment is created.  Solve times are recorded per
+    environment in ``timings``, when given.
+    """
+    timings = {} if timings is None else timings
     build_ms_deps = m.ms_depends('build')
     build_ms_deps = [utils.ensure_valid_spec(spec) for spec in build_ms_deps]
     host_ms_deps = m.ms_depends('host')
@@ -1216,10 +1288,12 @@ def create_build_envs(m, notest):
 
     m.config._merge_build_host = m.build_is_host
 
+    host_actions = None
     if m.is_cross and not m.build_is_host:
         if VersionOrder(conda_version) < VersionOrder('4.3.2'):
             raise RuntimeError("Non-native subdir support only in conda >= 4.3.2")
 
+        start = time.time()
         host_actions = environ.get_install_actions(m.config.host_prefix,
                                                     tuple(host_ms_deps), 'host',
                                                     subdir=m.config.host_subdir,
@@ -1231,12 +1305,13 @@ def create_build_envs(m, notest):
                                                     disable_pip=m.config.disable_pip,
                                                     max_env_retry=m.config.max_env_retry,
                                                     output_folder=m.config.output_folder,
-                                                    channel_urls=tuple(m.config.channel_urls))
-        environ.create_env(m.config.host_prefix, host_actions, env='host', config=m.config,
-                            subdir=m.config.host_subdir, is_cross=m.is_cross,
-                            is_conda=m.name() == 'conda')
+                                                    channel_urls=tuple(m.config.channel_urls),
+                                                    solve_cache_dir=m.config.solve_cache_dir,
+                                                    solved_envs=_solved_envs(m))
+        timings.setdefault('host', {})['solve'] = time.time() - start
     if m.build_is_host:
         build_ms_deps.extend(host_ms_deps)
+    start = time.time()
     build_actions = environ.get_install_actions(m.config.build_prefix,
                                                 tuple(build_ms_deps), 'build',
                                                 subdir=m.config.build_subdir,
@@ -1248,7 +1323,18 @@ def create_build_envs(m, notest):
                                                 disable_pip=m.config.disable_pip,
                                                 max_env_retry=m.config.max_env_retry,
                                                 output_folder=m.config.output_folder,
-                                                channel_urls=tuple(m.config.channel_urls))
+                                                channel_urls=tuple(m.config.channel_urls),
+                                                solve_cache_dir=m.config.solve_cache_dir,
+                                                solved_envs=_solved_envs(m))
+    timings.setdefault('build', {})['solve'] = time.time() - start
+    return host_actions, build_actions
+
+
+@trace.traced('create build envs', cat='env')
+def create_build_envs(m, notest, stats=None):
+    start = time.time()
+    timings = {}
+    host_actions, build_actions = _solve_build_envs(m, timings)
 
     try:
         if not notest:
@@ -1268,7 +1354,8 @@ def create_build_envs(m, notest):
                                         disable_pip=m.config.disable_pip,
                                         max_env_retry=m.config.max_env_retry,
                                         output_folder=m.config.output_folder,
-                                        channel_urls=tuple(m.config.channel_urls))
+                                        channel_urls=tuple(m.config.channel_urls),
+                                        solve_cache_dir=m.config.solve_cache_dir)
     except DependencyNeedsBuildingError as e:
         # subpackages are not actually missing.  We just haven't built them yet.
         from .conda_interface import MatchSpec
@@ -1279,14 +1366,24 @@ def create_build_envs(m, notest):
         if missing_deps:
             e.packages = missing_deps
             raise e
+    envs = []
+    if host_actions is not None:
+        envs.append(dict(prefix=m.config.host_prefix, specs_or_actions=host_actions, env='host',
+                         subdir=m.config.host_subdir, is_cross=m.is_cross,
+                         is_conda=m.name() == 'conda'))
     if (not m.config.dirty or not os.path.isdir(m.config.build_prefix) or not os.listdir(m.config.build_prefix)):
-        environ.create_env(m.config.build_prefix, build_actions, env='build',
-                            config=m.config, subdir=m.config.build_subdir,
-                            is_cross=m.is_cross, is_conda=m.name() == 'conda')
+        envs.append(dict(prefix=m.config.build_prefix, specs_or_actions=build_actions,
+                         env='build', subdir=m.config.build_subdir, is_cross=m.is_cross,
+                         is_conda=m.name() == 'conda'))
+    environ.create_envs(envs, m.config, timings)
+    if stats is not None:
+        stats[stats_key(m, 'create_envs', recipe=True)] = {'elapsed': time.time() - start,
+                                                           'envs': timings}
 
 
+@trace.traced(args=lambda m, *a, **kw: {'name': m.name()})
 def build(m, stats, post=None, need_source_download=True, need_reparse_in_env=False,
-          built_packages=None, notest=False, provision_only=False):
+          built_packages=None, notest=False, provision_only=False, built=None):
     '''
     Build the package with the specified metadata.
 
@@ -1296,6 +1393,9 @@ def build(m, stats, post=None, need_source_download=True, need_reparse_in_env=Fa
     post only. False means stop just before the post.
     :type need_source_download: bool: if rendering failed to download source
     (due to missing tools), retry here after build env is populated
+    :type built: set or None: the package_key of outputs found already built (see
+    find_built_packages), for --skip-existing.  Looked up here when None.  The key of each
+    output built here is added to it.
     '''
     default_return = {}
     if not built_packages:
@@ -1309,6 +1409,8 @@ def build(m, stats, post=None, need_source_download=True, need_reparse_in_env=Fa
     host_actions = []
     build_actions = []
     output_metas = []
+    cache = None
+    cache_digest = None
 
     with utils.path_prepended(m.config.build_prefix):
         env = environ.get_dict(m=m)
@@ -1327,11 +1429,17 @@ def build(m, stats, post=None, need_source_download=True, need_reparse_in_env=Fa
         package_locations = []
         # TODO: should we check both host and build envs?  These are the same, except when
         #    cross compiling.
-        for _, om in output_metas:
-            if om.skip() or (m.config.skip_existing and is_package_built(om, 'host')):
-                skipped.append(bldpkg_path(om))
-            else:
-                package_locations.append(bldpkg_path(om))
+        with trace.span('check existing', outputs=len(output_metas)):
+            if built is None:
+                built = set()
+                if m.config.skip_existing:
+                    built = find_built_packages([om for _, om in output_metas if not om.skip()],
+                                                'host')
+            for _, om in output_metas:
+                if om.skip() or package_key(om) in built:
+                    skipped.append(bldpkg_path(om))
+                else:
+                    package_locations.append(bldpkg_path(om))
         if not package_locations:
             print("Packages for ", m.path or m.name(), "with variant {} "
                   "are already built and available from your configured channels "
@@ -1394,7 +1502,22 @@ def build(m, stats, post=None, need_source_download=True, need_reparse_in_env=Fa
         utils.insert_variant_versions(m.meta.get('requirements', {}), m.config.variant, 'host')
         add_upstream_pins(m, False, exclude_pattern)
 
-        create_build_envs(m, notest)
+        cache = build_cache.get_build_cache(m.config)
+        if (cache and post is None and not provision_only and
+                all(getattr(om, 'type', 'conda') == 'conda' for _, om in output_metas)):
+            host_actions, build_actions = _solve_build_envs(m)
+            cache_digest = build_cache.input_digest(m, output_metas, build_actions, host_actions)
+            if cache_digest is None:
+                print("Not using the build cache: the sources of {} can't be pinned down before "
+                      "they are fetched (a url without a checksum, a git branch or tag, ...)".format(
+                          m.name()))
+            else:
+                cached_pkgs = _republish_from_build_cache(cache, cache_digest, output_metas,
+                                                          package_locations)
+                if cached_pkgs:
+                    return cached_pkgs
+
+        create_build_envs(m, notest, stats)
 
         # this check happens for the sake of tests, but let's do it before the build so we don't
         #     make people wait longer only to see an error
@@ -1403,7 +1526,7 @@ def build(m, stats, post=None, need_source_download=True, need_reparse_in_env=Fa
         # Execute any commands fetching the source (e.g., git) in the _build environment.
         # This makes it possible to provide source fetchers (eg. git, hg, svn) as build
         # dependencies.
-        with utils.path_prepended(m.config.build_prefix):
+        with trace.span('source'), utils.path_prepended(m.config.build_prefix):
             try_download(m, no_download_source=False, raise_error=True)
         if need_source_download and not m.final:
             m.parse_until_resolved(allow_no_other_outputs=True)
@@ -1441,7 +1564,8 @@ def build(m, stats, post=None, need_source_download=True, need_reparse_in_env=Fa
                     build_file = join(src_dir, 'bld.bat')
                     with open(build_file, 'w') as bf:
                         bf.write(script)
-                windows.build(m, build_file, stats=build_stats, provision_only=provision_only)
+                with trace.span('build script', cat='script'):
+                    windows.build(m, build_file, stats=build_stats, provision_only=provision_only)
             else:
                 build_file = join(m.path, 'build.sh')
                 if isfile(build_file) and script:
@@ -1473,13 +1597,14 @@ def build(m, stats, post=None, need_source_download=True, need_reparse_in_env=Fa
                         del env['CONDA_BUILD']
 
                         # this should raise if any problems occur while building
-                        utils.check_call_env(cmd, env=env, rewrite_stdout_env=rewrite_env,
-                                            cwd=src_dir, stats=build_stats)
+                        with trace.span('build script', cat='script'):
+                            utils.check_call_env(cmd, env=env, rewrite_stdout_env=rewrite_env,
+                                                 cwd=src_dir, stats=build_stats)
                         utils.remove_pycache_from_scripts(m.config.host_prefix)
             if build_stats and not provision_only:
                 log_stats(build_stats, "building {}".format(m.name()))
                 if stats is not None:
-                    stats[stats_key(m, 'build')] = build_stats
+                    stats[stats_key(m, 'build', recipe=True)] = build_stats
 
     prefix_file_list = join(m.config.build_folder, 'prefix_files.txt')
     initial_files = set()
@@ -1508,24 +1633,36 @@ def build(m, stats, post=None, need_source_download=True, need_reparse_in_env=Fa
 
         with TemporaryDirectory() as prefix_files_backup:
             # back up new prefix files, because we wipe the prefix before each output build
-            for f in new_prefix_files:
-                utils.copy_into(os.path.join(m.config.host_prefix, f),
-                                os.path.join(prefix_files_backup, f),
-                                symlinks=True)
+            start = time.time()
+            with trace.span('back up prefix files',
+                            **trace.file_args(new_prefix_files, m.config.host_prefix)):
+                how = utils.copy_prefix_files(m.config.host_prefix, prefix_files_backup,
+                                              new_prefix_files)
+            log.info("Backed up %d new prefix files (%s) in %.2fs", len(new_prefix_files), how,
+                     time.time() - start)
 
             # this is the inner loop, where we loop over any vars used only by
             # outputs (not those used by the top-level recipe). The metadata
             # objects here are created by the m.get_output_metadata_set, which
             # is distributing the matrix of used variables.
 
+            if built is None:
+                built = set()
+                if top_level_meta.config.skip_existing:
+                    # TODO: should we check both host and build envs?  These are the same,
+                    #    except when cross compiling
+                    built = find_built_packages([om for _, om in outputs if not om.skip()],
+                                                'host')
+            # outputs picking their files out of the top-level build share one index of them
+            new_files_index = None
+            if any(output_d.get('files') for output_d, _ in outputs):
+                new_files_index = utils.PrefixFileIndex(new_prefix_files)
             for (output_d, m) in outputs:
                 if m.skip():
                     print(utils.get_skip_message(m))
                     continue
 
-                # TODO: should we check both host and build envs?  These are the same, except when
-                #    cross compiling
-                if m.config.skip_existing and is_package_built(m, 'host'):
+                if package_key(m) in built:
                     print(utils.get_skip_message(m))
                     new_pkgs[bldpkg_path(m)] = output_d, m
                     continue
@@ -1564,12 +1701,13 @@ def build(m, stats, post=None, need_source_download=True, need_reparse_in_env=Fa
                     else:
                         m.config._merge_build_host = m.build_is_host
 
-                        utils.rm_rf(m.config.host_prefix)
-                        utils.rm_rf(m.config.build_prefix)
-                        utils.rm_rf(m.config.test_prefix)
+                        trash.discard(m.config.host_prefix, m.config)
+                        trash.discard(m.config.build_prefix, m.config)
+                        trash.discard(m.config.test_prefix, m.config)
 
                         host_ms_deps = m.ms_depends('host')
                         sub_build_ms_deps = m.ms_depends('build')
+                        envs = []
                         if m.is_cross and not m.build_is_host:
                             host_actions = environ.get_install_actions(m.config.host_prefix,
                                                     tuple(host_ms_deps), 'host',
@@ -1582,10 +1720,13 @@ def build(m, stats, post=None, need_source_download=True, need_reparse_in_env=Fa
                                                     disable_pip=m.config.disable_pip,
                                                     max_env_retry=m.config.max_env_retry,
                                                     output_folder=m.config.output_folder,
-                                                    channel_urls=tuple(m.config.channel_urls))
-                            environ.create_env(m.config.host_prefix, host_actions, env='host',
-                                               config=m.config, subdir=subdir, is_cross=m.is_cross,
-                                               is_conda=m.name() == 'conda')
+                                                    channel_urls=tuple(m.config.channel_urls),
+                                                    solve_cache_dir=m.config.solve_cache_dir,
+                                                    solved_envs=_solved_envs(m))
+                            envs.append(dict(prefix=m.config.host_prefix,
+                                             specs_or_actions=host_actions, env='host',
+                                             subdir=subdir, is_cross=m.is_cross,
+                                             is_conda=m.name() == 'conda'))
                         else:
                             # When not cross-compiling, the build deps aggregate 'build' and 'host'.
                             sub_build_ms_deps.extend(host_ms_deps)
@@ -1600,11 +1741,14 @@ def build(m, stats, post=None, need_source_download=True, need_reparse_in_env=Fa
                                                     disable_pip=m.config.disable_pip,
                                                     max_env_retry=m.config.max_env_retry,
                                                     output_folder=m.config.output_folder,
-                                                    channel_urls=tuple(m.config.channel_urls))
-                        environ.create_env(m.config.build_prefix, build_actions, env='build',
-                                           config=m.config, subdir=m.config.build_subdir,
-                                           is_cross=m.is_cross,
-                                           is_conda=m.name() == 'conda')
+                                                    channel_urls=tuple(m.config.channel_urls),
+                                                    solve_cache_dir=m.config.solve_cache_dir,
+                                                    solved_envs=_solved_envs(m))
+                        envs.append(dict(prefix=m.config.build_prefix,
+                                         specs_or_actions=build_actions, env='build',
+                                         subdir=m.config.build_subdir, is_cross=m.is_cross,
+                                         is_conda=m.name() == 'conda'))
+                        environ.create_envs(envs, m.config)
 
                     to_remove = set()
                     for f in output_d.get('files', []):
@@ -1615,17 +1759,21 @@ def build(m, stats, post=None, need_source_download=True, need_reparse_in_env=Fa
                         output_d['files'] = set(output_d['files']) - to_remove
 
                     # copies the backed-up new prefix files into the newly created host env
-                    for f in new_prefix_files:
-                        utils.copy_into(os.path.join(prefix_files_backup, f),
-                                        os.path.join(m.config.host_prefix, f),
-                                        symlinks=True)
+                    start = time.time()
+                    with trace.span('restore prefix files',
+                                    **trace.file_args(new_prefix_files, prefix_files_backup)):
+                        how = utils.copy_prefix_files(prefix_files_backup, m.config.host_prefix,
+                                                      new_prefix_files)
+                    log.info("Restored %d new prefix files (%s) in %.2fs",
+                             len(new_prefix_files), how, time.time() - start)
 
                     # we must refresh the environment variables because our env for each package
                     #    can be different from the env for the top level build.
                     with utils.path_prepended(m.config.build_prefix):
                         env = environ.get_dict(m=m)
                     pkg_type = 'conda' if not hasattr(m, 'type') else m.type
-                    newly_built_packages = bundlers[pkg_type](output_d, m, env, stats)
+                    newly_built_packages = bundlers[pkg_type](output_d, m, env, stats,
+                                                              new_files_index=new_files_index)
                     # warn about overlapping files.
                     if 'checksums' in output_d:
                         for file, csum in output_d['checksums'].items():
@@ -1639,6 +1787,7 @@ def build(m, stats, post=None, need_source_download=True, need_reparse_in_env=Fa
                                                      prev_output_d['name']))
                     for built_package in newly_built_packages:
                         new_pkgs[built_package] = (output_d, m)
+                    built.add(package_key(m))
 
                     # must rebuild index because conda has no way to incrementally add our last
                     #    package to the index.
@@ -1654,6 +1803,8 @@ def build(m, stats, post=None, need_source_download=True, need_reparse_in_env=Fa
                                     output_folder=m.config.output_folder, channel_urls=m.config.channel_urls,
                                     debug=m.config.debug, verbose=m.config.verbose, locking=m.config.locking,
                                     timeout=m.config.timeout, clear_cache=True)
+        if cache_digest and new_pkgs and all(os.path.isfile(pkg) for pkg in new_pkgs):
+            cache.store(cache_digest, list(new_pkgs), dist=top_level_meta.dist())
     else:
         if not provision_only:
             print("STOPPING BUILD BEFORE POST:", m.dist())
@@ -1662,6 +1813,24 @@ def build(m, stats, post=None, need_source_download=True, need_reparse_in_env=Fa
     return new_pkgs
 
 
+def _republish_from_build_cache(cache, digest, output_metas, package_locations):
+    """Copy cached packages for a build into place, if the cache has all of them"""
+    wanted = [(output_d, om) for output_d, om in output_metas if bldpkg_path(om) in package_locations]
+    if not cache.fetch(digest, {os.path.basename(bldpkg_path(om)): bldpkg_path(om) for _, om in wanted}):
+        return {}
+    new_pkgs = {}
+    output_folders = set()
+    for output_d, om in wanted:
+        pkg_path = bldpkg_path(om)
+        print("Republished {} from build cache (inputs digest {})".format(
+            os.path.basename(pkg_path), digest))
+        output_folders.add(os.path.dirname(os.path.dirname(pkg_path)))
+        new_pkgs[pkg_path] = (output_d, om)
+    for output_folder in output_folders:
+        update_index(output_folder, verbose=output_metas[0][1].config.debug)
+    return new_pkgs
+
+
 def guess_interpreter(script_filename):
     # -l is needed for MSYS2 as the login scripts set some env. vars (TMP, TEMP)
     # Since the MSYS2 installation is probably a set of conda packages we do not
@@ -1717,8 +1886,13 @@ def _construct_metadata_for_test_from_recipe(recipe_dir, config):
     return metadata, hash_input
 
 
+# the parts of a package that testing it from the package file reads
+_package_test_members = ('info/index.json', 'info/hash_input.json', 'info/recipe',
+                         'info/recipe.tar', 'info/test')
+
+
 def _construct_metadata_for_test_from_package(package, config):
-    recipe_dir, need_cleanup = utils.get_recipe_abspath(package)
+    recipe_dir, need_cleanup = utils.get_recipe_abspath(package, members=_package_test_members)
     config.need_cleanup = need_cleanup
     config.recipe_dir = recipe_dir
     hash_input = {}
@@ -1771,8 +1945,9 @@ def _construct_metadata_for_test_from_package(package, config):
 
     local_channel = os.path.dirname(local_pkg_location)
 
-    # update indices in the channel
-    update_index(local_channel, verbose=config.debug)
+    # add just this package to the channel's index; the rest of the channel is left as it is
+    update_index_for_package(os.path.join(local_pkg_location, os.path.basename(package)),
+                             verbose=config.debug)
 
     try:
         metadata = render_recipe(os.path.join(info_dir, 'recipe'), config=config,
@@ -1899,7 +2074,7 @@ def write_build_scripts(m, script, build_file):
 
 
 def _write_test_run_script(metadata, test_run_script, test_env_script, py_files, pl_files,
-                           lua_files, r_files, shell_files, trace):
+                           lua_files, r_files, shell_files, trace_flag):
     log = utils.get_logger(__name__)
     with open(test_run_script, 'w') as tf:
         tf.write('{source} "{test_env_script}"\n'.format(
@@ -1948,12 +2123,12 @@ def _write_test_run_script(metadata, test_run_script, test_env_script, py_files,
                         log.warn("Found sh test file on windows.  Ignoring this for now (PRs welcome)")
                 elif os.path.splitext(shell_file)[1] == ".sh":
                     # TODO: Run the test/commands here instead of in run_test.py
-                    tf.write('"{shell_path}" {trace}-e "{test_file}"\n'.format(shell_path=shell_path,
-                                                                            test_file=shell_file,
-                                                                            trace=trace))
+                    tf.write('"{shell_path}" {trace_flag}-e "{test_file}"\n'.format(shell_path=shell_path,
+                                                                                 test_file=shell_file,
+                                                                                 trace_flag=trace_flag))
 
 
-def write_test_scripts(metadata, env_vars, py_files, pl_files, lua_files, r_files, shell_files, trace=""):
+def write_test_scripts(metadata, env_vars, py_files, pl_files, lua_files, r_files, shell_files, trace_flag=""):
     if not metadata.config.activate or metadata.name() == 'conda':
         # prepend bin (or Scripts) directory
         env_vars = utils.prepend_bin_path(env_vars, metadata.config.test_prefix, prepend_prefix=True)
@@ -1973,7 +2148,7 @@ def write_test_scripts(metadata, env_vars, py_files, pl_files, lua_files, r_file
 
     with open(test_env_script, 'w') as tf:
         if not utils.on_win:
-            tf.write('set {trace}-e\n'.format(trace=trace))
+            tf.write('set {trace_flag}-e\n'.format(trace_flag=trace_flag))
         if metadata.config.activate and not metadata.name() == 'conda':
             ext = ".bat" if utils.on_win else ""
             tf.write('{source} "{conda_root}activate{ext}" "{test_env}"\n'.format(
@@ -1985,10 +2160,13 @@ def write_test_scripts(metadata, env_vars, py_files, pl_files, lua_files, r_file
                 tf.write("IF %ERRORLEVEL% NEQ 0 exit 1\n")
 
     _write_test_run_script(metadata, test_run_script, test_env_script, py_files, pl_files,
-                           lua_files, r_files, shell_files, trace)
+                           lua_files, r_files, shell_files, trace_flag)
     return test_run_script, test_env_script
 
 
+@trace.traced(cat='test', args=lambda recipedir_or_package_or_metadata, *a, **kw: {
+    'package': getattr(recipedir_or_package_or_metadata, 'dist',
+                       lambda: recipedir_or_package_or_metadata)()})
 def test(recipedir_or_package_or_metadata, config, stats, move_broken=True, provision_only=False):
     '''
     Execute any test scripts for the given package.
@@ -2011,12 +2189,14 @@ def test(recipedir_or_package_or_metadata, config, stats, move_broken=True, prov
 
     if hasattr(recipedir_or_package_or_metadata, 'config'):
         metadata = recipedir_or_package_or_metadata
-        utils.rm_rf(metadata.config.test_dir)
+        trash.discard(metadata.config.test_dir, metadata.config)
     else:
         metadata, hash_input = construct_metadata_for_test(recipedir_or_package_or_metadata,
                                                                   config)
 
-    trace = '-x ' if metadata.config.debug else ''
+    trace_flag = '-x ' if metadata.config.debug else ''
+    if metadata.config.lockfile:
+        environ.load_lockfile(metadata.config.lockfile)
 
     # Must download *after* computing build id, or else computing build id will change
     #     folder destination
@@ -2095,7 +2275,7 @@ def test(recipedir_or_package_or_metadata, config, stats, move_broken=True, prov
     subdir = ('noarch' if (metadata.noarch or metadata.noarch_python)
                 else metadata.config.host_subdir)
     # ensure that the test prefix isn't kept between variants
-    utils.rm_rf(metadata.config.test_prefix)
+    trash.discard(metadata.config.test_prefix, metadata.config)
 
     try:
         actions = environ.get_install_actions(metadata.config.test_prefix,
@@ -2109,7 +2289,8 @@ def test(recipedir_or_package_or_metadata, config, stats, move_broken=True, prov
                                                 disable_pip=metadata.config.disable_pip,
                                                 max_env_retry=metadata.config.max_env_retry,
                                                 output_folder=metadata.config.output_folder,
-                                                channel_urls=tuple(metadata.config.channel_urls))
+                                                channel_urls=tuple(metadata.config.channel_urls),
+                                                solve_cache_dir=metadata.config.solve_cache_dir)
     except (DependencyNeedsBuildingError, NoPackagesFoundError, UnsatisfiableError,
             CondaError, AssertionError) as exc:
         log.warn("failed to get install actions, retrying.  exception was: %s",
@@ -2124,7 +2305,7 @@ def test(recipedir_or_package_or_metadata, config, stats, move_broken=True, prov
     with env_var('CONDA_PATH_CONFLICT', conflict_verbosity, reset_context):
         environ.create_env(metadata.config.test_prefix, actions, config=metadata.config,
                            env='host', subdir=subdir, is_cross=metadata.is_cross,
-                           is_conda=metadata.name() == 'conda')
+                           is_conda=metadata.name() == 'conda', layer=(metadata.name(),))
 
     with utils.path_prepended(metadata.config.test_prefix):
         env = dict(os.environ.copy())
@@ -2140,7 +2321,7 @@ def test(recipedir_or_package_or_metadata, config, stats, move_broken=True, prov
     if metadata.config.remove_work_dir:
         env['SRC_DIR'] = metadata.config.test_dir
 
-    test_script, _ = write_test_scripts(metadata, env, py_files, pl_files, lua_files, r_files, shell_files, trace)
+    test_script, _ = write_test_scripts(metadata, env, py_files, pl_files, lua_files, r_files, shell_files, trace_flag)
 
     if utils.on_win:
         cmd = [os.environ.get('COMSPEC', 'cmd.exe'), "/d", "/c", test_script]
@@ -2161,7 +2342,9 @@ def test(recipedir_or_package_or_metadata, config, stats, move_broken=True, prov
                     for k, v in rewrite_env.items():
                         print('{0} {1}={2}'
                             .format('set' if test_script.endswith('.bat') else 'export', k, v))
-            utils.check_call_env(cmd, env=env, cwd=metadata.config.test_dir, stats=test_stats, rewrite_stdout_env=rewrite_env)
+            with trace.span('test script', cat='script'):
+                utils.check_call_env(cmd, env=env, cwd=metadata.config.test_dir, stats=test_stats,
+                                     rewrite_stdout_env=rewrite_env)
             log_stats(test_stats, "testing {}".format(metadata.name()))
             if stats is not None and metadata.config.variants:
                 stats[stats_key(metadata, 'test_{}'.format(metadata.name()))] = test_stats
@@ -2205,6 +2388,114 @@ def tests_failed(package_or_metadata, move_broken, broken_dir, config):
     sys.exit("TESTS FAILED: " + os.path.basename(pkg))
 
 
+def _test_in_worker(package, config, log_file, cpus, move_broken, tracing=False):
+    """Run ``test`` for one package in a test_packages worker process, logging to log_file.
+
+    With tracing, the spans of the test are returned too, for the parent's trace.
+    """
+    # CPU_COUNT is what build scripts and tests are expected to size their parallelism by
+    os.environ['CPU_COUNT'] = str(cpus)
+    stats = {}
+    events = [] if tracing else None
+    passed = True
+    start = time.time()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved_fds = os.dup(1), os.dup(2)
+    # redirect the file descriptors, not just sys.stdout, so that subprocess output is captured
+    with open(log_file, 'w') as log:
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+        try:
+            with trace.collect(events, name='test worker'):
+                test(package, config=config, stats=stats, move_broken=move_broken)
+        except (SystemExit, subprocess.CalledProcessError):
+            # failed tests; anything else is a bug and goes back to the parent as such
+            traceback.print_exc()
+            passed = False
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            for fd, saved in zip((1, 2), saved_fds):
+                os.dup2(saved, fd)
+                os.close(saved)
+    # span arguments can be anything; make them what the trace file would hold, so they pickle
+    return passed, time.time() - start, stats, json.loads(json.dumps(events or [], default=str))
+
+
+@trace.traced(cat='test', args=lambda packages, *a, **kw: {'packages': len(packages)})
+def test_packages(packages, config, stats, move_broken=True):
+    """Test several packages (or recipes), up to ``config.test_workers`` at a time.
+
+    Each package is tested in its own worker process with its own build id, and so its own test
+    prefix.  The output of each test goes to a log file under ``<croot>/test_logs`` and a
+    summary is printed at the end.  Workers get ``config.test_cpus`` CPUs each (as CPU_COUNT),
+    or an even share of the machine by default.
+
+    Test failures do not stop the other tests; any other error is raised.  Returns an ordered dict
+    mapping each package to a dict with 'passed', 'elapsed' (seconds) and 'log' (None when tests
+    ran in this process).
+    """
+    results = OrderedDict()
+    workers = min(config.test_workers or 1, len(packages))
+    if workers <= 1:
+        for package in packages:
+            start = time.time()
+            try:
+                passed = test(package, config=config.copy(), stats=stats, move_broken=move_broken)
+            except (SystemExit, subprocess.CalledProcessError):
+                traceback.print_exc()
+                passed = False
+            results[package] = {'passed': bool(passed), 'elapsed': time.time() - start,
+                                'log': None}
+        return results
+
+    cpus = int(config.test_cpus or max(1, multiprocessing.cpu_count() // workers))
+    log_dir = os.path.join(config.croot, 'test_logs')
+    if not os.path.isdir(log_dir):
+        os.makedirs(log_dir)
+    futures = OrderedDict()
+    id_base = int(time.time() * 1000)
+    with ProcessPoolExecutor(workers) as executor:
+        for n, package in enumerate(packages):
+            name = os.path.basename(package.rstrip('/\\'))
+            if name.endswith(CONDA_TARBALL_EXTENSIONS):
+                name = name.rsplit('-', 2)[0]
+            worker_config = config.copy()
+            # keep the usual <name>_<timestamp> shape, but make sure no two workers share one
+            worker_config.build_id = '{}_{}'.format(name, id_base + n)
+            worker_config.test_workers = 1
+            log_file = os.path.join(log_dir, worker_config.build_id + '.log')
+            futures[package] = (executor.submit(_test_in_worker, package, worker_config,
+                                                log_file, cpus, move_broken,
+                                                trace.recording()), log_file)
+            print("TEST QUEUED:", package)
+        for package, (future, log_file) in futures.items():
+            try:
+                passed, elapsed, test_stats, events = future.result()
+            except BrokenProcessPool as e:
+                # the worker itself died
+                with open(log_file, 'a') as f:
+                    f.write("\nTest worker failed: {}\n".format(e))
+                passed, elapsed, test_stats, events = False, 0.0, {}, []
+            stats.update(test_stats)
+            trace.merge(events)
+            stats['test_run_{}'.format(os.path.basename(package))] = {
+                'elapsed': elapsed, 'passed': passed, 'log': log_file}
+            results[package] = {'passed': passed, 'elapsed': elapsed, 'log': log_file}
+            print("TEST {}:".format('PASSED' if passed else 'FAILED'), package)
+
+    print('#' * 84)
+    print("Test summary ({} workers, {} CPUs each):".format(workers, cpus))
+    for package, result in results.items():
+        print("  {:6}  {:>8}  {}".format('passed' if result['passed'] else 'FAILED',
+                                         seconds_to_text(result['elapsed']),
+                                         os.path.basename(package)))
+        if not result['passed']:
+            print("          log: {}".format(result['log']))
+    return results
+
+
 def check_external():
     if sys.platform.startswith('linux'):
         patchelf = external.find_executable('patchelf')
@@ -2221,6 +2512,12 @@ Error:
 def build_tree(recipe_list, config, stats, build_only=False, post=False, notest=False,
                need_source_download=True, need_reparse_in_env=False, variants=None):
 
+    if config.trace_file and not trace.recording():
+        with trace.record(config.trace_file):
+            return build_tree(recipe_list, config, stats, build_only=build_only, post=post,
+                              notest=notest, need_source_download=need_source_download,
+                              need_reparse_in_env=need_reparse_in_env, variants=variants)
+
     to_build_recursive = []
     recipe_list = deque(recipe_list)
 
@@ -2237,6 +2534,11 @@ def build_tree(recipe_list, config, stats, build_only=False, post=False, notest=
     retried_recipes = []
     initial_time = time.time()
     stats_file = config.stats_file
+    if config.lockfile:
+        environ.load_lockfile(config.lockfile)
+    journal = build_journal.get_build_journal(config, list(recipe_list), variants)
+    # packages that the run being resumed had already finished
+    resumed_packages = []
 
     # this is primarily for exception handling.  It's OK that it gets clobbered by
     #     the loop below.
@@ -2257,6 +2559,7 @@ def build_tree(recipe_list, config, stats, build_only=False, post=False, notest=
         try:
             recipe = recipe_list.popleft()
             name = recipe.name() if hasattr(recipe, 'name') else recipe
+            journal_key = None
             if hasattr(recipe, 'config'):
                 metadata = recipe
                 metadata.config.anaconda_upload = config.anaconda_upload
@@ -2274,35 +2577,64 @@ def build_tree(recipe_list, config, stats, build_only=False, post=False, notest=
 
                     # This is where reparsing happens - we need to re-evaluate the meta.yaml for any
                     #    jinja2 templating
-                    metadata_tuples = distribute_variants(metadata, variants_,
-                                                        permit_unsatisfiable_variants=False)
+                    with trace.span('render', recipe=metadata.path) as span_args:
+                        metadata_tuples = distribute_variants(metadata, variants_,
+                                                            permit_unsatisfiable_variants=False)
+                        span_args['variants'] = len(metadata_tuples)
                 else:
                     metadata_tuples = ((metadata, False, False), )
             else:
                 recipe_parent_dir = os.path.dirname(recipe)
                 recipe = recipe.rstrip("/").rstrip("\\")
                 to_build_recursive.append(os.path.basename(recipe))
+                if journal:
+                    journal_key = os.path.abspath(recipe)
+                    finished = journal.finished_recipe(journal_key)
+                    if finished is not None:
+                        print("Skipping {}: finished by the run being resumed".format(recipe))
+                        resumed_packages.extend(finished)
+                        continue
 
                 # each tuple is:
                 #    metadata, need_source_download, need_reparse_in_env =
                 # We get one tuple per variant
-                metadata_tuples = render_recipe(recipe, config=config, variants=variants,
-                                                permit_unsatisfiable_variants=False,
-                                                reset_build_id=not config.dirty,
-                                                bypass_env_check=True)
+                with trace.span('render', recipe=recipe) as span_args:
+                    metadata_tuples = render_recipe(recipe, config=config, variants=variants,
+                                                    permit_unsatisfiable_variants=False,
+                                                    reset_build_id=not config.dirty,
+                                                    bypass_env_check=True)
+                    span_args['variants'] = len(metadata_tuples)
             # restrict to building only one variant for bdist_conda.  The way it splits the build
             #    job breaks variants horribly.
             if post in (True, False):
                 metadata_tuples = metadata_tuples[:1]
+            if journal_key:
+                journal.rendered(journal_key, [build_journal.variant_key(m)
+                                               for m, _, _ in metadata_tuples])
+            built = None
+            if config.skip_existing and post is not True:
+                # one lookup for the outputs of every variant, rather than one per variant
+                with trace.span('check existing', recipe=name) as span_args:
+                    outputs = [om for _, om in expand_outputs(metadata_tuples) if not om.skip()]
+                    span_args['outputs'] = len(outputs)
+                    built = find_built_packages(outputs, 'host')
 
             # This is the "TOP LEVEL" loop. Only vars used in the top-level
             # recipe are looped over here.
 
             for (metadata, need_source_download, need_reparse_in_env) in metadata_tuples:
+                variant_key = journal_key and build_journal.variant_key(metadata)
+                if variant_key:
+                    finished = journal.finished_variant(journal_key, variant_key)
+                    if finished is not None:
+                        print("Skipping {}: finished by the run being resumed".format(
+                            ', '.join(os.path.basename(pkg) for pkg in finished)))
+                        resumed_packages.extend(finished)
+                        continue
                 if post is None:
-                    utils.rm_rf(metadata.config.host_prefix)
-                    utils.rm_rf(metadata.config.build_prefix)
-                    utils.rm_rf(metadata.config.test_prefix)
+                    trash.discard(metadata.config.host_prefix, metadata.config)
+                    trash.discard(metadata.config.build_prefix, metadata.config)
+                    trash.discard(metadata.config.test_prefix, metadata.config)
                 if metadata.name() not in metadata.config.build_folder:
                     metadata.config.compute_build_id(metadata.name(), reset=True)
 
@@ -2312,11 +2644,21 @@ def build_tree(recipe_list, config, stats, build_only=False, post=False, notest=
                                            need_reparse_in_env=need_reparse_in_env,
                                            built_packages=built_packages,
                                            notest=notest,
+                                           built=built,
                                            )
                 if not notest:
+                    # we only know how to test conda packages
+                    to_test = [pkg for pkg in packages_from_this
+                               if pkg.endswith(CONDA_TARBALL_EXTENSIONS) and os.path.isfile(pkg)]
+                    if metadata.config.test_workers > 1 and len(to_test) > 1:
+                        results = test_packages(to_test, metadata.config, stats)
+                        failed = [pkg for pkg, result in results.items() if not result['passed']]
+                        if failed:
+                            sys.exit("TESTS FAILED: " +
+                                     ", ".join(os.path.basename(pkg) for pkg in failed))
+                        to_test = []
                     for pkg, dict_and_meta in packages_from_this.items():
-                        if pkg.endswith(CONDA_TARBALL_EXTENSIONS) and os.path.isfile(pkg):
-                            # we only know how to test conda packages
+                        if pkg in to_test:
                             test(pkg, config=metadata.config.copy(), stats=stats)
                         _, meta = dict_and_meta
                         downstreams = meta.meta.get('test', {}).get('downstreams')
@@ -2364,6 +2706,8 @@ def build_tree(recipe_list, config, stats, build_only=False, post=False, notest=
                         built_packages.update({pkg: dict_and_meta})
                 else:
                     built_packages.update(packages_from_this)
+                if variant_key:
+                    journal.variant_done(journal_key, variant_key, packages_from_this.keys())
 
                 if (os.path.exists(metadata.config.work_dir) and not
                         (metadata.config.dirty or metadata.config.keep_old_work or
@@ -2384,6 +2728,8 @@ def build_tree(recipe_list, config, stats, build_only=False, post=False, notest=
             # each metadata element here comes from one recipe, thus it will share one build id
             #    cleaning on the last metadata in the loop should take care of all of the stuff.
             metadata.clean()
+            if journal_key:
+                journal.recipe_done(journal_key)
         except DependencyNeedsBuildingError as e:
             skip_names = ['python', 'r', 'r-base', 'mro-base', 'perl', 'lua']
             built_package_paths = [entry[1][1].path for entry in built_packages.items()]
@@ -2447,33 +2793,78 @@ for Python 3.5 and needs to be rebuilt."""
 
     if post in [True, None]:
         # TODO: could probably use a better check for pkg type than this...
-        tarballs = [f for f in built_packages if f.endswith(CONDA_TARBALL_EXTENSIONS)]
-        wheels = [f for f in built_packages if f.endswith('.whl')]
-        handle_anaconda_upload(tarballs, config=config)
-        handle_pypi_upload(wheels, config=config)
+        packages = resumed_packages + list(built_packages)
+        tarballs = [f for f in packages if f.endswith(CONDA_TARBALL_EXTENSIONS)]
+        wheels = [f for f in packages if f.endswith('.whl')]
+        with trace.span('upload', packages=len(tarballs) + len(wheels)):
+            handle_anaconda_upload(tarballs, config=config)
+            handle_pypi_upload(wheels, config=config)
+    if journal:
+        # the run is complete; there is nothing left to resume
+        journal.remove()
 
     total_time = time.time() - initial_time
-    max_memory_used = max([step.get('rss') for step in stats.values()] or [0])
-    total_disk = sum([step.get('disk') for step in stats.values()] or [0])
-    total_cpu_sys = sum([step.get('cpu_sys') for step in stats.values()] or [0])
-    total_cpu_user = sum([step.get('cpu_user') for step in stats.values()] or [0])
+    # not every step measures everything (e.g. creating environments is only timed)
+    max_memory_used = max([step.get('rss') or 0 for step in stats.values()] or [0])
+    total_disk = sum([step.get('disk') or 0 for step in stats.values()] or [0])
+    total_cpu_sys = sum([step.get('cpu_sys') or 0 for step in stats.values()] or [0])
+    total_cpu_user = sum([step.get('cpu_user') or 0 for step in stats.values()] or [0])
 
     print('#' * 84)
     print("Resource usage summary:")
     print("\nTotal time: {}".format(seconds_to_text(total_time)))
     print("CPU usage: sys={}, user={}".format(seconds_to_text(total_cpu_sys),
                                               seconds_to_text(total_cpu_user)))
+    cpu_by_name = {}
+    for step in stats.values():
+        for name, cpu in (step.get('cpu_by_name') or {}).items():
+            cpu_by_name[name] = cpu_by_name.get(name, 0) + cpu['user'] + cpu['sys']
+    if cpu_by_name:
+        print("CPU usage by process: {}".format(', '.join(
+            '{}={}'.format(name, seconds_to_text(seconds)) for name, seconds in
+            sorted(cpu_by_name.items(), key=lambda item: -item[1])[:5])))
     print("Maximum memory usage observed: {}".format(utils.bytes2human(max_memory_used)))
     print("Total disk usage observed (not including envs): {}".format(
         utils.bytes2human(total_disk)))
     stats['total'] = {'time': total_time,
                       'memory': max_memory_used,
                       'disk': total_disk}
+    cache = build_cache.get_build_cache(config)
+    if cache:
+        cache_summary = cache.summary()
+        print("Build cache: {hits} hits, {misses} misses, {stored} stored, {evicted} evicted"
+              .format(**cache_summary))
+        stats['total']['build_cache'] = cache_summary
+    templates = env_templates.get_template_cache(config)
+    if templates:
+        templates_summary = templates.summary()
+        print("Env templates: {hits} cloned, {misses} created, {evicted} evicted "
+              "({clone_time:.1f}s cloning, {create_time:.1f}s linking)".format(**templates_summary))
+        stats['total']['env_templates'] = templates_summary
+    test_env_pool = env_templates.get_test_env_pool(config)
+    if test_env_pool and test_env_pool is not templates:
+        pool_summary = test_env_pool.summary()
+        print("Test env pool: {hits} reused, {misses} created, {evicted} evicted "
+              "({clone_time:.1f}s cloning, {layer_time:.1f}s linking tested packages)".format(
+                  **pool_summary))
+        stats['total']['test_env_pool'] = pool_summary
+    background = trash.get_trash(config)
+    if background and (background.discarded or background.fallbacks):
+        trash_summary = background.summary()
+        print("Background deletion: {discarded} folders moved to the trash in "
+              "{rename_time:.1f}s, {pending} still being deleted, {fallbacks} deleted in place"
+              .format(**trash_summary))
+        stats['total']['background_delete'] = trash_summary
     if stats_file:
         with open(stats_file, 'w') as f:
             json.dump(stats, f)
+    try:
+        stats_history.record(stats_history.history_path(config), stats)
+    except (EnvironmentError, stats_history.HistoryError) as e:
+        log = utils.get_logger(__name__)
+        log.warn("Could not record build stats in the stats history: %s", e)
 
-    return list(built_packages.keys())
+    return resumed_packages + list(built_packages.keys())
 
 
 def handle_anaconda_upload(paths, config):
@@ -2583,27 +2974,115 @@ def clean_build(config, folders=None):
         utils.rm_rf(folder)
 
 
-def is_package_built(metadata, env, include_local=True):
-    for d in metadata.config.bldpkgs_dirs:
+def package_key(metadata):
+    """The (name, version, build string) that identifies the package of an output"""
+    return metadata.name(), metadata.version(), metadata.build_id()
+
+
+def find_built_packages(metadata_list, env, include_local=True):
+    """Return the package_key of each of metadata_list that is already built.
+
+    Looks in the local output folders (when include_local) and the configured channels.  Each
+    index is loaded once for all of the outputs, rather than once per output.
+    """
+    metadata_list = list(metadata_list)
+    if not metadata_list:
+        return set()
+    bldpkgs_dirs = set()
+    for metadata in metadata_list:
+        bldpkgs_dirs.update(metadata.config.bldpkgs_dirs)
+    for d in sorted(bldpkgs_dirs):
         if not os.path.isdir(d):
             os.makedirs(d)
-        update_index(d, verbose=metadata.config.debug, warn=False)
-    subdir = getattr(metadata.config, '{}_subdir'.format(env))
+        update_index(d, verbose=metadata_list[0].config.debug, warn=False)
+
+    # outputs looking in the same channels for the same subdir share one lookup
+    groups = OrderedDict()
+    for metadata in metadata_list:
+        subdir = getattr(metadata.config, '{}_subdir'.format(env))
+        urls = [url_path(metadata.config.output_folder), 'local'] if include_local else []
+        urls += get_rc_urls()
+        if metadata.config.channel_urls:
+            urls.extend(metadata.config.channel_urls)
+        groups.setdefault((subdir, tuple(urls)), []).append(metadata)
+
+    built = set()
+    for (subdir, urls), group in groups.items():
+        wanted = set(package_key(metadata) for metadata in group)
+        if conda_45:
+            from conda.api import SubdirData
+            for name in sorted(set(key[0] for key in wanted)):
+                built.update(wanted.intersection(
+                    (prec.name, prec.version, prec.build) for prec in
+                    SubdirData.query_all(name, channels=urls, subdirs=(subdir, "noarch"))))
+        else:
+            config = group[0].config
+            index, _, _ = get_build_index(subdir=subdir, bldpkgs_dir=config.bldpkgs_dir,
+                                          output_folder=config.output_folder,
+                                          channel_urls=list(urls), debug=config.debug,
+                                          verbose=config.verbose, locking=config.locking,
+                                          timeout=config.timeout, clear_cache=True)
+            built.update(wanted.intersection(
+                (prec.name, prec.version, prec.build) for prec in index.values()))
+    return built
 
-    urls = [url_path(metadata.config.output_folder), 'local'] if include_local else []
-    urls += get_rc_urls()
-    if metadata.config.channel_urls:
-        urls.extend(metadata.config.channel_urls)
 
-    spec = MatchSpec(name=metadata.name(), version=metadata.version(), build=metadata.build_id())
+def is_package_built(metadata, env, include_local=True):
+    return bool(find_built_packages([metadata], env, include_local=include_local))
+
+
+def plan_output(metadata, history, built=None):
+    """Describe the work that building one output would take, for ``api.plan``.
+
+    The result says whether the output would be skipped (by the recipe, or because
+    --skip-existing finds it already built), the requirements of each environment it needs and
+    estimates of each phase taken from the stats history.  built is the result of
+    find_built_packages for a batch of outputs including this one, if already known.
+    """
+    m = metadata
+    plan = OrderedDict([('name', m.name()),
+                        ('version', m.version()),
+                        ('build_string', m.build_id()),
+                        ('subdir', 'noarch' if m.noarch or m.noarch_python
+                         else m.config.host_subdir),
+                        ('path', bldpkg_path(m)),
+                        ('recipe', m.path or None),
+                        ('variant', {var: m.config.variant.get(var)
+                                     for var in sorted(m.get_used_vars())})])
+    if m.skip():
+        plan['skip'] = 'recipe'
+    elif m.config.skip_existing and (package_key(m) in built if built is not None
+                                     else is_package_built(m, 'host')):
+        plan['skip'] = 'existing'
+    else:
+        plan['skip'] = None
 
-    if conda_45:
-        from conda.api import SubdirData
-        return bool(SubdirData.query_all(spec, channels=urls, subdirs=(subdir, "noarch")))
+    build_reqs = list(m.get_value('requirements/build', []))
+    host_reqs = list(m.get_value('requirements/host', []))
+    envs = OrderedDict()
+    if m.build_is_host:
+        envs['build'] = build_reqs + host_reqs
+    else:
+        envs['build'] = build_reqs
+        envs['host'] = host_reqs
+    envs['test'] = (['{} {} {}'.format(m.name(), m.version(), m.build_id())] +
+                    list(m.get_value('requirements/run', [])) +
+                    list(m.get_value('test/requires', [])))
+    plan['environments'] = envs
+
+    name = m.name()
+    recipe_name = m.meta.get('extra', {}).get('parent_recipe', {}).get('name') or name
+    phases = OrderedDict()
+    for phase, desc, recipe in (('create_envs', 'create_envs', True),
+                                ('build', 'build', True),
+                                ('bundle', 'bundle_{}'.format(name), False),
+                                ('test', 'test_{}'.format(name), False)):
+        fallback = '{}{}-'.format(desc, recipe_name if recipe else name)
+        phases[phase] = history.estimate(stats_key(m, desc, recipe=recipe), fallback)
+    plan['estimates'] = phases
+    known = [phase['elapsed'] for phase in phases.values() if phase and phase['elapsed']]
+    if plan['skip']:
+        plan['estimated_time'] = 0
     else:
-        index, _, _ = get_build_index(subdir=subdir, bldpkgs_dir=metadata.config.bldpkgs_dir,
-                                      output_folder=metadata.config.output_folder, channel_urls=urls,
-                                      debug=metadata.config.debug, verbose=metadata.config.verbose,
-                                      locking=metadata.config.locking, timeout=metadata.config.timeout,
-                                      clear_cache=True)
-        return any(spec.match(prec) for prec in index.values())
+        plan['estimated_time'] = round(sum(known), 1) if known else None
+    return plan
@@ -0,0 +1,306 @@
+'''
+Content-addressed cache of build results.
+
+Entries are keyed by a digest of everything that goes into a build: the hash contents and
+rendered metadata of each output, the raw recipe files, the content of the sources and the
+packages resolved for the build and host environments.  When a build with the same digest has
+been done before, the packages can be republished from the cache instead of being rebuilt.
+
+The content of a source must be known before it is fetched: url sources need a checksum, git
+sources a full commit hash as git_rev, and the files of path sources are hashed.  Recipes with
+other sources (a git branch or tag, hg, svn) are not cached.
+
+The cache lives in a local folder laid out as::
+
+    <root>/<digest[:2]>/<digest>/entry.json
+    <root>/<digest[:2]>/<digest>/<package filename>
+
+The same layout may also be served read-only over HTTP (``python -m http.server`` in the
+cache folder is enough); entries found there are pulled into the local folder on first use.
+'''
+from __future__ import absolute_import, division, print_function
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+
+from .conda_interface import CondaHTTPError, TemporaryDirectory, download
+from conda_build import __version__, utils
+
+ENTRY_FILE = 'entry.json'
+
+_GIT_SHA = re.compile(r'^[0-9a-fA-F]{40}$')
+
+_size_suffixes = {'': 1, 'b': 1, 'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30, 't': 1 << 40}
+
+
+def parse_size(size):
+    """Turn a size like 2048, '500M' or '20G' into a number of bytes"""
+    if not size:
+        return None
+    if isinstance(size, (int, float)):
+        return int(size)
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([bkmgt]?)i?b?\s*$', str(size).lower())
+    if not match:
+        raise ValueError("Could not understand build cache size {}".format(size))
+    number, suffix = match.groups()
+    return int(float(number) * _size_suffixes[suffix])
+
+
+def _hash_files(folder):
+    hashes = {}
+    if not folder or not os.path.isdir(folder):
+        return hashes
+    for root, dirs, files in os.walk(folder):
+        dirs[:] = sorted(d for d in dirs if d not in ('.git', '__pycache__'))
+        for fn in sorted(files):
+            path = os.path.join(root, fn)
+            if os.path.islink(path) or not os.path.isfile(path):
+                continue
+            hashes[os.path.relpath(path, folder).replace('\\', '/')] = \
+                utils.sha256_checksum(path)
+    return hashes
+
+
+def _pinned_sources(m):
+    """What pins down the content of each source of m, or None if a source can't be pinned
+    down before it is fetched"""
+    pinned = []
+    for source in utils.ensure_list(m.get_section('source')):
+        if not source:
+            continue
+        if 'url' in source:
+            if not any(source.get(checksum) for checksum in ('sha256', 'sha1', 'md5')):
+                return None
+            pinned.append(source)
+        elif 'git_url' in source:
+            # a branch or a tag can move
+            if not _GIT_SHA.match(str(source.get('git_rev', ''))):
+                return None
+            pinned.append(source)
+        elif 'path' in source:
+            path = os.path.normpath(os.path.join(m.path, source['path']))
+            pinned.append(dict(source, files=_hash_files(path)))
+        else:
+            return None
+    return pinned
+
+
+def _link_dists(actions):
+    if not actions:
+        return []
+    return sorted(str(dist) for dist in actions.get('LINK', []))
+
+
+def input_digest(m, outputs, build_actions=None, host_actions=None):
+    """Compute the build cache key for top-level metadata ``m``.
+
+    ``outputs`` is the list of (output dict, metadata) tuples that the build will produce.
+    ``build_actions`` and ``host_actions`` are the solved install actions for the build and
+    host environments; their LINK lists pin the digest to the exact packages used.  Returns
+    None if the sources of ``m`` can't be pinned down (see the module docstring).
+    """
+    sources = _pinned_sources(m)
+    if sources is None:
+        return None
+    contents = {
+        'conda_build': __version__,
+        'subdir': m.config.host_subdir,
+        'hash_contents': m.get_hash_contents(),
+        'sources': sources,
+        'recipe_files': _hash_files(m.path),
+        'build_env': _link_dists(build_actions),
+        'host_env': _link_dists(host_actions),
+        'outputs': [{'dist': om.dist(),
+                     'hash_contents': om.get_hash_contents(),
+                     'meta': om.meta}
+                    for _, om in outputs],
+    }
+    blob = json.dumps(contents, sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+
+class BuildCache(object):
+    """A local folder of built packages, keyed by ``input_digest``.
+
+    ``url`` optionally points at an HTTP server exposing the same layout, consulted when an
+    entry is not available locally.  ``max_size`` (bytes) and ``max_age`` (days since last use)
+    bound the local folder; least recently used entries are evicted first.
+    """
+    def __init__(self, root, url=None, max_size=None, max_age=None, locking=True, timeout=900):
+        self.root = os.path.abspath(os.path.expanduser(root))
+        self.url = url.rstrip('/') if url else None
+        self.max_size = parse_size(max_size)
+        self.max_age = float(max_age) if max_age else None
+        self.locking = locking
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.evicted = 0
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+
+    def _entry_dir(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def _locks(self):
+        return [utils.get_lock(self.root, timeout=self.timeout)] if self.locking else []
+
+    def _read_entry(self, entry_dir):
+        try:
+            with open(os.path.join(entry_dir, ENTRY_FILE)) as f:
+                entry = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if not all(os.path.isfile(os.path.join(entry_dir, fn)) for fn in entry.get('files', [])):
+            return None
+        return entry
+
+    def _fetch_remote(self, digest):
+        if not self.url:
+            return None
+        remote = '/'.join((self.url, digest[:2], digest))
+        log = utils.get_logger(__name__)
+        with TemporaryDirectory(dir=self.root) as tmp:
+            try:
+                download('/'.join((remote, ENTRY_FILE)), os.path.join(tmp, ENTRY_FILE))
+                with open(os.path.join(tmp, ENTRY_FILE)) as f:
+                    entry = json.load(f)
+                for fn in entry.get('files', []):
+                    download('/'.join((remote, fn)), os.path.join(tmp, fn))
+            except (CondaHTTPError, RuntimeError, ValueError) as e:
+                log.debug("build cache entry %s not available from %s: %s", digest, self.url, e)
+                return None
+            entry_dir = self._entry_dir(digest)
+            with utils.try_acquire_locks(self._locks(), self.timeout):
+                if not os.path.isdir(entry_dir):
+                    utils.copy_into(tmp, entry_dir, self.timeout, locking=False)
+        return self._read_entry(entry_dir)
+
+    def fetch(self, digest, destinations=None):
+        """Return a dict mapping package filename to its path in the cache, or None on a miss.
+
+        ``destinations`` maps package filenames to the paths they should be copied to.  The copies
+        are made with the cache locked, so that another process can't evict the entry halfway; it
+        is a miss if any of them is missing from the entry.  The returned paths are not protected
+        that way.
+        """
+        destinations = destinations or {}
+        entry_dir = self._entry_dir(digest)
+        if not self._read_entry(entry_dir):
+            self._fetch_remote(digest)
+        with utils.try_acquire_locks(self._locks(), self.timeout):
+            entry = self._read_entry(entry_dir)
+            if entry and all(fn in entry['files'] for fn in destinations):
+                # the entry file's mtime records the last use, which drives eviction
+                os.utime(os.path.join(entry_dir, ENTRY_FILE), None)
+                for fn, dest in destinations.items():
+                    utils.copy_into(os.path.join(entry_dir, fn), dest, self.timeout, locking=False)
+            else:
+                entry = None
+        if not entry:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return {fn: os.path.join(entry_dir, fn) for fn in entry['files']}
+
+    def store(self, digest, paths, dist=None):
+        """Add the packages at ``paths`` to the cache under ``digest``"""
+        entry_dir = self._entry_dir(digest)
+        if self._read_entry(entry_dir):
+            return
+        parent = os.path.dirname(entry_dir)
+        if not os.path.isdir(parent):
+            try:
+                os.makedirs(parent)
+            except OSError:
+                pass
+        # populate a sibling folder first so that readers never see a partial entry
+        tmp = tempfile.mkdtemp(prefix='.tmp_', dir=parent)
+        try:
+            for path in paths:
+                shutil.copy2(path, os.path.join(tmp, os.path.basename(path)))
+            with open(os.path.join(tmp, ENTRY_FILE), 'w') as f:
+                json.dump({'digest': digest,
+                           'dist': dist,
+                           'files': sorted(os.path.basename(path) for path in paths),
+                           'created': time.time()}, f, indent=2, sort_keys=True)
+            with utils.try_acquire_locks(self._locks(), self.timeout):
+                if os.path.isdir(entry_dir):
+                    utils.rm_rf(entry_dir)
+                os.rename(tmp, entry_dir)
+        finally:
+            if os.path.isdir(tmp):
+                utils.rm_rf(tmp)
+        self.stored += 1
+        self.evict()
+
+    def entries(self):
+        """List (last use, size, path) for each entry in the local cache"""
+        entries = []
+        for prefix in os.listdir(self.root):
+            prefix_dir = os.path.join(self.root, prefix)
+            if len(prefix) != 2 or not os.path.isdir(prefix_dir):
+                continue
+            for digest in os.listdir(prefix_dir):
+                entry_dir = os.path.join(prefix_dir, digest)
+                entry_file = os.path.join(entry_dir, ENTRY_FILE)
+                if digest.startswith('.tmp_') or not os.path.isfile(entry_file):
+                    continue
+                size = sum(os.path.getsize(os.path.join(entry_dir, fn))
+                           for fn in os.listdir(entry_dir))
+                entries.append((os.path.getmtime(entry_file), size, entry_dir))
+        return sorted(entries)
+
+    def evict(self):
+        """Drop entries unused for longer than max_age, then the oldest ones over max_size"""
+        if not self.max_size and not self.max_age:
+            return
+        with utils.try_acquire_locks(self._locks(), self.timeout):
+            entries = self.entries()
+            now = time.time()
+            keep = []
+            for last_use, size, entry_dir in entries:
+                if self.max_age and now - last_use > self.max_age * 86400:
+                    utils.rm_rf(entry_dir)
+                    self.evicted += 1
+                else:
+                    keep.append((last_use, size, entry_dir))
+            if self.max_size:
+                total = sum(size for _, size, _ in keep)
+                for _, size, entry_dir in keep:
+                    if total <= self.max_size:
+                        break
+                    utils.rm_rf(entry_dir)
+                    total -= size
+                    self.evicted += 1
+
+    def summary(self):
+        return {'hits': self.hits, 'misses': self.misses, 'stored': self.stored,
+                'evicted': self.evicted}
+
+
+_caches = {}
+
+
+def get_build_cache(config):
+    """Return the BuildCache configured for ``config``, or None when caching is off.
+
+    Instances are shared for the lifetime of the process so that hit/miss counts add up over
+    all of the recipes in a build_tree run.
+    """
+    root = getattr(config, 'build_cache_dir', None)
+    if not root:
+        return None
+    key = (os.path.abspath(os.path.expanduser(root)), config.build_cache_url)
+    if key not in _caches:
+        _caches[key] = BuildCache(root, url=config.build_cache_url,
+                                  max_size=config.build_cache_max_size,
+                                  max_age=config.build_cache_max_age,
+                                  locking=config.locking, timeout=config.timeout)
+    return _caches[key]
@@ -0,0 +1,114 @@
+'''
+Checkpoint journal of a build_tree run, so that an interrupted run can be resumed.
+
+The journal of a run is ``<croot>/build_journals/<digest>.json``, where the digest is taken
+from the list of recipes and the variants passed in; another run of the same recipes finds it
+again.  For each recipe it records the variants that rendering produced and, as each one
+finishes (built and tested), the packages it made::
+
+    {"recipes": {"/path/to/recipe": {"variants": {"<variant key>": ["<package>", ...],
+                                                  "<variant key>": null},
+                                     "done": false}}}
+
+With ``--resume``, recipes that are done, and whose packages are all still there, are skipped
+without being rendered again; a recipe that was cut short is rendered and only its unfinished
+variants are built.  The journal is removed once the run completes.
+'''
+from __future__ import absolute_import, division, print_function
+
+import hashlib
+import json
+import os
+
+from conda_build import utils
+
+JOURNAL_DIR = 'build_journals'
+
+
+def variant_key(metadata):
+    """Identify a top-level variant of a recipe by the values of the variables it loops over"""
+    return json.dumps(sorted((var, str(metadata.config.variant.get(var)))
+                             for var in metadata.get_used_loop_vars()))
+
+
+def _packages_present(packages):
+    return packages is not None and all(os.path.isfile(pkg) for pkg in packages)
+
+
+class BuildJournal(object):
+    def __init__(self, path):
+        self.path = path
+        self.recipes = {}
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                self.recipes = json.load(f)['recipes']
+        except (IOError, OSError, ValueError, KeyError):
+            self.recipes = {}
+        return bool(self.recipes)
+
+    def _write(self):
+        dirname = os.path.dirname(self.path)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        tmp = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump({'recipes': self.recipes}, f, indent=2, sort_keys=True)
+        try:
+            os.rename(tmp, self.path)
+        except OSError:
+            # windows won't rename over an existing file
+            utils.rm_rf(self.path)
+            os.rename(tmp, self.path)
+
+    def finished_recipe(self, recipe):
+        """Packages of a recipe that a previous run finished, or None if it has to be built"""
+        entry = self.recipes.get(recipe)
+        if not entry or not entry.get('done'):
+            return None
+        packages = [pkg for pkgs in entry['variants'].values() for pkg in pkgs or ()]
+        return packages if _packages_present(packages) else None
+
+    def finished_variant(self, recipe, key):
+        """Packages of one variant that a previous run finished, or None if it has to be built"""
+        packages = self.recipes.get(recipe, {}).get('variants', {}).get(key)
+        return packages if _packages_present(packages) else None
+
+    def rendered(self, recipe, keys):
+        entry = self.recipes.setdefault(recipe, {'variants': {}, 'done': False})
+        for key in keys:
+            entry['variants'].setdefault(key, None)
+        self._write()
+
+    def variant_done(self, recipe, key, packages):
+        entry = self.recipes.setdefault(recipe, {'variants': {}, 'done': False})
+        entry['variants'][key] = sorted(packages)
+        self._write()
+
+    def recipe_done(self, recipe):
+        if recipe in self.recipes:
+            self.recipes[recipe]['done'] = True
+            self._write()
+
+    def remove(self):
+        utils.rm_rf(self.path)
+
+
+def get_build_journal(config, recipe_list, variants=None):
+    """Return the journal for building recipe_list, loaded from disk when resuming.
+
+    Only recipes given as paths are journaled; runs of MetaData objects get None.
+    """
+    if not recipe_list or not all(hasattr(recipe, 'lower') for recipe in recipe_list):
+        return None
+    recipes = [os.path.abspath(recipe.rstrip("/").rstrip("\\")) for recipe in recipe_list]
+    digest = hashlib.sha256(json.dumps([recipes, variants], sort_keys=True,
+                                       default=str).encode('utf-8')).hexdigest()[:16]
+    journal = BuildJournal(os.path.join(config.croot, JOURNAL_DIR, digest + '.json'))
+    if config.resume:
+        if journal.load():
+            print("Resuming the build of {} recipes from {}".format(len(recipes), journal.path))
+        else:
+            print("No journal to resume from at {}; building everything".format(journal.path))
+    return journal
@@ -7,6 +7,7 @@
 from __future__ import absolute_import, division, print_function
 
 import argparse
+import json
 
 from glob2 import glob
 import logging
@@ -336,6 +337,132 @@ different sets of packages."""
     )
     p.add_argument('--stats-file', help=('File path to save build statistics to.  Stats are '
                                          'in JSON format'), )
+    p.add_argument('--trace-file', help=('File path to save a timeline of the build to, with '
+                                         'nested spans for rendering, solving, linking, source, '
+                                         'build script, post-processing, packaging and tests.  '
+                                         'It is in the Chrome trace-event JSON format; open it '
+                                         'in chrome://tracing or https://ui.perfetto.dev.'), )
+    p.add_argument('--stats-history',
+                   help=('sqlite database that the stats of every build are added to, and that '
+                         '--plan estimates phase durations from.  Defaults to '
+                         '<croot>/stats_history.sqlite.'),
+                   default=cc_conda_build.get('stats_history'))
+    p.add_argument(
+        '--resume',
+        action='store_true',
+        help=('Continue an interrupted build of the same recipes where it stopped.  Every run '
+              'keeps a journal of its rendered and finished recipes in <croot>/build_journals; '
+              'recipes it finished are skipped without rendering them again, as long as their '
+              'packages are still there.'),
+    )
+    p.add_argument(
+        '--plan',
+        action='store_true',
+        help=('Print, as JSON, what building the recipes would do rather than building them: '
+              'for each output, whether it would be skipped, the environments it needs and '
+              'estimated phase durations from the stats of earlier builds.'),
+    )
+    p.add_argument(
+        '--solve-cache-dir',
+        help=('Folder to keep solved build, host and test environments in.  A stored solution '
+              'is reused instead of solving again as long as the channel index is unchanged.'),
+        default=(abspath(expanduser(expandvars(cc_conda_build.get('solve_cache_dir'))))
+                 if cc_conda_build.get('solve_cache_dir')
+                 else cc_conda_build.get('solve_cache_dir')),
+    )
+    p.add_argument(
+        '--lockfile',
+        help=('Solved environments to use instead of solving, e.g. the info/solved_envs.json '
+              'file from a previously built package.  Locked environments are used as long as '
+              'the configured channels still contain all of the locked packages.'),
+    )
+    p.add_argument(
+        '--write-lockfile',
+        action='store_true',
+        help=('Record the solved build and host environments of each package in its '
+              'info/solved_envs.json, for use with --lockfile.'),
+        default=cc_conda_build.get('write_lockfile', 'false').lower() == 'true',
+    )
+    p.add_argument(
+        '--build-cache-dir',
+        help=('Folder holding a cache of previously built packages, keyed by a digest of all '
+              'build inputs (metadata, recipe files, sources and resolved build/host packages).  '
+              'Builds whose inputs match a cache entry are republished from the cache instead '
+              'of being rebuilt.'),
+        default=(abspath(expanduser(expandvars(cc_conda_build.get('build_cache_dir'))))
+                 if cc_conda_build.get('build_cache_dir')
+                 else cc_conda_build.get('build_cache_dir')),
+    )
+    p.add_argument(
+        '--build-cache-url',
+        help=('URL of an http server exposing the same layout as --build-cache-dir.  Entries '
+              'missing locally are fetched from it.'),
+        default=cc_conda_build.get('build_cache_url'),
+    )
+    p.add_argument(
+        '--build-cache-max-size',
+        help=('Evict least recently used build cache entries beyond this size (e.g. 20G).'),
+        default=cc_conda_build.get('build_cache_max_size'),
+    )
+    p.add_argument(
+        '--build-cache-max-age', type=float,
+        help=('Evict build cache entries that have not been used for this many days.'),
+        default=cc_conda_build.get('build_cache_max_age'),
+    )
+    p.add_argument(
+        '--env-template-dir',
+        help=('Folder holding fully linked environments, keyed by their exact package set.  '
+              'Build, host and test environments with a package set seen before are cloned '
+              'from these (hardlinking files where possible) instead of being linked again.  '
+              'Use a short path: templates are padded to the length of the environment prefix.'),
+        default=(abspath(expanduser(expandvars(cc_conda_build.get('env_template_dir'))))
+                 if cc_conda_build.get('env_template_dir')
+                 else cc_conda_build.get('env_template_dir')),
+    )
+    p.add_argument(
+        '--env-template-max', type=int,
+        help=('Number of environment templates to keep (default 10).'),
+        default=int(cc_conda_build.get('env_template_max', 10)),
+    )
+    p.add_argument(
+        '--test-env-pool',
+        action='store_true',
+        help=('Reuse test environments between packages whose tests need the same resolved '
+              'dependencies.  The dependencies are linked once into a pooled environment, which '
+              'is cloned for each test and has just the package under test linked on top.  '
+              'Pooled environments live in --env-template-dir if given, else in the croot.'),
+        default=cc_conda_build.get('test_env_pool', 'false').lower() == 'true',
+    )
+    p.add_argument(
+        '--no-parallel-envs',
+        action='store_false',
+        dest='parallel_envs',
+        help=('Link the build and host environments one after the other, rather than at the '
+              'same time.'),
+        default=cc_conda_build.get('parallel_envs', 'true').lower() == 'true',
+    )
+    p.add_argument(
+        '--no-background-delete',
+        action='store_false',
+        dest='background_delete',
+        help=('Delete prefixes and work directories in place when they are no longer needed, '
+              'rather than moving them into <croot>/.trash and deleting them in the '
+              'background.'),
+        default=cc_conda_build.get('background_delete', 'true').lower() == 'true',
+    )
+    p.add_argument(
+        '--test-workers', type=int,
+        help=('Number of packages to test at once with -t/--test, or after building a recipe '
+              'with several outputs.  Each package is tested in its own process and test '
+              'prefix, with its output logged to <croot>/test_logs.'),
+        default=int(cc_conda_build.get('test_workers', 1)),
+    )
+    p.add_argument(
+        '--test-cpus', type=int,
+        help=('Number of CPUs (CPU_COUNT) given to each test worker.  Defaults to an even share '
+              'of the machine.'),
+        default=cc_conda_build.get('test_cpus'),
+    )
     p.add_argument('--extra-deps',
                    nargs='+',
                    help=('Extra dependencies to add to all environment creation steps.  This '
@@ -356,6 +483,15 @@ def output_action(recipe, config):
         print('\n'.join(sorted(paths)))
 
 
+def plan_action(recipes, config):
+    with LoggingContext(logging.CRITICAL + 1):
+        config.verbose = False
+        config.debug = False
+        plan = api.plan(recipes, config=config)
+    print(json.dumps(plan, indent=2))
+    return plan
+
+
 def source_action(recipe, config):
     metadata = api.render(recipe, config=config)[0][0]
     source.provide(metadata)
@@ -408,6 +544,9 @@ def execute(args):
         config.verbose = False
         config.quiet = True
         config.debug = False
+    elif args.plan:
+        action = plan_action
+        config.quiet = True
     elif args.test:
         action = test_action
     elif args.source:
@@ -421,6 +560,12 @@ def execute(args):
                    [glob(os.path.abspath(recipe)) if '*' in recipe
                                                   else [recipe] for recipe in args.recipe]
                    for item in sublist]
+        if config.test_workers > 1:
+            # tests running alongside each other all finish, as if --keep-going had been given
+            results = api.test_packages(recipes, move_broken=False, config=config)
+            failed_recipes = [recipe for recipe, result in results.items()
+                              if not result['passed']]
+            recipes = []
         for recipe in recipes:
             try:
                 action(recipe, config)
@@ -439,6 +584,9 @@ def execute(args):
             print("All tests passed")
         outputs = []
 
+    elif action == plan_action:
+        # one document for all of the recipes
+        outputs = action(args.recipe, config)
     elif action:
         outputs = [action(recipe, config) for recipe in args.recipe]
     else:
@@ -446,7 +594,7 @@ def execute(args):
                             notest=args.notest, already_built=None, config=config,
                             verify=args.verify, variants=args.variants)
 
-    if not args.output and len(utils.get_build_folders(config.croot)) > 0:
+    if not (args.output or args.plan) and len(utils.get_build_folders(config.croot)) > 0:
         build.print_build_intermediate_warning(config)
     return outputs
 
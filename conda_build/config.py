@@ -18,6 +18,7 @@ from .variants import get_default_variant
 from .conda_interface import cc_platform, cc_conda_build, subdir
 
 from .utils import get_build_folders, rm_rf, get_logger, get_conda_operation_locks
+from . import trash
 
 on_win = (sys.platform == 'win32')
 
@@ -169,10 +170,82 @@ def _get_default_settings():
 
             # path to output build statistics to
             Setting('stats_file', None),
+            # path to write a timeline of the build to (Chrome trace-event JSON)
+            Setting('trace_file', None),
+            # pick an interrupted build_tree run of the same recipes up where it stopped
+            Setting('resume', False),
+            # sqlite database every build's stats are added to, for estimating later builds.
+            #    <croot>/stats_history.sqlite unless a path is given.
+            Setting('stats_history', (abspath(expanduser(expandvars(
+                cc_conda_build.get('stats_history')))) if cc_conda_build.get('stats_history')
+                else None)),
 
             # extra deps to add to test env creation
             Setting('extra_deps', []),
 
+            # folder to persist solved environments in, so later builds can skip solving when
+            #    the channels have not changed.  Off unless a folder is given.
+            Setting('solve_cache_dir', (abspath(expanduser(expandvars(
+                cc_conda_build.get('solve_cache_dir')))) if cc_conda_build.get('solve_cache_dir')
+                else None)),
+            # solved environments (e.g. info/solved_envs.json from a previous build) to use
+            #    instead of solving
+            Setting('lockfile', None),
+            # record the solved build and host environments of each package in
+            #    info/solved_envs.json, for use as a lockfile
+            Setting('write_lockfile',
+                    cc_conda_build.get('write_lockfile', 'false').lower() == 'true'),
+
+            # content-addressed cache of build results.  Off unless a folder is given.
+            Setting('build_cache_dir', (abspath(expanduser(expandvars(
+                cc_conda_build.get('build_cache_dir')))) if cc_conda_build.get('build_cache_dir')
+                else None)),
+            # optional http server exposing the same layout as build_cache_dir (read only)
+            Setting('build_cache_url', cc_conda_build.get('build_cache_url')),
+            # bytes (or e.g. '20G') and days since last use
+            Setting('build_cache_max_size', cc_conda_build.get('build_cache_max_size')),
+            Setting('build_cache_max_age', cc_conda_build.get('build_cache_max_age')),
+
+            # folder to save the index of which package owns each file of a prefix in, for
+            #    `conda inspect linkages`.  Off unless a folder is given.
+            Setting('prefix_owners_cache_dir', (abspath(expanduser(expandvars(
+                cc_conda_build.get('prefix_owners_cache_dir'))))
+                if cc_conda_build.get('prefix_owners_cache_dir') else None)),
+
+            # linked environments to clone build/host/test envs from.  Off unless a folder is
+            #    given; keep it short, since templates are padded to the length of the env prefix
+            Setting('env_template_dir', (abspath(expanduser(expandvars(
+                cc_conda_build.get('env_template_dir')))) if cc_conda_build.get('env_template_dir')
+                else None)),
+            # number of templates to keep and days since last use
+            Setting('env_template_max', int(cc_conda_build.get('env_template_max', 10))),
+            Setting('env_template_max_age', cc_conda_build.get('env_template_max_age')),
+            # pool test envs on their dependencies, linking the package under test on top
+            Setting('test_env_pool', cc_conda_build.get('test_env_pool', 'false').lower() == 'true'),
+            # number of packages to test at once, and CPUs (CPU_COUNT) given to each of them
+            Setting('test_workers', int(cc_conda_build.get('test_workers', 1))),
+            Setting('test_cpus', cc_conda_build.get('test_cpus')),
+            # rename prefixes and work dirs into <croot>/.trash and delete them on background
+            #    threads, rather than deleting them in place
+            Setting('background_delete',
+                    cc_conda_build.get('background_delete', 'true').lower() == 'true'),
+            # python processes byte-compiling a package's .py files at once; one per CPU if unset
+            Setting('pyc_compile_workers', cc_conda_build.get('pyc_compile_workers')),
+            # sqlite database of DSO analyses (exports, symbols, ...) shared by builds; by default
+            #    <croot>/dso_cache.sqlite.  Kept under dso_cache_max_size (e.g. '1G'; 0 turns it off)
+            Setting('dso_cache', (abspath(expanduser(expandvars(
+                cc_conda_build.get('dso_cache')))) if cc_conda_build.get('dso_cache') else None)),
+            Setting('dso_cache_max_size', cc_conda_build.get('dso_cache_max_size')),
+            # processes analyzing DSOs for the overlinking checks; one per CPU if unset
+            Setting('dso_analysis_workers', cc_conda_build.get('dso_analysis_workers')),
+            # JSON file of the natures of run requirements (dso library, ...) found by the
+            #    overlinking checks; by default <first pkgs_dir>/cache/conda-build-library-nature.json
+            Setting('library_nature_cache', (abspath(expanduser(expandvars(
+                cc_conda_build.get('library_nature_cache')))) if cc_conda_build.get('library_nature_cache')
+                else None)),
+            # link the build and host envs at the same time
+            Setting('parallel_envs', cc_conda_build.get('parallel_envs', 'true').lower() == 'true'),
+
             # customize this so pip doesn't look in places we don't want.  Per-build path by default.
             Setting('_pip_cache_dir', None)
             ]
@@ -197,6 +270,9 @@ class Config(object):
         super(Config, self).__init__()
         # default variant is set in render's distribute_variants
         self.variant = variant or {}
+        # lock entries of the build and host environments solved for this build, by prefix.
+        #    Shared with copies, so that outputs see what the top-level build solved.
+        self.solved_envs = {}
         self.set_keys(**kwargs)
         if self._src_cache_root:
             self._src_cache_root = os.path.expanduser(self._src_cache_root)
@@ -738,11 +814,11 @@ class Config(object):
         if remove_folders and not getattr(self, 'dirty'):
             if self.build_id:
                 if os.path.isdir(self.build_folder):
-                    rm_rf(self.build_folder)
+                    trash.discard(self.build_folder, self)
             else:
                 for path in [self.work_dir, self.test_dir, self.build_prefix, self.test_prefix]:
                     if os.path.isdir(path):
-                        rm_rf(path)
+                        trash.discard(path, self)
             if os.path.isfile(os.path.join(self.build_folder, 'prefix_files')):
                 rm_rf(os.path.join(self.build_folder, 'prefix_files'))
         else:
@@ -0,0 +1,299 @@
+'''
+Cache of fully linked environments ("templates"), keyed by the exact set of packages linked.
+
+Creating the same build, host or test environment over and over is dominated by conda's link
+step.  Instead, the first time a package set is seen it is linked once into a template prefix
+under ``config.env_template_dir``, and every later environment with that package set is cloned
+from it: files conda hardlinked from the package cache are hardlinked again, everything else is
+reflinked or copied and has the template prefix replaced by the new one.
+
+Test environments can also be pooled on everything except the package being tested: the
+template then holds the test dependencies only, and the package under test is linked on top of
+each clone as a fresh layer.  Variants and outputs whose tests need the same dependencies share
+one template.
+
+Template prefixes are padded to exactly the length of the prefix they will be cloned into, so
+replacing the prefix never changes the length of a file.  That keeps binary files (and the
+strings embedded in .pyc files) valid without having to know where each prefix occurrence is.
+'''
+from __future__ import absolute_import, division, print_function
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+from conda_build import utils
+
+MARKER_FILE = '.conda_build_template.json'
+
+_placeholder = '_placehold'
+
+
+def template_key(actions, subdir, prefix_length):
+    """Key a template on its linked packages, its platform and the length of its prefix"""
+    contents = {'link': sorted(str(dist) for dist in actions.get('LINK', [])),
+                'subdir': subdir,
+                'prefix_length': prefix_length}
+    blob = json.dumps(contents, sort_keys=True)
+    return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+
+def _hardlinkable_paths(prefix):
+    """Paths (relative to prefix) that conda linked straight from the package cache.
+
+    These contain no prefix and can be hardlinked into the clone.  Anything else (files with a
+    prefix placeholder, compiled .pyc files, entry points, conda-meta) may mention the prefix.
+    """
+    paths = set()
+    meta_dir = os.path.join(prefix, 'conda-meta')
+    if not os.path.isdir(meta_dir):
+        return paths
+    for fn in os.listdir(meta_dir):
+        if not fn.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(meta_dir, fn)) as f:
+                record = json.load(f)
+        except (IOError, OSError, ValueError):
+            continue
+        for entry in record.get('paths_data', {}).get('paths', []):
+            if entry.get('path_type') == 'hardlink' and not entry.get('prefix_placeholder'):
+                paths.add(entry['_path'])
+    return paths
+
+
+def _clone_file(src, dst, src_prefix, dst_prefix):
+    with open(src, 'rb') as f:
+        data = f.read()
+    if src_prefix in data:
+        with open(dst, 'wb') as f:
+            f.write(data.replace(src_prefix, dst_prefix))
+        shutil.copystat(src, dst)
+    else:
+        utils.reflink_or_copy(src, dst)
+
+
+def clone_prefix(src, dst):
+    """Materialize the environment at ``src`` into the (empty) prefix ``dst``.
+
+    Returns a dict counting the files that were hardlinked, copied and symlinked.
+    """
+    hardlinkable = _hardlinkable_paths(src)
+    b_src, b_dst = src.encode('utf-8'), dst.encode('utf-8')
+    counts = {'hardlinked': 0, 'copied': 0, 'symlinks': 0}
+    for root, dirs, files in os.walk(src):
+        rel_root = os.path.relpath(root, src)
+        dst_root = os.path.normpath(os.path.join(dst, rel_root))
+        if not os.path.isdir(dst_root):
+            os.makedirs(dst_root)
+        for name in dirs + files:
+            src_path = os.path.join(root, name)
+            dst_path = os.path.join(dst_root, name)
+            rel_path = os.path.normpath(os.path.join(rel_root, name)).replace('\\', '/')
+            if rel_path == MARKER_FILE:
+                continue
+            if os.path.islink(src_path):
+                os.symlink(os.readlink(src_path).replace(src, dst), dst_path)
+                counts['symlinks'] += 1
+            elif name in files:
+                if rel_path in hardlinkable:
+                    try:
+                        os.link(src_path, dst_path)
+                        counts['hardlinked'] += 1
+                        continue
+                    except OSError:
+                        pass
+                _clone_file(src_path, dst_path, b_src, b_dst)
+                counts['copied'] += 1
+        # os.walk does not descend into symlinked folders, but lists them in dirs
+        dirs[:] = [d for d in dirs if not os.path.islink(os.path.join(root, d))]
+    return counts
+
+
+class TemplateCache(object):
+    """A folder of linked environments, reused by ``create_env``.
+
+    ``max_count`` bounds the number of templates kept and ``max_age`` drops templates unused for
+    that many days; the least recently used go first.  Each template is guarded by its own lock,
+    taken while holding the conda operation locks so that it nests like the other locks
+    conda-build takes around linking.  The file locks don't exclude other threads of this
+    process (``create_envs`` links environments side by side), so each template also has a
+    thread lock, and another one guards the counters and eviction.
+    """
+    def __init__(self, root, max_count=None, max_age=None, locking=True, timeout=900):
+        self.root = os.path.abspath(os.path.expanduser(root))
+        self.max_count = int(max_count) if max_count else None
+        self.max_age = float(max_age) if max_age else None
+        self.locking = locking
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.clone_time = 0.0
+        self.create_time = 0.0
+        self.layer_time = 0.0
+        self._lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+        self._template_locks = {}
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+
+    def template_prefix(self, key, prefix_length):
+        """Path of the template for ``key``, padded to ``prefix_length``, or None if it can't fit"""
+        base = os.path.join(self.root, key[:16] + '_')
+        missing = prefix_length - len(base)
+        if missing < 0:
+            return None
+        return base + (_placeholder * (missing // len(_placeholder) + 1))[:missing]
+
+    def _locks(self, path):
+        return [utils.get_lock(path, timeout=self.timeout)] if self.locking else []
+
+    def _thread_lock(self, path):
+        with self._lock:
+            return self._template_locks.setdefault(path, threading.Lock())
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def _read_marker(self, template):
+        try:
+            with open(os.path.join(template, MARKER_FILE)) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def materialize(self, prefix, actions, subdir, link, layer=None):
+        """Fill ``prefix`` from the template matching ``actions``.
+
+        ``link(actions)`` performs the actual conda link step; it is called with PREFIX pointing
+        at the template the first time a package set is seen.  Packages named in ``layer`` are
+        left out of the template and linked into ``prefix`` after it has been cloned.  Returns
+        False when no template can be used for this prefix, in which case the caller should link
+        ``prefix`` itself.
+        """
+        log = utils.get_logger(__name__)
+        if utils.on_win or not actions.get('LINK'):
+            return False
+        layer_actions = None
+        if layer:
+            layer_actions = actions.copy()
+            layer_actions['LINK'] = [dist for dist in actions['LINK'] if dist.name in layer]
+            actions = actions.copy()
+            actions['LINK'] = [dist for dist in actions['LINK'] if dist.name not in layer]
+            if not actions['LINK']:
+                return False
+        template = self.template_prefix(template_key(actions, subdir, len(prefix)), len(prefix))
+        if not template:
+            log.debug("env template folder %s is too long for prefix %s", self.root, prefix)
+            return False
+        with self._thread_lock(template), utils.try_acquire_locks(self._locks(template),
+                                                                   self.timeout):
+            marker = self._read_marker(template)
+            if marker:
+                self._count('hits')
+            else:
+                self._count('misses')
+                utils.rm_rf(template)
+                template_actions = actions.copy()
+                template_actions['PREFIX'] = template
+                start = time.time()
+                try:
+                    link(template_actions)
+                except:  # noqa
+                    utils.rm_rf(template)
+                    raise
+                marker = {'link': sorted(str(dist) for dist in actions['LINK']),
+                          'subdir': subdir,
+                          'create_time': time.time() - start}
+                with open(os.path.join(template, MARKER_FILE), 'w') as f:
+                    json.dump(marker, f, indent=2, sort_keys=True)
+                self._count('create_time', marker['create_time'])
+            start = time.time()
+            counts = clone_prefix(template, prefix)
+            clone_time = time.time() - start
+            # the marker's mtime records the last use, which drives eviction
+            os.utime(os.path.join(template, MARKER_FILE), None)
+        self._count('clone_time', clone_time)
+        log.info("Cloned environment %s from template in %.2fs (%d hardlinked, %d copied); "
+                 "linking it took %.2fs", prefix, clone_time, counts['hardlinked'],
+                 counts['copied'], marker['create_time'])
+        if layer_actions and layer_actions['LINK']:
+            start = time.time()
+            link(layer_actions)
+            layer_time = time.time() - start
+            self._count('layer_time', layer_time)
+            log.info("Linked %s into %s in %.2fs",
+                     ', '.join(str(dist) for dist in layer_actions['LINK']), prefix, layer_time)
+        self.evict()
+        return True
+
+    def templates(self):
+        """List (last use, path) for each complete template"""
+        templates = []
+        for name in os.listdir(self.root):
+            marker = os.path.join(self.root, name, MARKER_FILE)
+            if os.path.isfile(marker):
+                templates.append((os.path.getmtime(marker), os.path.join(self.root, name)))
+        return sorted(templates)
+
+    def evict(self):
+        """Drop templates unused for longer than max_age, then the oldest ones over max_count"""
+        if not self.max_count and not self.max_age:
+            return
+        with self._evict_lock:
+            now = time.time()
+            templates = self.templates()
+            doomed = [path for last_use, path in templates
+                      if self.max_age and now - last_use > self.max_age * 86400]
+            keep = [path for _, path in templates if path not in doomed]
+            if self.max_count and len(keep) > self.max_count:
+                doomed.extend(keep[:len(keep) - self.max_count])
+            for path in doomed:
+                with self._thread_lock(path), utils.try_acquire_locks(self._locks(path),
+                                                                       self.timeout):
+                    utils.rm_rf(path)
+                self._count('evicted')
+
+    def summary(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evicted': self.evicted,
+                'clone_time': self.clone_time, 'create_time': self.create_time,
+                'layer_time': self.layer_time}
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def _get_cache(root, config):
+    key = os.path.abspath(os.path.expanduser(root))
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = TemplateCache(root, max_count=config.env_template_max,
+                                         max_age=config.env_template_max_age,
+                                         locking=config.locking, timeout=config.timeout)
+        return _caches[key]
+
+
+def get_template_cache(config):
+    """Return the TemplateCache configured for ``config``, or None when templates are off"""
+    root = getattr(config, 'env_template_dir', None)
+    if not root:
+        return None
+    return _get_cache(root, config)
+
+
+def get_test_env_pool(config):
+    """Return the TemplateCache that test environments are pooled in, or None when pooling is off.
+
+    The pool shares ``config.env_template_dir`` when that is set, and otherwise lives in the
+    croot.
+    """
+    if not getattr(config, 'test_env_pool', False):
+        return None
+    return _get_cache(getattr(config, 'env_template_dir', None) or
+                      os.path.join(config.croot, 'test_env_pool'), config)
@@ -1,6 +1,7 @@
 from __future__ import absolute_import, division, print_function
 
 import contextlib
+import hashlib
 import json
 import logging
 import multiprocessing
@@ -9,7 +10,9 @@ import platform
 import re
 import subprocess
 import sys
+import time
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 from glob import glob
 from os.path import join, normpath
 
@@ -18,12 +21,12 @@ from .conda_interface import text_type, PY3  # noqa
 from .conda_interface import (CondaError, LinkError, LockError, NoPackagesFoundError,
                               PaddingError, UnsatisfiableError)
 from .conda_interface import display_actions, execute_actions, execute_plan, install_actions
-from .conda_interface import memoized
-from .conda_interface import package_cache, TemporaryDirectory
+from .conda_interface import memoized, MatchSpec
+from .conda_interface import package_cache, ProgressiveFetchExtract, TemporaryDirectory
 from .conda_interface import pkgs_dirs, root_dir, symlink_conda, create_default_packages
 from .conda_interface import reset_context
 
-from conda_build import utils
+from conda_build import env_templates, trace, trash, utils
 from conda_build.exceptions import BuildLockError, DependencyNeedsBuildingError
 from conda_build.features import feature_list
 from conda_build.index import get_build_index
@@ -707,11 +710,175 @@ class Environment(object):
 cached_actions = {}
 last_index_ts = 0
 
+# Solutions loaded from a lockfile (--lockfile), keyed like the persistent solve cache.  These
+#    are used instead of solving as long as the index still has every locked package.
+locked_actions = {}
+_loaded_lockfiles = set()
+# fingerprint and dist_name lookup for the current index; recomputed when the index changes
+_index_info = (None, None, None)
+
+# action keys we know how to serialize.  Anything else (e.g. a non-empty UNLINK) is not locked.
+_LOCKABLE_ACTION_KEYS = ('PREFIX', 'SPECS', 'op_order', 'LINK', 'UNLINK')
+
+
+def _solve_key(specs, env, subdir, channel_urls=None, disable_pip=False):
+    key = [sorted(str(spec) for spec in specs), env, subdir, disable_pip]
+    if channel_urls is not None:
+        key.append(list(channel_urls))
+    return hashlib.sha256(json.dumps(key).encode('utf-8')).hexdigest()
+
+
+def _index_by_dist_name(index):
+    """Return {dist_name: [index keys]} for index, computed once per index"""
+    global _index_info
+    if _index_info[0] is not index:
+        by_dist_name = {}
+        for key in index:
+            by_dist_name.setdefault(key.dist_name, []).append(key)
+        _index_info = (index, by_dist_name, None)
+    return _index_info[1]
+
+
+def _index_fingerprint(index):
+    """Digest of every record in index that can change a solution, computed once per index"""
+    global _index_info
+    by_dist_name = _index_by_dist_name(index)
+    if _index_info[2] is None:
+        fingerprint = hashlib.sha256()
+        for dist_name in sorted(by_dist_name):
+            for key in by_dist_name[dist_name]:
+                record = index[key]
+                fingerprint.update(u'{} {} {} {}\n'.format(
+                    str(record.get('channel')), dist_name, record.get('md5'),
+                    ','.join(record.get('depends') or ())).encode('utf-8'))
+        _index_info = (index, by_dist_name, fingerprint.hexdigest())
+    return _index_info[2]
+
+
+def _actions_to_lock(actions, index, specs, env, subdir, channel_urls, disable_pip,
+                     with_fingerprint=False):
+    if not set(actions) <= set(_LOCKABLE_ACTION_KEYS) or actions.get('UNLINK'):
+        return None
+    packages = []
+    for pkg in actions.get('LINK', []):
+        record = index.get(pkg, {})
+        packages.append({'dist_name': pkg.dist_name,
+                         'channel': str(record.get('channel')),
+                         'md5': record.get('md5')})
+    return {'env': env,
+            'subdir': subdir,
+            'specs': sorted(str(spec) for spec in specs),
+            'channel_urls': list(channel_urls or ()),
+            'disable_pip': disable_pip,
+            'index_fingerprint': _index_fingerprint(index) if with_fingerprint else None,
+            'actions': {k: [str(v) for v in actions[k]]
+                        for k in ('SPECS', 'op_order') if k in actions},
+            'packages': packages}
+
+
+def _actions_from_lock(entry, prefix, index, check_fingerprint=False):
+    """Turn a lock entry back into install actions, or None if the index no longer fits it.
+
+    Validation is a dictionary lookup per locked package (plus a fingerprint comparison for
+    solve cache entries), so it is much cheaper than solving.
+    """
+    if check_fingerprint and entry.get('index_fingerprint') != _index_fingerprint(index):
+        return None
+    by_dist_name = _index_by_dist_name(index)
+    link = []
+    for pkg in entry['packages']:
+        candidates = by_dist_name.get(pkg['dist_name'])
+        if not candidates:
+            return None
+        if len(candidates) > 1:
+            candidates = ([c for c in candidates if str(index[c].get('channel')) == pkg['channel']] or
+                          candidates)
+        key = candidates[0]
+        if pkg.get('md5') and index[key].get('md5') and index[key].get('md5') != pkg['md5']:
+            return None
+        link.append(key)
+    actions = {'PREFIX': prefix, 'LINK': link}
+    if 'op_order' in entry['actions']:
+        actions['op_order'] = tuple(entry['actions']['op_order'])
+    if 'SPECS' in entry['actions']:
+        actions['SPECS'] = [MatchSpec(spec) for spec in entry['actions']['SPECS']]
+    return actions
+
+
+def _read_solve_cache(solve_cache_dir, key):
+    try:
+        with open(os.path.join(solve_cache_dir, key + '.json')) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _write_solve_cache(solve_cache_dir, key, entry):
+    if not os.path.isdir(solve_cache_dir):
+        try:
+            os.makedirs(solve_cache_dir)
+        except OSError:
+            pass
+    path = os.path.join(solve_cache_dir, key + '.json')
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(entry, f, indent=2, sort_keys=True)
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        # windows won't rename over an existing file.  Another build wrote the same solution.
+        utils.rm_rf(tmp)
 
+
+def _get_locked_or_cached_actions(prefix, specs, env, subdir, channel_urls, disable_pip, index,
+                                  solve_cache_dir=None):
+    """Find a previous solution for these specs in a loaded lockfile or the solve cache"""
+    log = utils.get_logger(__name__)
+    entry = locked_actions.get(_solve_key(specs, env, subdir, disable_pip=disable_pip))
+    if entry:
+        actions = _actions_from_lock(entry, prefix, index)
+        if actions:
+            log.info("Using locked solution for %s environment", env)
+            return actions
+        log.warn("Locked solution for %s environment is not available from the current "
+                 "channels.  Solving instead.", env)
+    if solve_cache_dir:
+        entry = _read_solve_cache(solve_cache_dir,
+                                  _solve_key(specs, env, subdir, channel_urls, disable_pip))
+        if entry:
+            actions = _actions_from_lock(entry, prefix, index, check_fingerprint=True)
+            if actions:
+                log.debug("Using cached solution for %s environment from %s", env,
+                          solve_cache_dir)
+                return actions
+    return None
+
+
+def load_lockfile(path):
+    """Load solved environments from a lockfile (e.g. info/solved_envs.json from a package)"""
+    path = os.path.abspath(os.path.expanduser(path))
+    if path in _loaded_lockfiles:
+        return
+    with open(path) as f:
+        entries = json.load(f)
+    if hasattr(entries, 'keys'):
+        entries = list(entries.values())
+    for entry in entries:
+        key = _solve_key(entry['specs'], entry['env'], entry['subdir'],
+                         disable_pip=entry.get('disable_pip', False))
+        locked_actions[key] = entry
+    _loaded_lockfiles.add(path)
+
+
+@trace.traced('solve', cat='env', args=lambda prefix, specs, env, *a, **kw: {
+    'prefix': prefix, 'env': env, 'specs': len(specs)})
 def get_install_actions(prefix, specs, env, retries=0, subdir=None,
                         verbose=True, debug=False, locking=True,
                         bldpkgs_dirs=None, timeout=900, disable_pip=False,
-                        max_env_retry=3, output_folder=None, channel_urls=None):
+                        max_env_retry=3, output_folder=None, channel_urls=None,
+                        solve_cache_dir=None, solved_envs=None):
+    """Solve specs for prefix.  The lock entry of the solution is put in solved_envs[prefix],
+    when given (see ``build.write_solved_envs``)."""
     global cached_actions
     global last_index_ts
     actions = {}
@@ -738,11 +905,21 @@ def get_install_actions(prefix, specs, env, retries=0, subdir=None,
                                       locking=locking, timeout=timeout)
     specs = tuple(utils.ensure_valid_spec(spec) for spec in specs if not str(spec).endswith('@'))
 
-    if ((specs, env, subdir, channel_urls, disable_pip) in cached_actions and
-            last_index_ts >= index_ts):
+    in_memory = ((specs, env, subdir, channel_urls, disable_pip) in cached_actions and
+                 last_index_ts >= index_ts)
+    previous_solution = None
+    if specs and not in_memory:
+        previous_solution = _get_locked_or_cached_actions(prefix, specs, env, subdir, channel_urls,
+                                                          disable_pip, index, solve_cache_dir)
+
+    if in_memory:
         actions = cached_actions[(specs, env, subdir, channel_urls, disable_pip)].copy()
         if "PREFIX" in actions:
             actions['PREFIX'] = prefix
+    elif previous_solution:
+        actions = previous_solution
+        cached_actions[(specs, env, subdir, channel_urls, disable_pip)] = actions.copy()
+        last_index_ts = index_ts
     elif specs:
         # this is hiding output like:
         #    Fetching package metadata ...........
@@ -786,7 +963,8 @@ def get_install_actions(prefix, specs, env, retries=0, subdir=None,
                                                       disable_pip=disable_pip,
                                                       max_env_retry=max_env_retry,
                                                       output_folder=output_folder,
-                                                      channel_urls=tuple(channel_urls))
+                                                      channel_urls=tuple(channel_urls),
+                                                      solve_cache_dir=solve_cache_dir)
                     else:
                         log.error("Failed to get install actions, max retries exceeded.")
                         raise
@@ -799,13 +977,27 @@ def get_install_actions(prefix, specs, env, retries=0, subdir=None,
         utils.trim_empty_keys(actions)
         cached_actions[(specs, env, subdir, channel_urls, disable_pip)] = actions.copy()
         last_index_ts = index_ts
+        if solve_cache_dir:
+            entry = _actions_to_lock(actions, index, specs, env, subdir, channel_urls, disable_pip,
+                                     with_fingerprint=True)
+            if entry:
+                _write_solve_cache(solve_cache_dir,
+                                   _solve_key(specs, env, subdir, channel_urls, disable_pip), entry)
+    if actions and solved_envs is not None:
+        solved_envs[prefix] = _actions_to_lock(actions, index, specs, env, subdir, channel_urls,
+                                               disable_pip)
     return actions
 
 
+@trace.traced(cat='env', args=lambda prefix, specs_or_actions, env, *a, **kw: {
+    'prefix': prefix, 'env': env})
 def create_env(prefix, specs_or_actions, env, config, subdir, clear_cache=True, retry=0,
-               locks=None, is_cross=False, is_conda=False):
+               locks=None, is_cross=False, is_conda=False, layer=None):
     '''
     Create a conda envrionment for the given prefix and specs.
+
+    With ``config.test_env_pool``, the packages named in ``layer`` are linked on top of a pooled
+    environment holding everything else.
     '''
     if config.debug:
         external_logger_context = utils.LoggingContext(logging.DEBUG)
@@ -814,7 +1006,7 @@ def create_env(prefix, specs_or_actions, env, config, subdir, clear_cache=True,
 
     if os.path.exists(prefix):
         for entry in glob(os.path.join(prefix, "*")):
-            utils.rm_rf(entry)
+            trash.discard(entry, config)
 
     with external_logger_context:
         log = utils.get_logger(__name__)
@@ -843,7 +1035,8 @@ def create_env(prefix, specs_or_actions, env, config, subdir, clear_cache=True,
                                                         disable_pip=config.disable_pip,
                                                         max_env_retry=config.max_env_retry,
                                                         output_folder=config.output_folder,
-                                                        channel_urls=tuple(config.channel_urls))
+                                                        channel_urls=tuple(config.channel_urls),
+                                                        solve_cache_dir=config.solve_cache_dir)
                     else:
                         actions = specs_or_actions
                     index, _, _ = get_build_index(subdir=subdir,
@@ -862,7 +1055,7 @@ def create_env(prefix, specs_or_actions, env, config, subdir, clear_cache=True,
                             os.environ[k] = str(v)
                     with env_var('CONDA_QUIET', not config.verbose, reset_context):
                         with env_var('CONDA_JSON', not config.verbose, reset_context):
-                            execute_actions(actions, index)
+                            _link_env(prefix, actions, index, config, subdir, layer=layer)
             except (SystemExit, PaddingError, LinkError, DependencyNeedsBuildingError,
                     CondaError, BuildLockError) as exc:
                 if (("too short in" in str(exc) or
@@ -935,13 +1128,126 @@ def create_env(prefix, specs_or_actions, env, config, subdir, clear_cache=True,
                     raise
 
     if not is_conda:
-        # Symlinking conda is critical here to make sure that activate scripts are not
-        #    accidentally included in packages.
-        if utils.on_win:
-            shell = "cmd.exe"
-        else:
-            shell = "bash"
-        symlink_conda(prefix, sys.prefix, shell)
+        _symlink_conda(prefix)
+
+
+@trace.traced('link', cat='env', args=lambda prefix, actions, *a, **kw: {
+    'prefix': prefix, 'packages': len(actions.get('LINK', []))})
+def _link_env(prefix, actions, index, config, subdir, layer=None):
+    # ``layer`` names packages (the one under test) to link on top of a pooled environment
+    templates = env_templates.get_test_env_pool(config) if layer else None
+    if not templates:
+        templates, layer = env_templates.get_template_cache(config), None
+    if not (templates and templates.materialize(prefix, actions, subdir,
+                                                lambda a: execute_actions(a, index),
+                                                layer=layer)):
+        execute_actions(actions, index)
+
+
+def _symlink_conda(prefix):
+    # Symlinking conda is critical here to make sure that activate scripts are not
+    #    accidentally included in packages.
+    if utils.on_win:
+        shell = "cmd.exe"
+    else:
+        shell = "bash"
+    symlink_conda(prefix, sys.prefix, shell)
+
+
+@trace.traced('fetch', cat='env', args=lambda actions, index: {'packages': len(actions.get('LINK', []))})
+def fetch_packages(actions, index):
+    """Download and extract the packages that ``actions`` will link into the package cache"""
+    link_dists = list(actions.get('LINK', []))
+    if not link_dists:
+        return
+    try:
+        # the conda 4.4 API uses a single `link_prefs` kwarg
+        # whereas conda 4.3 used `index` and `link_dists` kwargs
+        pfe = ProgressiveFetchExtract(link_prefs=tuple(index[dist] for dist in link_dists))
+    except TypeError:
+        pfe = ProgressiveFetchExtract(link_dists=link_dists, index=index)
+    with utils.LoggingContext():
+        pfe.execute()
+
+
+@trace.traced(cat='env', args=lambda envs, *a, **kw: {'envs': len(envs)})
+def create_envs(envs, config, timings=None):
+    '''
+    Create several environments at once, e.g. the build and host envs of a recipe.
+
+    ``envs`` is a list of dicts of ``create_env`` arguments, each with solved actions as
+    ``specs_or_actions``.  Downloading and extracting packages touches the shared package
+    cache, so that is done first, one environment after the other.  Linking only writes to each
+    environment's own prefix, so the environments are then linked in parallel.  The conda
+    operation locks are held throughout, keeping other conda-build processes out of the package
+    cache meanwhile.  An environment that fails to link here is created again with
+    ``create_env``, which knows how to retry and fall back to shorter prefixes.
+
+    Fetch and link times (or the whole create_env time, for environments created on their own)
+    are recorded in seconds per environment in ``timings``.
+    '''
+    log = utils.get_logger(__name__)
+    timings = {} if timings is None else timings
+    done = set()
+    if config.parallel_envs and len(envs) > 1:
+        locks = utils.get_conda_operation_locks(config)
+        with utils.try_acquire_locks(locks, timeout=config.timeout):
+            indexes = []
+            for kwargs in envs:
+                start = time.time()
+                actions = kwargs['specs_or_actions']
+                index, _, _ = get_build_index(subdir=kwargs['subdir'],
+                                              bldpkgs_dir=config.bldpkgs_dir,
+                                              output_folder=config.output_folder,
+                                              channel_urls=config.channel_urls,
+                                              debug=config.debug,
+                                              verbose=config.verbose,
+                                              locking=config.locking,
+                                              timeout=config.timeout)
+                utils.trim_empty_keys(actions)
+                if config.verbose:
+                    display_actions(actions, index)
+                try:
+                    fetch_packages(actions, index)
+                except (CondaError, AssertionError, IOError, RuntimeError) as exc:
+                    # leave it to create_env, which knows how to clean up and retry
+                    log.warn("Fetching packages for the %s environment failed: %s",
+                             kwargs['env'], exc)
+                    break
+                timings.setdefault(kwargs['env'], {})['fetch'] = time.time() - start
+                indexes.append(index)
+
+            def link(kwargs, index):
+                start = time.time()
+                prefix = kwargs['prefix']
+                for entry in glob(os.path.join(prefix, "*")):
+                    trash.discard(entry, config)
+                _link_env(prefix, kwargs['specs_or_actions'], index, config, kwargs['subdir'])
+                return time.time() - start
+
+            # conda's context is process wide; set it up once here rather than in each thread
+            with env_var('CONDA_QUIET', not config.verbose, reset_context):
+                with env_var('CONDA_JSON', not config.verbose, reset_context):
+                    with ThreadPoolExecutor(max(len(indexes), 1)) as executor:
+                        # zip stops short of any environment whose packages failed to fetch
+                        futures = [executor.submit(link, kwargs, index)
+                                   for kwargs, index in zip(envs, indexes)]
+                    for kwargs, future in zip(envs, futures):
+                        try:
+                            timings[kwargs['env']]['link'] = future.result()
+                            done.add(kwargs['env'])
+                        except Exception as exc:
+                            log.warn("Linking the %s environment alongside others failed, "
+                                     "creating it on its own.  Error was: %s", kwargs['env'], exc)
+    for kwargs in envs:
+        if kwargs['env'] in done:
+            if not kwargs.get('is_conda'):
+                _symlink_conda(kwargs['prefix'])
+            continue
+        start = time.time()
+        create_env(config=config, **kwargs)
+        timings.setdefault(kwargs['env'], {})['create'] = time.time() - start
+    return timings
 
 
 def get_pkg_dirs_locks(dirs, config):
@@ -1012,6 +1318,7 @@ def get_pinned_deps(m, section):
                                     disable_pip=m.config.disable_pip,
                                     max_env_retry=m.config.max_env_retry,
                                     output_folder=m.config.output_folder,
-                                    channel_urls=tuple(m.config.channel_urls))
+                                    channel_urls=tuple(m.config.channel_urls),
+                                    solve_cache_dir=m.config.solve_cache_dir)
     runtime_deps = [' '.join(link.dist_name.rsplit('-', 2)) for link in actions.get('LINK', [])]
     return runtime_deps
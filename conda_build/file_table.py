@@ -0,0 +1,200 @@
+'''
+Classification of the files of a build, shared by the post-processing and info-file steps.
+
+Each file of an output used to be opened again by every step looking at it: for its codefile
+type when relocating it and in the overlinking checks, for a shebang, for NUL bytes and the
+prefix when detecting prefix files, and for its hash in paths.json.  A ``FileTable`` reads each
+file once, on a pool of threads, and records::
+
+    kind         'elffile', 'machofile', 'DLLfile', 'EXEfile' (as codefile_type), 'script',
+                 'text', 'binary' or 'empty', of the file a symlink points to; 'symlink' for
+                 symlinks to no file, 'unreadable' and 'missing'
+    is_link      whether the file is a symlink
+    codefile     the codefile_type of the file (None for symlinks, like codefile_type)
+    size         the size of the file, following symlinks (None if it is not a file)
+    mode         'text' or 'binary' (whether it has NUL bytes), as in has_prefix
+    sha256       hash of the content
+    prefix_hits  which of the prefix, its placeholder and (on Windows) its other spellings
+                 occur in the content
+
+Entries remember the stat of their file, and are classified again when a step changed the file
+(rewriting a shebang, an rpath or the prefix), so steps always see what is on disk.  A same-size
+rewrite within the timestamp resolution of the filesystem can go unnoticed, so what ends up in
+the package metadata (paths.json) is read afresh.
+'''
+from __future__ import absolute_import, division, print_function
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import stat
+import threading
+
+from conda_build import trace, utils
+from conda_build.conda_interface import prefix_placeholder
+from conda_build.os_utils.pyldd import codefile_class_from_header
+
+# tables of this many prefixes are kept (the host prefixes of the builds done lately)
+MAX_TABLES = 4
+# read files larger than this through mmap
+MMAP_SIZE = 1 << 20
+
+_tables = OrderedDict()
+_tables_lock = threading.Lock()
+
+
+def prefix_spellings(prefix):
+    """The strings prefix detection looks for in files, in the order has_prefix lists them"""
+    spellings = [prefix]
+    if utils.on_win:
+        # some windows libraries use unix-style path separators, or escape backslashes
+        spellings.extend((prefix.replace('\\', '/'), prefix.replace('\\', '\\\\')))
+    spellings.append(prefix_placeholder)
+    return spellings
+
+
+class FileInfo(object):
+    __slots__ = ('path', 'kind', 'codefile', 'is_link', 'size', 'mode', 'sha256', 'prefix_hits',
+                 'error', '_stat_key')
+
+    def __init__(self, path, stat_key):
+        self.path = path
+        self._stat_key = stat_key
+        self.kind = 'missing'
+        self.codefile = None
+        self.is_link = False
+        self.size = None
+        self.mode = None
+        self.sha256 = None
+        self.prefix_hits = ()
+        self.error = None
+
+    @property
+    def is_file(self):
+        return self.size is not None
+
+
+def _stat_key(path):
+    try:
+        st = os.lstat(path)
+    except (IOError, OSError):
+        return None
+    # not the permissions, though changing them changes the ctime: the ctime is there because,
+    #    unlike the mtime, tools can't set it back after rewriting a file of the same size
+    key = (stat.S_IFMT(st.st_mode), st.st_ino, st.st_size,
+           st.st_mtime_ns if hasattr(st, 'st_mtime_ns') else st.st_mtime,
+           st.st_ctime_ns if hasattr(st, 'st_ctime_ns') else st.st_ctime)
+    if stat.S_ISLNK(st.st_mode):
+        # a link changes with what it points to
+        key += (_stat_key(os.path.realpath(path)),)
+    return key
+
+
+def _read(path, size):
+    with open(path, 'rb') as f:
+        if size < MMAP_SIZE:
+            return f.read()
+        try:
+            return utils.mmap_mmap(f.fileno(), 0, tagname=None, flags=utils.mmap_MAP_PRIVATE)
+        except (OSError, ValueError):
+            return f.read()
+
+
+def classify(path, spellings=()):
+    """Read the file at path once, and return its FileInfo"""
+    info = FileInfo(path, _stat_key(path))
+    if info._stat_key is None:
+        return info
+    info.is_link = os.path.islink(path)
+    try:
+        st = os.stat(path)
+    except (IOError, OSError):
+        info.kind = 'symlink' if info.is_link else 'missing'
+        return info
+    if not stat.S_ISREG(st.st_mode):
+        info.kind = 'symlink' if info.is_link else 'missing'
+        return info
+    info.size = st.st_size
+    try:
+        data = _read(path, st.st_size) if st.st_size else b''
+    except (IOError, OSError) as e:
+        info.kind = 'unreadable'
+        info.error = e
+        return info
+    try:
+        info.sha256 = hashlib.sha256(data).hexdigest()
+        info.mode = 'binary' if data.find(b'\x00') != -1 else 'text'
+        info.prefix_hits = tuple(spelling for spelling in spellings
+                                 if data.find(spelling.encode(utils.codec)) != -1)
+        klass = codefile_class_from_header(path, data[:4])
+        if klass and not info.is_link:
+            info.codefile = klass.__name__
+        if klass:
+            info.kind = klass.__name__
+        elif not st.st_size:
+            info.kind = 'empty'
+        elif data[:2] == b'#!':
+            info.kind = 'script'
+        else:
+            info.kind = info.mode
+    finally:
+        if hasattr(data, 'close'):
+            data.close()
+    return info
+
+
+class FileTable(object):
+    """FileInfo of the files (relative paths) below prefix, kept up to date with the files"""
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.spellings = prefix_spellings(prefix)
+        self._infos = {}
+        self._lock = threading.Lock()
+        self.classified = 0
+
+    def _key(self, f):
+        return f.replace('\\', '/')
+
+    def _classify(self, f):
+        info = classify(os.path.join(self.prefix, f), self.spellings)
+        with self._lock:
+            self._infos[self._key(f)] = info
+            self.classified += 1
+        return info
+
+    def _current(self, f):
+        """The FileInfo of f if it still describes the file, else None"""
+        info = self._infos.get(self._key(f))
+        if info is not None and info._stat_key == _stat_key(info.path):
+            return info
+        return None
+
+    def update(self, files, workers=None, fresh=False):
+        """Classify the files that are new or changed since they were last (all of them if
+        fresh), in parallel"""
+        stale = list(files) if fresh else [f for f in files if self._current(f) is None]
+        if not stale:
+            return 0
+        with trace.span('classify files', files=len(stale)):
+            if len(stale) == 1 or workers == 1:
+                for f in stale:
+                    self._classify(f)
+            else:
+                with ThreadPoolExecutor(min(workers or utils.cpu_count(), len(stale))) as executor:
+                    list(executor.map(self._classify, stale))
+        return len(stale)
+
+    def get(self, f):
+        """The FileInfo of f, classifying it if it is new or changed"""
+        return self._current(f) or self._classify(f)
+
+
+def get_file_table(prefix):
+    """The FileTable of prefix in this process"""
+    with _tables_lock:
+        table = _tables.pop(prefix, None) or FileTable(prefix)
+        _tables[prefix] = table
+        while len(_tables) > MAX_TABLES:
+            _tables.popitem(last=False)
+    return table
@@ -37,7 +37,7 @@ import logging
 import libarchive
 
 
-from . import conda_interface, utils
+from . import conda_interface, trace, utils
 from .conda_interface import MatchSpec, VersionOrder, human_bytes, context
 from .conda_interface import CondaError, CondaHTTPError, get_index, url_path
 from .conda_interface import download, TemporaryDirectory
@@ -174,6 +174,7 @@ def _download_channeldata(channel_url):
     return data
 
 
+@trace.traced(cat='index', args=lambda subdir, *a, **kw: {'subdir': subdir})
 def get_build_index(subdir, bldpkgs_dir, output_folder=None, clear_cache=False,
                     omit_defaults=False, channel_urls=None, debug=False, verbose=True,
                     **kwargs):
@@ -299,6 +300,7 @@ def _ensure_valid_channel(local_folder, subdir):
             os.makedirs(path)
 
 
+@trace.traced(cat='index', args=lambda dir_path, *a, **kw: {'channel': dir_path})
 def update_index(dir_path, check_md5=False, channel_name=None, patch_generator=None, threads=MAX_THREADS_DEFAULT,
                  verbose=False, progress=False, hotfix_source_repo=None, subdirs=None, warn=True):
     """
@@ -325,6 +327,24 @@ def update_index(dir_path, check_md5=False, channel_name=None, patch_generator=N
                                                               hotfix_source_repo=hotfix_source_repo)
 
 
+@trace.traced(cat='index', args=lambda pkg_path, *a, **kw: {'package': pkg_path})
+def update_index_for_package(pkg_path, channel_name=None, verbose=False):
+    """
+    Make the package at pkg_path, which must sit in a subdir of a channel, installable from that
+    channel without re-indexing the rest of it.
+
+    The subdir's repodata.json is updated with just this package.  Channels (or subdirs) that
+    have never been indexed get a full update_index instead, since there is nothing to add to.
+    """
+    subdir_path, fn = os.path.split(abspath(pkg_path))
+    channel_root, subdir = os.path.split(subdir_path)
+    if subdir not in DEFAULT_SUBDIRS or not all(
+            isfile(join(channel_root, d, REPODATA_JSON_FN)) for d in (subdir, 'noarch')):
+        return update_index(channel_root, channel_name=channel_name, verbose=verbose)
+    return ChannelIndex(channel_root, channel_name, subdirs=[subdir]).index_package(
+        subdir, fn, verbose=verbose)
+
+
 def _determine_namespace(info):
     if info.get('namespace'):
         namespace = info['namespace']
@@ -985,6 +1005,64 @@ class ChannelIndex(object):
                 self._write_channeldata_rss(channel_data, package_mtimes, hotfix_source_repo)
                 self._write_channeldata(channel_data)
 
+    def index_package(self, subdir, fn, verbose=False):
+        """Add (or refresh) the single package ``fn`` in the existing repodata.json of ``subdir``.
+
+        Only that package is stat'ed and, if it is new or changed, extracted.  The rest of the
+        repodata is carried over as-is, and repodata2.json, channeldata.json and the html
+        indexes are left alone; a full ``index`` brings those up to date.
+        """
+        level = logging.DEBUG if verbose else logging.ERROR
+        subdir_path = join(self.channel_root, subdir)
+        repodata_json_path = join(subdir_path, REPODATA_JSON_FN)
+        stat_cache_path = join(subdir_path, '.cache', 'stat.json')
+
+        with utils.LoggingContext(level, loggers=[__name__]):
+            with utils.try_acquire_locks([utils.get_lock(self.channel_root)], timeout=900):
+                self._ensure_dirs(subdir)
+                with open(repodata_json_path) as fh:
+                    repodata = json.load(fh)
+                repodata.setdefault('packages', {})
+                try:
+                    with open(stat_cache_path) as fh:
+                        stat_cache = json.load(fh) or {}
+                except (EnvironmentError, JSONDecodeError):
+                    stat_cache = {}
+
+                stat_result = os.lstat(join(subdir_path, fn))
+                cached = stat_cache.get(fn, {})
+                if (fn in repodata['packages'] and not self.deep_integrity_check and
+                        stat_result.st_mtime == cached.get('mtime') and
+                        stat_result.st_size == cached.get('size')):
+                    log.debug("%s is already up to date in %s", fn, repodata_json_path)
+                    return repodata
+
+                log.debug("adding %s to %s", fn, repodata_json_path)
+                fn, mtime, size, index_json = self._extract_to_cache(subdir, fn)
+                if not index_json:
+                    # corrupt package; _extract_to_cache has already reported it
+                    return repodata
+                stat_cache[fn] = {'mtime': mtime, 'size': size}
+                with open(stat_cache_path, 'w') as fh:
+                    json.dump(stat_cache, fh)
+
+                # only the instructions that concern this package apply
+                instructions = self._load_instructions(subdir)
+                package_instructions = {key: [f for f in instructions.get(key, ()) if f == fn]
+                                        for key in ('revoke', 'remove')}
+                package_instructions['packages'] = {f: patch for f, patch
+                                                    in instructions.get('packages', {}).items()
+                                                    if f == fn}
+                package_repodata = _apply_instructions(subdir, {'packages': {fn: index_json}},
+                                                       package_instructions)
+                repodata['packages'].pop(fn, None)
+                repodata['packages'].update(package_repodata['packages'])
+                if package_repodata['removed']:
+                    repodata['removed'] = sorted(set(repodata.get('removed', [])) |
+                                                 set(package_repodata['removed']))
+                self._write_repodata(subdir, repodata)
+        return repodata
+
     def index_subdir(self, subdir, verbose=False, progress=False):
         subdir_path = join(self.channel_root, subdir)
         self._ensure_dirs(subdir)
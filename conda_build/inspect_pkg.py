@@ -7,6 +7,7 @@
 from __future__ import absolute_import, division, print_function
 
 from collections import defaultdict
+import hashlib
 import json
 from operator import itemgetter
 from os.path import abspath, join, dirname, exists, basename
@@ -20,8 +21,8 @@ from conda_build.os_utils.macho import get_rpaths, human_filetype
 from conda_build.utils import (groupby, getter, comma_join, rm_rf, package_has_file, get_logger,
                                ensure_list)
 
-from conda_build.conda_interface import (iteritems, specs_from_args, is_linked, linked_data, linked,
-                                         get_index)
+from conda_build.conda_interface import (iteritems, specs_from_args, is_linked, linked_data,
+                                         get_index, Dist)
 from conda_build.conda_interface import display_actions, install_actions
 from conda_build.conda_interface import memoized
 
@@ -32,15 +33,125 @@ def dist_files(prefix, dist):
     return set(meta['files'])
 
 
+def _conda_meta_signature(prefix):
+    """The names, mtimes and sizes of the package records of prefix"""
+    meta_dir = join(prefix, 'conda-meta')
+    try:
+        names = sorted(fn for fn in os.listdir(meta_dir) if fn.endswith('.json'))
+    except (IOError, OSError):
+        return []
+    signature = []
+    for fn in names:
+        try:
+            st = os.stat(join(meta_dir, fn))
+        except (IOError, OSError):
+            continue
+        signature.append([fn, st.st_mtime, st.st_size])
+    return signature
+
+
+class PrefixOwners(object):
+    """Which of the packages installed in a prefix own which of its files.
+
+    The index is built in one pass over the package records in conda-meta, instead of going
+    through the file list of every package for each file looked up.  With cache_dir, it is
+    also saved there and loaded again for as long as the records keep their mtimes and sizes.
+    """
+    def __init__(self, prefix, signature, cache_dir=None):
+        self.prefix = prefix
+        self.signature = signature
+        self.cache_path = None
+        if cache_dir:
+            digest = hashlib.sha256(abspath(prefix).encode('utf-8')).hexdigest()[:16]
+            self.cache_path = join(cache_dir, digest + '.json')
+        if not self._load():
+            self._build()
+            self._save()
+
+    def _index(self, dists, files):
+        """dists in a fixed order, and for each in-prefix path the indices of its owners"""
+        self.dists = dists
+        self._files = files
+        self._by_name = defaultdict(list)
+        for dist in dists:
+            self._by_name[dist.quad[0]].append(dist)
+
+    def _build(self):
+        records = sorted(iteritems(linked_data(self.prefix)), key=lambda item: str(item[0]))
+        files = defaultdict(list)
+        for n, (_, record) in enumerate(records):
+            for f in record.get('files') or ():
+                files[f].append(n)
+        self._index([dist for dist, _ in records], dict(files))
+
+    def _load(self):
+        if not self.cache_path:
+            return False
+        try:
+            with open(self.cache_path) as f:
+                data = json.load(f)
+            if data['signature'] != self.signature:
+                return False
+            self._index([Dist(dist) for dist in data['dists']], data['files'])
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return False
+        return True
+
+    def _save(self):
+        if not self.cache_path:
+            return
+        tmp = '{}.{}.tmp'.format(self.cache_path, os.getpid())
+        try:
+            if not os.path.isdir(dirname(self.cache_path)):
+                os.makedirs(dirname(self.cache_path))
+            with open(tmp, 'w') as f:
+                json.dump({'signature': self.signature, 'dists': [str(d) for d in self.dists],
+                           'files': self._files}, f)
+            rm_rf(self.cache_path)
+            os.rename(tmp, self.cache_path)
+        except (IOError, OSError) as e:
+            get_logger(__name__).debug("could not save the file owners of %s: %s", self.prefix, e)
+            rm_rf(tmp)
+
+    def owners(self, in_prefix_path):
+        """The packages that installed in_prefix_path (usually just one)"""
+        return [self.dists[n] for n in self._files.get(in_prefix_path.replace(os.sep, '/'), ())]
+
+    def dists_by_name(self, name):
+        return list(self._by_name.get(name, ()))
+
+
+_prefix_owners = {}
+
+
+def _conda_meta_names(prefix):
+    meta_dir = join(prefix, 'conda-meta')
+    try:
+        return os.stat(meta_dir).st_mtime, sorted(os.listdir(meta_dir))
+    except (IOError, OSError):
+        return None
+
+
+def get_prefix_owners(prefix, cache_dir=None):
+    """The PrefixOwners of prefix, rebuilt whenever the packages installed in it change"""
+    # Cheaper than the full signature, as this is called for every file looked up: installing
+    #    or removing a package adds or removes a record, and changes the mtime of conda-meta.
+    names = _conda_meta_names(prefix)
+    owners, owners_names = _prefix_owners.get(prefix, (None, None))
+    if owners is None or owners_names != names:
+        owners = PrefixOwners(prefix, _conda_meta_signature(prefix), cache_dir=cache_dir)
+        _prefix_owners[prefix] = owners, names
+    return owners
+
+
 def which_package(in_prefix_path, prefix):
     """
     given the path of a conda installed file iterate over
     the conda packages the file came from.  Usually the iteration yields
     only one package.
     """
-    for dist in linked(prefix):
-        if in_prefix_path.replace(os.sep, '/') in dist_files(prefix, dist):
-            yield dist
+    for dist in get_prefix_owners(prefix).owners(in_prefix_path):
+        yield dist
 
 
 def print_object_info(info, key):
@@ -195,10 +306,13 @@ def _underlined_text(text):
 
 
 def inspect_linkages(packages, prefix=sys.prefix, untracked=False,
-                     all_packages=False, show_files=False, groupby="package", sysroot=""):
+                     all_packages=False, show_files=False, groupby="package", sysroot="",
+                     owners_cache_dir=None):
     pkgmap = {}
 
     installed = _installed(prefix)
+    # which_package looks every linked file up in this
+    get_prefix_owners(prefix, cache_dir=owners_cache_dir)
 
     if not packages and not untracked and not all_packages:
         raise ValueError("At least one package or --untracked or --all must be provided")
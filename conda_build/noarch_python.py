@@ -1,55 +1,111 @@
-import io
+import codecs
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import json
 import locale
 import logging
+from multiprocessing import cpu_count
 import os
-from os.path import basename, dirname, isdir, join, isfile
+from os.path import basename, dirname, isdir, islink, join, isfile
 import shutil
 import sys
+import time
 
 ISWIN = sys.platform.startswith('win')
+# scripts are told from binaries by this much of their beginning
+HEADER_SIZE = 4096
 
 
 def _force_dir(dirname):
     if not isdir(dirname):
-        os.makedirs(dirname)
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            # made meanwhile by another thread
+            if not isdir(dirname):
+                raise
 
 
 def _error_exit(exit_message):
     sys.exit("[noarch_python] %s" % exit_message)
 
 
+def _is_binary(data):
+    """Whether data, the content of a file, is binary rather than text, going by its beginning"""
+    header = data[:HEADER_SIZE]
+    if b'\0' in header:
+        return True
+    decoder = codecs.getincrementaldecoder(locale.getpreferredencoding())()
+    try:
+        # a character may be cut at the end of the header
+        decoder.decode(header, final=len(data) <= HEADER_SIZE)
+    except UnicodeDecodeError:
+        return True
+    return False
+
+
+def _native_newlines(data):
+    """data with the newlines of the platform, as reading and writing it in text mode gives"""
+    data = data.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+    return data.replace(b'\n', b'\r\n') if ISWIN else data
+
+
+def _script_name(fn):
+    """The name of the script fn of the bin directory in the python-scripts directory"""
+    # Get rid of '-script.py' suffix on Windows
+    if ISWIN and fn.endswith('-script.py'):
+        return fn[:-10]
+    return fn
+
+
 def rewrite_script(fn, prefix):
-    """Take a file from the bin directory and rewrite it into the python-scripts
+    """Take a file from the bin directory and move it into the python-scripts
     directory with the same permissions after it passes some sanity checks for
-    noarch pacakges"""
+    noarch pacakges.  It is renamed unless its newlines need rewriting."""
 
-    # Load and check the source file for not being a binary
+    # Check the source file for not being a binary
     src = join(prefix, 'Scripts' if ISWIN else 'bin', fn)
-    with io.open(src, encoding=locale.getpreferredencoding()) as fi:
-        try:
-            data = fi.read()
-        except UnicodeDecodeError:  # file is binary
-            _error_exit("Noarch package contains binary script: %s" % fn)
-    src_mode = os.stat(src).st_mode
-    os.unlink(src)
+    with open(src, 'rb') as fi:
+        data = fi.read()
+    if _is_binary(data):
+        _error_exit("Noarch package contains binary script: %s" % fn)
 
-    # Get rid of '-script.py' suffix on Windows
-    if ISWIN and fn.endswith('-script.py'):
-        fn = fn[:-10]
+    fn = _script_name(fn)
 
-    # Rewrite the file to the python-scripts directory
+    # Move the file to the python-scripts directory, with the newlines of the
+    # platform (a CRLF shebang does not work on unix)
     dst_dir = join(prefix, 'python-scripts')
     _force_dir(dst_dir)
     dst = join(dst_dir, fn)
-    with open(dst, 'w') as fo:
-        fo.write(data)
-    os.chmod(dst, src_mode)
+    if isfile(dst):
+        os.unlink(dst)
+    native = _native_newlines(data)
+    if native == data and not islink(src):
+        os.rename(src, dst)
+    else:
+        src_mode = os.stat(src).st_mode
+        with open(dst, 'wb') as fo:
+            fo.write(native)
+        os.chmod(dst, src_mode)
+        os.unlink(src)
     return fn
 
 
-def handle_file(f, d, prefix):
-    """Process a file for inclusion in a noarch python package.
+def rewrite_scripts(fns, prefix, workers=None):
+    """rewrite_script the files fns of the bin directory, on a pool of threads.  Returns their
+    names in the python-scripts directory."""
+    if not fns:
+        return []
+    start = time.time()
+    with ThreadPoolExecutor(min(workers or cpu_count(), len(fns))) as executor:
+        names = list(executor.map(partial(rewrite_script, prefix=prefix), fns))
+    print("moved {} scripts to python-scripts in {:.2f}s".format(len(names), time.time() - start))
+    return names
+
+
+def handle_file(f, d, prefix, scripts=None):
+    """Process a file for inclusion in a noarch python package.  Scripts are
+    added to scripts, to be rewritten later, if it is given.
     """
     path = join(prefix, f)
 
@@ -75,7 +131,11 @@ def handle_file(f, d, prefix):
     # Treat scripts specially with the logic from above
     elif f.startswith(('bin/', 'Scripts')):
         fn = basename(path)
-        fn = rewrite_script(fn, prefix)
+        if scripts is None:
+            fn = rewrite_script(fn, prefix)
+        else:
+            scripts.append(fn)
+            fn = _script_name(fn)
         d['python-scripts'].append(fn)
 
     # Include examples in the metadata doc
@@ -96,8 +156,10 @@ def populate_files(m, files, prefix, entry_point_scripts=None):
          'Examples': []}
 
     # Populate site-package, python-scripts, and Examples into above
+    scripts = []
     for f in files:
-        handle_file(f, d, prefix)
+        handle_file(f, d, prefix, scripts)
+    rewrite_scripts(scripts, prefix)
 
     # Windows path conversion
     if ISWIN:
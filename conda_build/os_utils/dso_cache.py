@@ -0,0 +1,229 @@
+'''
+Persistent cache of what liefldd finds out about DSOs: their linkages, exports, imports,
+relocations and symbols.
+
+LIEF is slow to parse large libraries, and every build looks at the same ones again (libstdc++,
+libpython, MKL, ...).  Results are kept in a sqlite database that all builds using it share,
+with sqlite doing the locking between them.  They are keyed by the SHA1 of the file's content
+and the call that produced them.  So that a file need not be read to look it up, the content
+hash is remembered for the file's (device, inode, size, mtime); files hardlinked from the
+package cache keep those from one build to the next.
+
+Unless ``dso_cache`` says otherwise, the database is ``<croot>/dso_cache.sqlite``.  Results
+used least recently are evicted to keep it under ``dso_cache_max_size`` (0 turns it off).
+'''
+from __future__ import absolute_import, division, print_function
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from conda_build.utils import get_logger
+
+DB_FILE = 'dso_cache.sqlite'
+DEFAULT_MAX_SIZE = 512 << 20
+# bump when what is stored changes; older databases are emptied
+SCHEMA_VERSION = 1
+# store this many results between checks of the size of the cache
+EVICT_EVERY = 50
+# don't record a use of a result more often than this (seconds), to spare writes
+TOUCH_INTERVAL = 3600
+
+MISSING = object()
+
+_schema = '''
+CREATE TABLE IF NOT EXISTS files (
+    stat_key TEXT PRIMARY KEY,
+    digest TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    digest TEXT NOT NULL,
+    call TEXT NOT NULL,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    used REAL NOT NULL,
+    PRIMARY KEY (digest, call)
+);
+CREATE INDEX IF NOT EXISTS results_used ON results (used);
+'''
+
+_caches = {}
+_caches_lock = threading.Lock()
+_active = None
+
+
+def stat_key(st):
+    """Identify a version of a file by its device, inode, size and mtime"""
+    mtime = getattr(st, 'st_mtime_ns', None) or int(st.st_mtime * 1e9)
+    return '{}:{}:{}:{}'.format(st.st_dev, st.st_ino, st.st_size, mtime)
+
+
+def _sha1(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(65536)
+            if not data:
+                break
+            sha1.update(data)
+    return sha1.hexdigest()
+
+
+def _encode(value):
+    if isinstance(value, (set, frozenset)):
+        return json.dumps({'set': sorted(value)})
+    return json.dumps({'value': value})
+
+
+def _decode(text):
+    value = json.loads(text)
+    return set(value['set']) if 'set' in value else value['value']
+
+
+class DSOCache(object):
+    def __init__(self, path, max_size=DEFAULT_MAX_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stored = 0
+        self.hits = 0
+        self.content_hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        # a forked worker must not use its parent's connection
+        if conn is None or self._local.pid != os.getpid():
+            dirname = os.path.dirname(os.path.abspath(self.path))
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            # concurrent builds wait for each other's writes rather than failing
+            conn = sqlite3.connect(self.path, timeout=60)
+            if conn.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+                with conn:
+                    conn.executescript('DROP TABLE IF EXISTS files; DROP TABLE IF EXISTS results;')
+                    conn.execute('PRAGMA user_version = {}'.format(SCHEMA_VERSION))
+            conn.executescript(_schema)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _failed(self, e):
+        self._count('errors')
+        get_logger(__name__).debug("DSO cache %s: %s", self.path, e)
+
+    def _digest(self, conn, path, st):
+        """The content hash of path, and whether it was known from its stat_key"""
+        key = stat_key(st)
+        row = conn.execute('SELECT digest FROM files WHERE stat_key = ?', (key,)).fetchone()
+        if row:
+            return row[0], True
+        digest = _sha1(path)
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO files VALUES (?, ?)', (key, digest))
+        return digest, False
+
+    def get(self, path, st, call):
+        """The stored result of call for the file at path (with os.stat result st), or MISSING"""
+        try:
+            conn = self._conn()
+            digest, by_stat = self._digest(conn, path, st)
+            row = conn.execute('SELECT value, used FROM results WHERE digest = ? AND call = ?',
+                               (digest, call)).fetchone()
+            if row:
+                now = time.time()
+                if row[1] < now - TOUCH_INTERVAL:
+                    with conn:
+                        conn.execute('UPDATE results SET used = ? WHERE digest = ? AND call = ?',
+                                     (now, digest, call))
+                self._count('hits' if by_stat else 'content_hits')
+                return _decode(row[0])
+        except (sqlite3.Error, EnvironmentError, ValueError, KeyError) as e:
+            self._failed(e)
+            return MISSING
+        self._count('misses')
+        return MISSING
+
+    def put(self, path, st, call, value):
+        try:
+            text = _encode(value)
+        except (TypeError, ValueError):
+            return  # only kept in memory
+        try:
+            conn = self._conn()
+            digest, _ = self._digest(conn, path, st)
+            with conn:
+                conn.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)',
+                             (digest, call, text, len(text), time.time()))
+        except (sqlite3.Error, EnvironmentError) as e:
+            self._failed(e)
+            return
+        with self._lock:
+            self._stored += 1
+            evict = self._stored % EVICT_EVERY == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """Remove the results used least recently until the cache is below max_size"""
+        try:
+            conn = self._conn()
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+            if total <= self.max_size:
+                return 0
+            remove = []
+            for rowid, size in conn.execute('SELECT rowid, size FROM results ORDER BY used, rowid'):
+                if total <= self.max_size * 0.9:
+                    break
+                remove.append((rowid,))
+                total -= size
+            with conn:
+                conn.executemany('DELETE FROM results WHERE rowid = ?', remove)
+                conn.execute('DELETE FROM files WHERE digest NOT IN '
+                             '(SELECT DISTINCT digest FROM results)')
+            return len(remove)
+        except sqlite3.Error as e:
+            self._failed(e)
+            return 0
+
+    def summary(self):
+        looked_up = self.hits + self.content_hits + self.misses
+        rate = 100.0 * (self.hits + self.content_hits) / looked_up if looked_up else 0.0
+        return ("DSO cache {}: {} hits ({} by content hash), {} misses, {:.0f}% hit rate, "
+                "{} errors".format(self.path, self.hits + self.content_hits, self.content_hits,
+                                   self.misses, rate, self.errors))
+
+
+def cache_path(config):
+    return config.dso_cache or os.path.join(config.croot, DB_FILE)
+
+
+def activate(config):
+    """Make liefldd use the cache config asks for (or none) from now on, and return it"""
+    global _active
+    from conda_build.build_cache import parse_size
+    size = config.dso_cache_max_size
+    max_size = DEFAULT_MAX_SIZE if size is None else (parse_size(size) or 0)
+    if not max_size:
+        _active = None
+        return None
+    path = cache_path(config)
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = DSOCache(path, max_size)
+        _caches[path].max_size = max_size
+        _active = _caches[path]
+    return _active
+
+
+def active():
+    return _active
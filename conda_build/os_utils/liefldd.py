@@ -1,4 +1,5 @@
 from collections import Hashable
+from functools import partial
 import hashlib
 import json
 import os
@@ -8,11 +9,14 @@ import threading
 
 from six import string_types
 
+from . import dso_cache
 # TODO :: Remove all use of pyldd
 # Currently we verify the output of each against the other
 from .pyldd import inspect_linkages as inspect_linkages_pyldd
 # lief cannot handle files it doesn't know about gracefully
 from .pyldd import codefile_type as codefile_type_pyldd
+# LIEF parses all of a binary to list its symbols, pyldd only reads its symbol tables
+from .pyldd import get_symbols as get_symbols_pyldd
 codefile_type = codefile_type_pyldd
 have_lief = False
 try:
@@ -458,6 +462,10 @@ def get_exports(file, arch='native'):
                 # should not cause a failure, see gh-3287
                 print('WARNING: nm: failed to get_exports({})'.format(file))
 
+    if not result and is_string(file):
+        exports = get_symbols_pyldd(file, defined=True, undefined=False, arch=arch)
+        if exports is not None:
+            return exports
     if not result:
         binary = ensure_binary(file)
         if binary:
@@ -484,6 +492,10 @@ def get_relocations(filename, arch='native'):
 
 
 def get_symbols(file, defined=True, undefined=True, arch='native'):
+    if is_string(file):
+        symbols = get_symbols_pyldd(file, defined=defined, undefined=undefined, arch=arch)
+        if symbols is not None:
+            return symbols
     binary = ensure_binary(file)
     try:
         if binary.__class__ == lief.MachO.Binary and binary.has_dyld_info:
@@ -608,27 +620,95 @@ class memoized_by_arg0_filehash(object):
                 return value
 
 
-@memoized_by_arg0_inode
+class memoized_by_arg0_dso_cache(object):
+    """Decorator. Caches a function's return value each time it is called.
+    If called later with the same arguments, the cached value is returned
+    (not reevaluated).
+
+    The first argument is required to be an existing filename, which is
+    identified by its device, inode, size and mtime.  Unless persistent is
+    False, values are also kept in the persistent DSO cache (see dso_cache),
+    when one is active, so that other processes and later builds get them too.
+    Otherwise they are cached for the file at the same path only.
+    """
+    def __init__(self, func, persistent=True, version=None):
+        self.func = func
+        self.persistent = persistent
+        self.cache = {}
+        self.lock = threading.Lock()
+        self.version = getattr(lief, '__version__', None) if have_lief else None
+        if version:
+            self.version = '{}+{}'.format(self.version, version)
+
+    def _key(self, args, kw):
+        newargs = []
+        for arg in args[1:]:
+            if isinstance(arg, list):
+                newargs.append(tuple(arg))
+            elif not isinstance(arg, Hashable):
+                # uncacheable. a list, for instance.
+                # better to not cache than blow up.
+                return None, None, None
+            else:
+                newargs.append(arg)
+        st = os.stat(args[0])
+        try:
+            call = json.dumps([self.func.__name__, self.version, newargs, sorted(kw.items())])
+        except TypeError:
+            return None, None, None
+        return (dso_cache.stat_key(st), call, None if self.persistent else args[0]), st, call
+
+    def seed(self, value, *args, **kw):
+        """Cache value as the result of calling with these arguments (e.g. computed elsewhere)"""
+        key, _, _ = self._key(args, kw)
+        if key is not None:
+            with self.lock:
+                self.cache[key] = value
+
+    def __call__(self, *args, **kw):
+        key, st, call = self._key(args, kw)
+        if key is None:
+            return self.func(*args, **kw)
+        with self.lock:
+            if key in self.cache:
+                return self.cache[key]
+        persistent = dso_cache.active() if self.persistent else None
+        value = persistent.get(args[0], st, call) if persistent else dso_cache.MISSING
+        if value is dso_cache.MISSING:
+            value = self.func(*args, **kw)
+            if persistent:
+                persistent.put(args[0], st, call, value)
+        with self.lock:
+            self.cache[key] = value
+        return value
+
+
+# bump when what pyldd finds out about symbols changes
+PYLDD_SYMBOLS_VERSION = 'pyldd-symbols-1'
+
+
+@partial(memoized_by_arg0_dso_cache, version=PYLDD_SYMBOLS_VERSION)
 def get_exports_memoized(filename, arch='native'):
     return get_exports(filename, arch=arch)
 
 
-@memoized_by_arg0_filehash
+@memoized_by_arg0_dso_cache
 def get_imports_memoized(filename, arch='native'):
     return get_imports(filename, arch=arch)
 
 
-@memoized_by_arg0_filehash
+@memoized_by_arg0_dso_cache
 def get_relocations_memoized(filename, arch='native'):
     return get_relocations(filename, arch=arch)
 
 
-@memoized_by_arg0_filehash
+@partial(memoized_by_arg0_dso_cache, version=PYLDD_SYMBOLS_VERSION)
 def get_symbols_memoized(filename, defined, undefined, arch):
     return get_symbols(filename, defined=defined, undefined=undefined, arch=arch)
 
 
-@memoized_by_arg0_filehash
+# Linkages resolved in an environment depend on more than the file itself
+@partial(memoized_by_arg0_dso_cache, persistent=False)
 def get_linkages_memoized(filename, resolve_filenames, recurse,
                           sysroot='', envroot='', arch='native'):
     return get_linkages(filename, resolve_filenames=resolve_filenames,
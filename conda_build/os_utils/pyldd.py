@@ -1,6 +1,8 @@
 from __future__ import print_function
 import argparse
 import glob
+import itertools
+import mmap
 import os
 import re
 import struct
@@ -136,6 +138,14 @@ LC_LOAD_DYLIBS = (LC_LOAD_DYLIB,
                   LC_REEXPORT_DYLIB)
 LC_REQ_DYLD = 0x80000000
 LC_RPATH = 0x1c | LC_REQ_DYLD
+LC_SYMTAB = 0x2
+LC_DYLD_INFO = 0x22
+LC_DYLD_INFO_ONLY = 0x22 | LC_REQ_DYLD
+LC_DYLD_EXPORTS_TRIE = 0x33 | LC_REQ_DYLD
+N_STAB = 0xe0
+N_TYPE = 0x0e
+N_EXT = 0x01
+N_UNDF = 0x0
 majver = sys.version_info[0]
 maxint = majver == 3 and getattr(sys, 'maxsize') or getattr(sys, 'maxint')
 
@@ -225,6 +235,63 @@ class fileview(object):
         return bytes
 
 
+# Headers are decoded with struct.unpack_from straight out of the file, mmapped once, rather
+#    than through many small seeks and reads.  Only what the headers point to is looked at:
+#    the dynamic section and the strings it refers to for ELF, the load commands for Mach-O.
+
+_structs = {}
+
+
+def _struct(fmt):
+    st = _structs.get(fmt)
+    if st is None:
+        st = _structs[fmt] = struct.Struct(fmt)
+    return st
+
+
+def _map(file):
+    """The content of the open file, mmapped if possible"""
+    file = getattr(file, '_file_obj', file)
+    try:
+        fileno = file.fileno()
+        if os.fstat(fileno).st_size:
+            return mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+    except (AttributeError, EnvironmentError, ValueError):
+        pass
+    file.seek(0)
+    return file.read()
+
+
+def _unmap(data):
+    if isinstance(data, mmap.mmap):
+        try:
+            data.close()
+        except BufferError:
+            pass  # a view of it is still alive; it is closed when collected
+
+
+def _unpack_from(fmt, data, offset=0):
+    st = _struct(fmt)
+    if offset < 0 or offset + st.size > len(data):
+        raise IncompleteRead('{} bytes at offset {} are past the end of the file'.format(st.size, offset))
+    return st.unpack_from(data, offset)
+
+
+def _window(data, offset, size):
+    """A view of size bytes of data from offset, without copying them"""
+    if offset < 0 or offset + size > len(data):
+        raise IncompleteRead('{} bytes at offset {} are past the end of the file'.format(size, offset))
+    if majver == 3:
+        return memoryview(data)[offset:offset + size]
+    return buffer(data, offset, size)  # noqa
+
+
+def _cstring(data, start, end):
+    """The NUL terminated string at start (it stops at end, if it is not terminated by then)"""
+    stop = data.find(b'\0', start, end)
+    return data[start:end if stop < 0 else stop].decode('utf-8')
+
+
 class UnixExecutable(object):
     def __init__(self, file, initial_rpaths_transitive=[]):
         self.rpaths_transitive = []
@@ -482,26 +549,84 @@ def _get_resolved_relocated_location(codefile, so, src_exedir, src_selfdir,
     return src_resolved, dst_resolved, in_sysroot
 
 
+_MACHO_ARCHS = ((MH_MAGIC, 32, BIG_ENDIAN, ('any', 'ppc32', 'm68k')),
+                (MH_CIGAM, 32, LITTLE_ENDIAN, ('any', 'i386')),
+                (MH_MAGIC_64, 64, BIG_ENDIAN, ('any', 'ppc64')),
+                (MH_CIGAM_64, 64, LITTLE_ENDIAN, ('any', 'x86_64')))
+
+
+def _macho_slices(data, arch, offset=0, size=None):
+    """(bits, endian, view) of each Mach-O binary for arch in data, as do_file finds them"""
+    view = _window(data, offset, len(data) - offset if size is None else size)
+    magic, = _unpack_from(BIG_ENDIAN + 'L', view)
+    if magic == FAT_MAGIC:
+        nfat_arch, = _unpack_from(BIG_ENDIAN + 'L', view, 4)
+        for n in range(nfat_arch):
+            _cputype, _cpusubtype, offset, size, _align = \
+                _unpack_from(BIG_ENDIAN + 'L' * 5, view, 8 + n * 20)
+            for macho in _macho_slices(data, arch, offset, size):
+                yield macho
+    for magic_, bits, endian, archs in _MACHO_ARCHS:
+        if magic == magic_ and arch in archs:
+            yield bits, endian, view
+
+
+def _macho_load_commands(view, bits, endian):
+    """The filetype of the Mach-O binary in view, and (cmd, where, cmdsize) of its load commands"""
+    _cputype, _cpusubtype, filetype, ncmds, _sizeofcmds, _flags = _unpack_from(endian + 'L' * 6, view, 4)
+    where = 32 if bits == 64 else 28
+    commands = []
+    for _n in range(ncmds):
+        cmd, cmdsize = _unpack_from(endian + 'LL', view, where)
+        commands.append((cmd, where, cmdsize))
+        if cmdsize < 8:
+            raise IncompleteRead('load command of {} bytes'.format(cmdsize))
+        where += cmdsize
+    return filetype, commands
+
+
+def _macho_lc_str(view, endian, where, cmdsize):
+    """The string a load command carries (the one of LC_*_DYLIB and LC_RPATH commands)"""
+    name_offset, = _unpack_from(endian + 'L', view, where + 8)
+    load = bytes(_window(view, where + name_offset, cmdsize - name_offset)).decode()
+    return load[:load.index('\0')]
+
+
 class machofile(UnixExecutable):
     def __init__(self, file, arch, initial_rpaths_transitive=[]):
         self.filename = file.name
         self.shared_libraries = []
         self.dt_runpath = []
+        self.rpaths_transitive = []
+        self.rpaths_nontransitive = []
         self._dir = os.path.dirname(file.name)
-        results = mach_o_find_dylibs(file, arch)
-        if not results:
+        data = _map(file)
+        try:
+            sos, rpaths = self._load_commands(data, arch)
+        finally:
+            _unmap(data)
+        if sos is None:
             return
-        _, sos = zip(*results)
-        file.seek(0)
         self.rpaths_transitive = initial_rpaths_transitive
-        _filetypes, rpaths = zip(*mach_o_find_rpaths(file, arch))
         local_rpaths = [self.from_os_varnames(rpath.rstrip('/'))
-                        for rpath in rpaths[0] if rpath]
+                        for rpath in rpaths if rpath]
         self.rpaths_transitive.extend(local_rpaths)
         self.rpaths_nontransitive = local_rpaths
         self.shared_libraries.extend(
-            [(so, self.from_os_varnames(so)) for so in sos[0] if so])
-        file.seek(0)
+            [(so, self.from_os_varnames(so)) for so in sos if so])
+
+    def _load_commands(self, data, arch):
+        'The dylibs and rpaths of the first binary for arch, in one pass over its load commands'
+        for bits, endian, view in _macho_slices(data, arch):
+            _filetype, commands = _macho_load_commands(view, bits, endian)
+            sos, rpaths = [], []
+            for cmd, where, cmdsize in commands:
+                if cmd & ~LC_REQ_DYLD in LC_LOAD_DYLIBS:
+                    sos.append(_macho_lc_str(view, endian, where, cmdsize))
+                elif cmd == LC_RPATH:
+                    rpaths.append(_macho_lc_str(view, endian, where, cmdsize))
+            return sos, rpaths
+        return None, None
 
     def to_os_varnames(self, input_):
         """Don't make these functions - they are methods to match the API for elffiles."""
@@ -647,44 +772,34 @@ DT_HIOS = 0x6fffffff
 DT_LOPROC = 0x70000000
 DT_HIPROC = 0x7fffffff
 
+SHN_UNDEF = 0
+STB_GLOBAL = 1
+STB_WEAK = 2
+STT_FUNC = 2
+
 
 class elfheader(object):
-    def __init__(self, file):
-        self.hdr, = struct.unpack(BIG_ENDIAN + 'L', file.read(4))
+    def __init__(self, data):
+        self.hdr, = _unpack_from(BIG_ENDIAN + 'L', data)
         self.dt_needed = []
         self.dt_rpath = []
         if self.hdr != ELF_HDR:
             return
-        bitness, = struct.unpack(LITTLE_ENDIAN + 'B', file.read(1))
+        bitness, endian, self.version, self.osabi, self.abiver = _unpack_from('BBBBB', data, 4)
         bitness = 32 if bitness == 1 else 64
         sz_ptr = int(bitness / 8)
         ptr_type = 'Q' if sz_ptr == 8 else 'L'
         self.bitness = bitness
         self.sz_ptr = sz_ptr
         self.ptr_type = ptr_type
-        endian, = struct.unpack(LITTLE_ENDIAN + 'B', file.read(1))
         endian = LITTLE_ENDIAN if endian == 1 else BIG_ENDIAN
         self.endian = endian
-        self.version, = struct.unpack(endian + 'B', file.read(1))
-        self.osabi, = struct.unpack(endian + 'B', file.read(1))
-        self.abiver, = struct.unpack(endian + 'B', file.read(1))
-        struct.unpack(endian + 'B' * 7, file.read(7))
-        self.type, = struct.unpack(endian + 'H', file.read(2))
-        self.machine, = struct.unpack(endian + 'H', file.read(2))
-        self.version, = struct.unpack(endian + 'L', file.read(4))
-        self.entry, = struct.unpack(endian + ptr_type, file.read(sz_ptr))
-        self.phoff, = struct.unpack(endian + ptr_type, file.read(sz_ptr))
-        self.shoff, = struct.unpack(endian + ptr_type, file.read(sz_ptr))
-        self.flags, = struct.unpack(endian + 'L', file.read(4))
-        self.ehsize, = struct.unpack(endian + 'H', file.read(2))
-        self.phentsize, = struct.unpack(endian + 'H', file.read(2))
-        self.phnum, = struct.unpack(endian + 'H', file.read(2))
-        self.shentsize, = struct.unpack(endian + 'H', file.read(2))
-        self.shnum, = struct.unpack(endian + 'H', file.read(2))
-        self.shstrndx, = struct.unpack(endian + 'H', file.read(2))
-        loc = file.tell()
+        (self.type, self.machine, self.version, self.entry, self.phoff, self.shoff, self.flags,
+         self.ehsize, self.phentsize, self.phnum, self.shentsize, self.shnum, self.shstrndx) = \
+            _unpack_from(endian + 'HHL' + ptr_type * 3 + 'LHHHHHH', data, 16)
+        loc = 16 + _struct(endian + 'HHL' + ptr_type * 3 + 'LHHHHHH').size
         if loc != self.ehsize:
-            get_logger(__name__).warning('file.tell()={} != ehsize={}'.format(loc, self.ehsize))
+            get_logger(__name__).warning('header size={} != ehsize={}'.format(loc, self.ehsize))
 
     def __str__(self):
         return 'bitness {}, endian {}, version {}, type {}, machine {}, entry {}'.format( # noqa
@@ -697,147 +812,128 @@ class elfheader(object):
 
 
 class elfsection(object):
-    def __init__(self, eh, file):
+    __slots__ = ('sh_name', 'sh_type', 'sh_flags', 'sh_addr', 'sh_offset', 'sh_size', 'sh_link',
+                 'sh_info', 'sh_addralign', 'sh_entsize')
+
+    def __init__(self, eh, data, offset):
         ptr_type = eh.ptr_type
-        sz_ptr = eh.sz_ptr
-        endian = eh.endian
-        # It'd be quicker to use struct.calcsize here and a single
-        # struct.unpack but it would be ugly and harder to maintain.
-        self.sh_name, = struct.unpack(endian + 'L', file.read(4))
-        self.sh_type, = struct.unpack(endian + 'L', file.read(4))
-        self.sh_flags, = struct.unpack(endian + ptr_type, file.read(sz_ptr))
-        self.sh_addr, = struct.unpack(endian + ptr_type, file.read(sz_ptr))
-        self.sh_offset, = struct.unpack(endian + ptr_type, file.read(sz_ptr))
-        self.sh_size, = struct.unpack(endian + ptr_type, file.read(sz_ptr))
-        self.sh_link, = struct.unpack(endian + 'L', file.read(4))
-        self.sh_info, = struct.unpack(endian + 'L', file.read(4))
-        self.sh_addralign, = struct.unpack(endian + ptr_type, file.read(sz_ptr))
-        self.sh_entsize, = struct.unpack(endian + ptr_type, file.read(sz_ptr))
-        # Lower priority == post processed earlier so that those
-        # with higher priority can assume already initialized.
-        if self.sh_type == SHT_STRTAB:
-            self.priority = 0
-        else:
-            self.priority = 1
-
-    def postprocess(self, elffile, file):
-        ptr_type = elffile.ehdr.ptr_type
-        sz_ptr = elffile.ehdr.sz_ptr
-        endian = elffile.ehdr.endian
-        if self.sh_type == SHT_STRTAB:
-            file.seek(self.sh_offset)
-            self.table = file.read(self.sh_size).decode()
-        elif self.sh_type == SHT_DYNAMIC:
-            #
-            # Required reading 1:
-            # http://blog.qt.io/blog/2011/10/28/rpath-and-runpath/
-            #
-            # Unless loading object has RUNPATH:
-            #   RPATH of the loading object,
-            #     then the RPATH of its loader (unless it has a RUNPATH), ...,
-            #     until the end of the chain, which is either the executable
-            #     or an object loaded by dlopen
-            #   Unless executable has RUNPATH:
-            #     RPATH of the executable
-            # LD_LIBRARY_PATH
-            # RUNPATH of the loading object
-            # ld.so.cache
-            # default dirs
-            #
-            # Required reading 2:
-            # http://www.lumiera.org/documentation/technical/code/linkingStructure.html
-            #
-            # the $ORIGIN token
-            #
-            # To support flexible RUNPATH (and RPATH) settings, the GNU ld.so
-            # (also the SUN and Irix linkers) allow the usage of some "magic"
-            # tokens in the .dynamic section of ELF binaries (both libraries
-            # and executables):
-            #
-            # $ORIGIN
-            #
-            # the directory containing the executable or library actually
-            # triggering the current (innermost) resolution step. Not to be
-            # confused with the entity causing the whole linking procedure
-            # (an executable to be executed or a dlopen() call)
-            #
-            # $PLATFORM
-            #
-            # expands to the architecture/platform tag as provided by the OS
-            # kernel
-            #
-            # $LIB
-            #
-            # the system libraries directory, which is /lib for the native
-            # architecture on FHS compliant GNU/Linux systems.
-            #
-            dt_strtab_ptr = None
-            dt_needed = []
-            dt_rpath = []
-            dt_runpath = []
-            dt_soname = '$EXECUTABLE'
-            for m in range(int(self.sh_size / self.sh_entsize)):
-                file.seek(self.sh_offset + (m * self.sh_entsize))
-                d_tag, = struct.unpack(endian + ptr_type, file.read(sz_ptr))
-                d_val_ptr, = struct.unpack(endian + ptr_type, file.read(sz_ptr))
-                if d_tag == DT_NEEDED:
-                    dt_needed.append(d_val_ptr)
-                elif d_tag == DT_RPATH:
-                    dt_rpath.append(d_val_ptr)
-                elif d_tag == DT_RUNPATH:
-                    dt_runpath.append(d_val_ptr)
-                elif d_tag == DT_STRTAB:
-                    dt_strtab_ptr = d_val_ptr
-                elif d_tag == DT_SONAME:
-                    dt_soname = d_val_ptr
-            if dt_strtab_ptr:
-                strsec, _offset = elffile.find_section_and_offset(dt_strtab_ptr)
-                if strsec and strsec.sh_type == SHT_STRTAB:
-                    for n in dt_needed:
-                        end = n + strsec.table[n:].index('\0')
-                        elffile.dt_needed.append(strsec.table[n:end])
-                    for r in dt_rpath:
-                        end = r + strsec.table[r:].index('\0')
-                        path = strsec.table[r:end]
-                        rpaths = [p for p in path.split(':') if path]
-                        elffile.dt_rpath.extend([p.rstrip('/') for p in rpaths])
-                    for r in dt_runpath:
-                        end = r + strsec.table[r:].index('\0')
-                        path = strsec.table[r:end]
-                        rpaths = [p for p in path.split(':') if path]
-                        elffile.dt_runpath.extend([p.rstrip('/') for p in rpaths])
-                    if dt_soname != '$EXECUTABLE':
-                        end = dt_soname + strsec.table[dt_soname:].index('\0')
-                        elffile.dt_soname = strsec.table[dt_soname:end]
-
-            # runpath always takes precedence.
-            if len(elffile.dt_runpath):
-                elffile.dt_rpath = []
+        (self.sh_name, self.sh_type, self.sh_flags, self.sh_addr, self.sh_offset, self.sh_size,
+         self.sh_link, self.sh_info, self.sh_addralign, self.sh_entsize) = \
+            _unpack_from(eh.endian + 'LL' + ptr_type * 4 + 'LL' + ptr_type * 2, data, offset)
+
+    def dynamic_entries(self, eh, data):
+        """(d_tag, d_val) of each entry of this SHT_DYNAMIC section"""
+        entry = eh.endian + eh.ptr_type * 2
+        for m in range(int(self.sh_size / self.sh_entsize) if self.sh_entsize else 0):
+            yield _unpack_from(entry, data, self.sh_offset + (m * self.sh_entsize))
+
+    def postprocess(self, elffile, data):
+        if self.sh_type != SHT_DYNAMIC:
+            return
+        #
+        # Required reading 1:
+        # http://blog.qt.io/blog/2011/10/28/rpath-and-runpath/
+        #
+        # Unless loading object has RUNPATH:
+        #   RPATH of the loading object,
+        #     then the RPATH of its loader (unless it has a RUNPATH), ...,
+        #     until the end of the chain, which is either the executable
+        #     or an object loaded by dlopen
+        #   Unless executable has RUNPATH:
+        #     RPATH of the executable
+        # LD_LIBRARY_PATH
+        # RUNPATH of the loading object
+        # ld.so.cache
+        # default dirs
+        #
+        # Required reading 2:
+        # http://www.lumiera.org/documentation/technical/code/linkingStructure.html
+        #
+        # the $ORIGIN token
+        #
+        # To support flexible RUNPATH (and RPATH) settings, the GNU ld.so
+        # (also the SUN and Irix linkers) allow the usage of some "magic"
+        # tokens in the .dynamic section of ELF binaries (both libraries
+        # and executables):
+        #
+        # $ORIGIN
+        #
+        # the directory containing the executable or library actually
+        # triggering the current (innermost) resolution step. Not to be
+        # confused with the entity causing the whole linking procedure
+        # (an executable to be executed or a dlopen() call)
+        #
+        # $PLATFORM
+        #
+        # expands to the architecture/platform tag as provided by the OS
+        # kernel
+        #
+        # $LIB
+        #
+        # the system libraries directory, which is /lib for the native
+        # architecture on FHS compliant GNU/Linux systems.
+        #
+        dt_strtab_ptr = None
+        dt_needed = []
+        dt_rpath = []
+        dt_runpath = []
+        dt_soname = '$EXECUTABLE'
+        for d_tag, d_val_ptr in self.dynamic_entries(elffile.ehdr, data):
+            if d_tag == DT_NEEDED:
+                dt_needed.append(d_val_ptr)
+            elif d_tag == DT_RPATH:
+                dt_rpath.append(d_val_ptr)
+            elif d_tag == DT_RUNPATH:
+                dt_runpath.append(d_val_ptr)
+            elif d_tag == DT_STRTAB:
+                dt_strtab_ptr = d_val_ptr
+            elif d_tag == DT_SONAME:
+                dt_soname = d_val_ptr
+        if dt_strtab_ptr:
+            strsec, _offset = elffile.find_section_and_offset(dt_strtab_ptr)
+            if strsec and strsec.sh_type == SHT_STRTAB:
+                # only the strings the dynamic section refers to are read
+                start = strsec.sh_offset + _offset
+                end = strsec.sh_offset + strsec.sh_size
+
+                def string(n):
+                    return _cstring(data, start + n, end)
+                for n in dt_needed:
+                    elffile.dt_needed.append(string(n))
+                for r in dt_rpath:
+                    path = string(r)
+                    rpaths = [p for p in path.split(':') if path]
+                    elffile.dt_rpath.extend([p.rstrip('/') for p in rpaths])
+                for r in dt_runpath:
+                    path = string(r)
+                    rpaths = [p for p in path.split(':') if path]
+                    elffile.dt_runpath.extend([p.rstrip('/') for p in rpaths])
+                if dt_soname != '$EXECUTABLE':
+                    elffile.dt_soname = string(dt_soname)
+
+        # runpath always takes precedence.
+        if len(elffile.dt_runpath):
+            elffile.dt_rpath = []
 
 
 class programheader(object):
-    def __init__(self, eh, file):
+    __slots__ = ('p_type', 'p_flags', 'p_offset', 'p_vaddr', 'p_paddr', 'p_filesz', 'p_memsz',
+                 'p_align')
+
+    def __init__(self, eh, data, offset):
         ptr_type = eh.ptr_type
-        sz_ptr = eh.sz_ptr
-        endian = eh.endian
-        self.p_type, = struct.unpack(endian + 'L', file.read(4))
         if eh.bitness == 64:
-            self.p_flags, = struct.unpack(endian + 'L', file.read(4))
-        self.p_offset, = struct.unpack(endian + ptr_type, file.read(sz_ptr))
-        self.p_vaddr, = struct.unpack(endian + ptr_type, file.read(sz_ptr))
-        self.p_paddr, = struct.unpack(endian + ptr_type, file.read(sz_ptr))
-        self.p_filesz, = struct.unpack(endian + ptr_type, file.read(sz_ptr))
-        self.p_memsz, = struct.unpack(endian + ptr_type, file.read(sz_ptr))
-        if eh.bitness == 32:
-            self.p_flags, = struct.unpack(endian + 'L', file.read(4))
-        self.p_align, = struct.unpack(endian + ptr_type, file.read(sz_ptr))
-
-    def postprocess(self, elffile, file):
+            (self.p_type, self.p_flags, self.p_offset, self.p_vaddr, self.p_paddr, self.p_filesz,
+             self.p_memsz, self.p_align) = _unpack_from(eh.endian + 'LL' + ptr_type * 6, data, offset)
+        else:
+            (self.p_type, self.p_offset, self.p_vaddr, self.p_paddr, self.p_filesz, self.p_memsz,
+             self.p_flags, self.p_align) = _unpack_from(eh.endian + 'L' + ptr_type * 5 + 'L' + ptr_type,
+                                                        data, offset)
+
+    def postprocess(self, elffile, data):
         if self.p_type == PT_INTERP:
-            file.seek(self.p_offset)
-            elffile.program_interpreter = file.read(self.p_filesz - 1).decode()
+            elffile.program_interpreter = bytes(_window(data, self.p_offset, self.p_filesz - 1)).decode()
         elif self.p_type == PT_LOAD:
-            file.seek(self.p_offset)
             if hasattr(elffile, 'ptload_p_vaddr'):
                 elffile.ptload_p_vaddr.append(self.p_vaddr)
                 elffile.ptload_p_paddr.append(self.p_paddr)
@@ -848,7 +944,6 @@ class programheader(object):
 
 class elffile(UnixExecutable):
     def __init__(self, file, initial_rpaths_transitive=[]):
-        self.ehdr = elfheader(file)
         self.dt_needed = []
         self.dt_rpath = []
         self.dt_runpath = []
@@ -858,17 +953,21 @@ class elffile(UnixExecutable):
         self.dt_soname = '$EXECUTABLE'
         self._dir = os.path.dirname(file.name)
 
-        for n in range(self.ehdr.phnum):
-            file.seek(self.ehdr.phoff + (n * self.ehdr.phentsize))
-            self.programheaders.append(programheader(self.ehdr, file))
-        for n in range(self.ehdr.shnum):
-            file.seek(self.ehdr.shoff + (n * self.ehdr.shentsize))
-            self.elfsections.append(elfsection(self.ehdr, file))
-        self.elfsections.sort(key=lambda x: x.priority)
-        for ph in self.programheaders:
-            ph.postprocess(self, file)
-        for es in self.elfsections:
-            es.postprocess(self, file)
+        data = _map(file)
+        try:
+            self.ehdr = elfheader(data)
+            for n in range(self.ehdr.phnum):
+                self.programheaders.append(
+                    programheader(self.ehdr, data, self.ehdr.phoff + (n * self.ehdr.phentsize)))
+            for n in range(self.ehdr.shnum):
+                self.elfsections.append(
+                    elfsection(self.ehdr, data, self.ehdr.shoff + (n * self.ehdr.shentsize)))
+            for ph in self.programheaders:
+                ph.postprocess(self, data)
+            for es in self.elfsections:
+                es.postprocess(self, data)
+        finally:
+            _unmap(data)
 
         # TODO :: If we have a program_interpreter we need to run it as:
         # TODO :: LD_DEBUG=all self.program_interpreter --inhibit-cache --list file.name
@@ -1010,22 +1109,28 @@ def codefile_class(filename, skip_symlinks=False):
             filename = os.path.realpath(filename)
     if os.path.isdir(filename):
         return None
+    if filename.endswith(('.dll', '.exe', '.class')):
+        return codefile_class_from_header(filename, b'')
+    if not os.path.exists(filename) or os.path.getsize(filename) < 4:
+        return None
+    with open(filename, 'rb') as file:
+        return codefile_class_from_header(filename, file.read(4))
+
+
+def codefile_class_from_header(filename, header):
+    """codefile_class of the regular file filename, given (at least) its first 4 bytes"""
     if filename.endswith('.dll'):
         return DLLfile
     if filename.endswith('.exe'):
         return EXEfile
     # Java .class files share 0xCAFEBABE with Mach-O FAT_MAGIC.
-    if filename.endswith('.class'):
+    if filename.endswith('.class') or len(header) < 4:
         return None
-    if not os.path.exists(filename) or os.path.getsize(filename) < 4:
-        return None
-    with open(filename, 'rb') as file:
-        magic, = struct.unpack(BIG_ENDIAN + 'L', file.read(4))
-        file.seek(0)
-        if magic in (FAT_MAGIC, MH_MAGIC, MH_CIGAM, MH_CIGAM_64):
-            return machofile
-        elif magic == ELF_HDR:
-            return elffile
+    magic, = struct.unpack(BIG_ENDIAN + 'L', header[:4])
+    if magic in (FAT_MAGIC, MH_MAGIC, MH_CIGAM, MH_CIGAM_64):
+        return machofile
+    elif magic == ELF_HDR:
+        return elffile
     return None
 
 
@@ -1125,6 +1230,256 @@ def get_runpaths(filename, arch='native'):
         return cf.get_runpaths()
 
 
+class elfrpath(object):
+    """
+    Where the rpath of an ELF file lives: the DT_RPATH and DT_RUNPATH entries
+    of its dynamic section and the string table they point into.  Only the
+    section headers and the dynamic section are read.
+    """
+
+    def __init__(self, data):
+        self.entries = {}
+        self.strtab_offset = None
+        self.strtab_size = 0
+        self.ehdr = ehdr = elfheader(data)
+        if ehdr.hdr != ELF_HDR:
+            return
+        sections = [elfsection(ehdr, data, ehdr.shoff + (n * ehdr.shentsize))
+                    for n in range(ehdr.shnum)]
+        dynamic = [es for es in sections if es.sh_type == SHT_DYNAMIC]
+        if not dynamic or not dynamic[0].sh_entsize:
+            return
+        dynamic = dynamic[0]
+        strtab_addr = None
+        for m, (d_tag, d_val) in enumerate(dynamic.dynamic_entries(ehdr, data)):
+            if d_tag == DT_NULL:
+                break
+            elif d_tag in (DT_RPATH, DT_RUNPATH):
+                self.entries[d_tag] = (dynamic.sh_offset + (m * dynamic.sh_entsize), d_val)
+            elif d_tag == DT_STRTAB:
+                strtab_addr = d_val
+        for es in sections:
+            if (es.sh_type == SHT_STRTAB and es.sh_addr and strtab_addr is not None and
+                    es.sh_addr <= strtab_addr < es.sh_addr + es.sh_size):
+                self.strtab_offset = es.sh_offset + strtab_addr - es.sh_addr
+                self.strtab_size = es.sh_size - (strtab_addr - es.sh_addr)
+                break
+
+    def read_string(self, data, index):
+        if self.strtab_offset is None or index >= self.strtab_size:
+            raise ValueError('string {} is outside the dynamic string table'.format(index))
+        start = self.strtab_offset + index
+        end = data.find(b'\0', start, self.strtab_offset + self.strtab_size)
+        if end < 0:
+            raise ValueError('string {} is not terminated'.format(index))
+        return data[start:end]
+
+    def current(self):
+        'The entry ld.so goes by: DT_RUNPATH wins over DT_RPATH'
+        return self.entries.get(DT_RUNPATH) or self.entries.get(DT_RPATH)
+
+
+def _open_elfrpath(data):
+    try:
+        rp = elfrpath(data)
+    except (IncompleteRead, struct.error, ValueError):
+        return None
+    return rp if rp.ehdr.hdr == ELF_HDR else None
+
+
+def get_elf_rpath(filename):
+    """
+    Return the rpath of an ELF file as `patchelf --print-rpath` prints it
+    (DT_RUNPATH if there is one, else DT_RPATH, else ''), or None if the
+    file can't be read this way.
+    """
+    with open(filename, 'rb') as f:
+        data = _map(f)
+        try:
+            rp = _open_elfrpath(data)
+            if rp is None:
+                return None
+            entry = rp.current()
+            if not entry:
+                return ''
+            try:
+                return rp.read_string(data, entry[1]).decode('utf-8')
+            except ValueError:
+                return None
+        finally:
+            _unmap(data)
+
+
+def set_elf_rpath(filename, rpath):
+    """
+    Do what `patchelf --force-rpath --set-rpath rpath filename` does,
+    but only if it can be done without growing the file: there must be
+    an rpath already and the new one must fit over its string.  Like patchelf,
+    all of the old string is overwritten (with NULs past the new one), so no
+    trace of the old rpath, such as the build prefix, is left in the file.
+    A DT_RUNPATH entry is turned into DT_RPATH.  Returns whether the file was
+    changed; if not, it is left untouched.
+    """
+    new = rpath.encode('utf-8')
+    with open(filename, 'r+b') as f:
+        data = _map(f)
+        try:
+            rp = _open_elfrpath(data)
+            # with both entries patchelf disables DT_RUNPATH; leave that to it
+            if rp is None or len(rp.entries) != 1:
+                return False
+            (tag, (offset, index)), = rp.entries.items()
+            try:
+                old = rp.read_string(data, index)
+            except ValueError:
+                return False
+        finally:
+            _unmap(data)
+        if len(new) > len(old):
+            return False
+        f.seek(rp.strtab_offset + index)
+        f.write(new + b'\0' * (len(old) - len(new) + 1))
+        if tag == DT_RUNPATH:
+            f.seek(offset)
+            f.write(struct.pack(rp.ehdr.endian + rp.ehdr.ptr_type, DT_RPATH))
+    return True
+
+
+# Symbols are listed as liefldd lists them, without LIEF parsing all of the binary to do so:
+#    an ELF file exports the defined, global or weak functions of its dynamic symbol table
+#    (its .symtab when it has none, as static executables and objects), a Mach-O binary the
+#    symbols of its export trie.  Imports are the undefined global symbols of either.
+
+def _elf_symbols(data, defined, undefined):
+    eh = elfheader(data)
+    if eh.hdr != ELF_HDR:
+        return None
+    if eh.bitness == 64:
+        entry = _struct(eh.endian + 'LBBHQQ')
+
+        def symbol(offset):
+            st_name, st_info, _st_other, st_shndx, st_value, st_size = entry.unpack_from(data, offset)
+            return st_name, st_info, st_shndx, st_value, st_size
+    else:
+        entry = _struct(eh.endian + 'LLLBBH')
+
+        def symbol(offset):
+            st_name, st_value, st_size, st_info, _st_other, st_shndx = entry.unpack_from(data, offset)
+            return st_name, st_info, st_shndx, st_value, st_size
+    sections = [elfsection(eh, data, eh.shoff + (n * eh.shentsize)) for n in range(eh.shnum)]
+    tables = ([es for es in sections if es.sh_type == SHT_DYNSYM] or
+              [es for es in sections if es.sh_type == SHT_SYMTAB])
+    names = []
+    for table in tables:
+        if table.sh_entsize < entry.size or table.sh_link >= len(sections):
+            continue
+        strtab = sections[table.sh_link]
+        str_start, str_end = strtab.sh_offset, strtab.sh_offset + strtab.sh_size
+        count = int(table.sh_size / table.sh_entsize)
+        if table.sh_offset + count * table.sh_entsize > len(data) or str_end > len(data):
+            raise IncompleteRead('symbol table at offset {} is past the end of the file'.format(table.sh_offset))
+        # the first entry is the undefined symbol
+        for n in range(1, count):
+            st_name, st_info, st_shndx, st_value, st_size = symbol(table.sh_offset + n * table.sh_entsize)
+            if not st_name or st_info >> 4 not in (STB_GLOBAL, STB_WEAK):
+                continue
+            if st_shndx == SHN_UNDEF:
+                wanted = undefined
+            else:
+                wanted = defined and st_info & 0xf == STT_FUNC and (st_value or st_size)
+            if wanted:
+                names.append(_cstring(data, str_start + st_name, str_end))
+    return names
+
+
+def _uleb128(data, offset):
+    result = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        result |= (byte & 0x7f) << shift
+        shift += 7
+        if byte < 0x80:
+            return result, offset
+
+
+def _macho_export_trie(view, offset, size):
+    """The names of the symbols of the export trie of size bytes at offset"""
+    trie = bytearray(_window(view, offset, size))
+    names = []
+    todo = [(0, b'')] if size else []
+    seen = set()
+    while todo:
+        node, prefix = todo.pop()
+        if node in seen or node >= size:
+            raise ValueError('malformed export trie at offset {}'.format(offset))
+        seen.add(node)
+        terminal_size, where = _uleb128(trie, node)
+        if terminal_size:
+            names.append(prefix.decode('utf-8'))
+        where += terminal_size
+        children = trie[where]
+        where += 1
+        for _n in range(children):
+            end = trie.index(b'\0', where)
+            edge = bytes(trie[where:end])
+            child, where = _uleb128(trie, end + 1)
+            todo.append((child, prefix + edge))
+    return names
+
+
+def _macho_symbols(data, arch, defined, undefined):
+    # fall back to the first binary of a fat file without one for arch, as LIEF does
+    for bits, endian, view in itertools.chain(_macho_slices(data, arch), _macho_slices(data, 'any')):
+        _filetype, commands = _macho_load_commands(view, bits, endian)
+        names = []
+        for cmd, where, cmdsize in commands:
+            if defined and cmd in (LC_DYLD_INFO, LC_DYLD_INFO_ONLY):
+                export_off, export_size = _unpack_from(endian + 'LL', view, where + 40)
+                names.extend(_macho_export_trie(view, export_off, export_size))
+            elif defined and cmd == LC_DYLD_EXPORTS_TRIE:
+                export_off, export_size = _unpack_from(endian + 'LL', view, where + 8)
+                names.extend(_macho_export_trie(view, export_off, export_size))
+            elif undefined and cmd == LC_SYMTAB:
+                symoff, nsyms, stroff, strsize = _unpack_from(endian + 'LLLL', view, where + 8)
+                nlist = _struct(endian + ('LBBHQ' if bits == 64 else 'LBBHL'))
+                strings = bytes(_window(view, stroff, strsize))
+                _window(view, symoff, nsyms * nlist.size)
+                for n in range(nsyms):
+                    n_strx, n_type, _n_sect, _n_desc, _n_value = nlist.unpack_from(view, symoff + n * nlist.size)
+                    if (n_strx and not n_type & N_STAB and n_type & N_TYPE == N_UNDF and
+                            n_type & N_EXT):
+                        names.append(_cstring(strings, n_strx, strsize))
+        return names
+    return None
+
+
+def get_symbols(filename, defined=True, undefined=True, arch='native'):
+    """
+    The names of the functions an ELF or Mach-O file exports (defined) and of
+    the symbols it imports (undefined), or None if it is neither or can't be
+    read this way.
+    """
+    with open(filename, 'rb') as f:
+        data = _map(f)
+        try:
+            klass = codefile_class_from_header(filename, data[:4])
+            if klass is elffile:
+                return _elf_symbols(data, defined, undefined)
+            elif klass is machofile:
+                return _macho_symbols(data, _get_arch_if_native(arch), defined, undefined)
+        except (IncompleteRead, struct.error, IndexError, ValueError) as e:
+            get_logger(__name__).debug('failed to read the symbols of {}: {}'.format(filename, e))
+        finally:
+            _unmap(data)
+    return None
+
+
+def get_exports(filename, arch='native'):
+    """The names of the functions an ELF or Mach-O file exports, or None (see get_symbols)"""
+    return get_symbols(filename, defined=True, undefined=False, arch=arch)
+
+
 # TODO :: Consider returning a tree structure or a dict when recurse is True?
 def inspect_linkages(filename, resolve_filenames=True, recurse=True,
                      sysroot='', arch='native'):
@@ -0,0 +1,328 @@
+'''
+Cheap resource accounting for the processes started by a build, using Linux' own bookkeeping.
+
+Rather than asking psutil about every process every few seconds and walking the work directory
+for its size, the sampler reads:
+
+* the cgroup v2 files (``cpu.stat``, ``memory.current``) of a cgroup created for the command,
+  when conda-build is allowed to create one below its own cgroup;
+* ``/proc/<pid>/stat``, one small read per process, for memory and for CPU per process name
+  (e.g. cc1plus vs ld).  CPU time of processes that exit between two samples is not lost: it
+  is added to the CPU time of the parent that waited for them, and ends up in the totals;
+* ``statvfs`` of the filesystem holding the work directory, whose growth is the disk usage.
+
+That keeps a sample well below a millisecond for typical builds, so it can run every 100ms.
+'''
+from __future__ import absolute_import, division, print_function
+
+from collections import defaultdict
+import errno
+import itertools
+import os
+import sys
+import time
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from conda_build.utils import get_logger
+
+_cgroup_root = '/sys/fs/cgroup'
+_cgroup_names = itertools.count()
+
+
+def available():
+    """Whether the sampler can be used here (Linux, with /proc mounted)"""
+    return (resource is not None and sys.platform.startswith('linux') and
+            os.path.isfile('/proc/self/stat'))
+
+
+def read_proc_stat(pid):
+    """Parse /proc/<pid>/stat into a dict; returns None when the process has gone away"""
+    try:
+        with open('/proc/{}/stat'.format(pid), 'rb') as f:
+            data = f.read()
+    except (IOError, OSError):
+        return None
+    # comm is in parentheses and may itself contain spaces and parentheses
+    lparen, rparen = data.index(b'('), data.rindex(b')')
+    fields = data[rparen + 2:].split()
+    return {'pid': pid,
+            'comm': data[lparen + 1:rparen].decode('utf-8', 'replace'),
+            'state': fields[0].decode('ascii'),
+            'ppid': int(fields[1]),
+            'utime': int(fields[11]),
+            'stime': int(fields[12]),
+            'cutime': int(fields[13]),
+            'cstime': int(fields[14]),
+            'num_threads': int(fields[17]),
+            'starttime': int(fields[19]),
+            'vsize': int(fields[20]),
+            'rss': int(fields[21])}
+
+
+def filesystem_used(path):
+    """Bytes in use on the filesystem holding path, or None if that can't be told"""
+    try:
+        st = os.statvfs(path)
+    except (AttributeError, OSError):
+        return None
+    return (st.f_blocks - st.f_bfree) * st.f_frsize
+
+
+def _own_cgroup():
+    try:
+        with open('/proc/self/cgroup') as f:
+            for line in f:
+                hierarchy, _, path = line.strip().split(':', 2)
+                if hierarchy == '0':
+                    return path
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+
+def _read_keyed(path):
+    values = {}
+    with open(path) as f:
+        for line in f:
+            key, _, value = line.partition(' ')
+            values[key] = int(value)
+    return values
+
+
+class ResourceSampler(object):
+    """Track CPU, memory, process count and disk usage of a command and all its descendants.
+
+    Call ``start()`` before spawning the command, ``attach(pid)`` as soon as it is running,
+    ``sample()`` periodically and ``finish()`` once it has been waited for.  Peaks and totals are then in ``rss``, ``vms``, ``processes``,
+    ``cpu_user``, ``cpu_sys`` and ``disk``, CPU seconds per process name in ``cpu_by_name``
+    and a ``(seconds, rss, cpu, disk, processes)`` time series in ``series``.  The series keeps
+    at most ``max_points`` entries, dropping every other one (and halving its resolution) when
+    it fills up.
+    """
+    def __init__(self, disk_path, use_cgroup=True, max_points=1000):
+        self.disk_path = disk_path
+        self.use_cgroup = use_cgroup
+        self.max_points = max_points
+        self.clock_ticks = float(os.sysconf('SC_CLK_TCK'))
+        self.page_size = os.sysconf('SC_PAGE_SIZE')
+
+        self.rss = 0
+        self.vms = 0
+        self.processes = 0
+        self.processes_seen = 0
+        self.cpu_user = 0.0
+        self.cpu_sys = 0.0
+        self.disk = 0
+        self.samples = 0
+        self.sample_time = 0.0
+        self.series = []
+        self.cpu_by_name = {}
+
+        self.cgroup = None
+        self.pid = None
+        self._stride = 1
+        self._last_cpu = {}  # (pid, starttime) -> (comm, utime, stime), in clock ticks
+        self._start_time = None
+        self._start_fs_used = None
+        self._start_rusage = None
+        self._scan_proc = False
+
+    def start(self):
+        self._start_time = time.time()
+        self._start_fs_used = filesystem_used(self.disk_path)
+        self._start_rusage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        if self.use_cgroup:
+            self.cgroup = self._make_cgroup()
+
+    def _make_cgroup(self):
+        own = _own_cgroup()
+        if own is None or not os.path.isfile(os.path.join(_cgroup_root, 'cgroup.controllers')):
+            return None
+        path = os.path.join(_cgroup_root, own.lstrip('/'),
+                            'conda-build-{}-{}'.format(os.getpid(), next(_cgroup_names)))
+        try:
+            os.mkdir(path)
+        except OSError as e:
+            get_logger(__name__).debug("not sampling with a cgroup: %s", e)
+            return None
+        return path
+
+    def attach(self, pid):
+        """Sample pid (and its descendants) from now on, moving it into the sampler's cgroup.
+
+        It is moved from here rather than in a ``preexec_fn``, which would run Python in the
+        forked child of a process with threads; what the child spawns in the moment before it
+        is moved is still found through /proc."""
+        self.pid = pid
+        if not self.cgroup:
+            return
+        try:
+            with open(os.path.join(self.cgroup, 'cgroup.procs'), 'w') as f:
+                f.write(str(pid))
+        except (IOError, OSError):
+            pass
+        if pid not in self._cgroup_pids():
+            get_logger(__name__).debug("could not move %d into %s, sampling /proc instead",
+                                       pid, self.cgroup)
+            self._remove_cgroup()
+
+    def _cgroup_pids(self):
+        try:
+            with open(os.path.join(self.cgroup, 'cgroup.procs')) as f:
+                return [int(line) for line in f if line.strip()]
+        except (IOError, OSError, ValueError):
+            return []
+
+    def _children_file_pids(self, stats):
+        # /proc/<pid>/task/<tid>/children needs CONFIG_PROC_CHILDREN; None if it is missing
+        pids, todo = [], [self.pid]
+        while todo:
+            pid = todo.pop()
+            tids = [pid]
+            stat = stats.get(pid)
+            if stat and stat['num_threads'] > 1:
+                try:
+                    tids = [int(tid) for tid in os.listdir('/proc/{}/task'.format(pid))]
+                except OSError:
+                    pass
+            for tid in tids:
+                try:
+                    with open('/proc/{}/task/{}/children'.format(pid, tid)) as f:
+                        children = [int(child) for child in f.read().split()]
+                except (IOError, OSError) as e:
+                    if e.errno == errno.ENOENT and pid == self.pid and tid == pid:
+                        return None
+                    continue
+                for child in children:
+                    stat = read_proc_stat(child)
+                    if stat:
+                        stats[child] = stat
+                        pids.append(child)
+                        todo.append(child)
+        return pids
+
+    def _descendants(self):
+        """Return {pid: stat} for the command and every process below it"""
+        if self.cgroup:
+            stats = {}
+            for pid in self._cgroup_pids():
+                stat = read_proc_stat(pid)
+                if stat:
+                    stats[pid] = stat
+            return stats
+        root = read_proc_stat(self.pid)
+        if not root:
+            return {}
+        stats = {self.pid: root}
+        if not self._scan_proc:
+            if self._children_file_pids(stats) is not None:
+                return stats
+            self._scan_proc = True
+        # no children files: scan all of /proc and keep what descends from the command
+        children = defaultdict(list)
+        for entry in os.listdir('/proc'):
+            if entry.isdigit():
+                stat = read_proc_stat(int(entry))
+                if stat:
+                    children[stat['ppid']].append(stat)
+        todo = [self.pid]
+        while todo:
+            for stat in children.get(todo.pop(), ()):
+                stats[stat['pid']] = stat
+                todo.append(stat['pid'])
+        return stats
+
+    def sample(self):
+        if self.pid is None:
+            return
+        start = time.time()
+        stats = self._descendants()
+
+        rss = sum(stat['rss'] for stat in stats.values()) * self.page_size
+        vms = sum(stat['vsize'] for stat in stats.values())
+        if self.cgroup:
+            try:
+                with open(os.path.join(self.cgroup, 'memory.current')) as f:
+                    rss = int(f.read())
+            except (IOError, OSError, ValueError):
+                pass
+        self.rss = max(rss, self.rss)
+        self.vms = max(vms, self.vms)
+        self.processes = max(len(stats), self.processes)
+
+        for stat in stats.values():
+            key = stat['pid'], stat['starttime']
+            if key not in self._last_cpu:
+                self.processes_seen += 1
+            self._last_cpu[key] = stat['comm'], stat['utime'], stat['stime']
+
+        user, system = self._cpu_totals(stats)
+        self.cpu_user, self.cpu_sys = max(user, self.cpu_user), max(system, self.cpu_sys)
+
+        fs_used = filesystem_used(self.disk_path)
+        if fs_used is not None and self._start_fs_used is not None:
+            self.disk = max(fs_used - self._start_fs_used, self.disk)
+
+        if self.samples % self._stride == 0:
+            self.series.append((round(start - self._start_time, 3), rss,
+                                round(self.cpu_user + self.cpu_sys, 3), self.disk, len(stats)))
+            if len(self.series) > self.max_points:
+                self.series = self.series[::2]
+                self._stride *= 2
+        self.samples += 1
+        self.sample_time += time.time() - start
+
+    def _cpu_totals(self, stats):
+        if self.cgroup:
+            try:
+                cpu = _read_keyed(os.path.join(self.cgroup, 'cpu.stat'))
+                return cpu['user_usec'] / 1e6, cpu['system_usec'] / 1e6
+            except (IOError, OSError, KeyError, ValueError):
+                pass
+        # every exited process that was waited for is accounted in its parent's cutime/cstime
+        user = sum(stat['utime'] + stat['cutime'] for stat in stats.values())
+        system = sum(stat['stime'] + stat['cstime'] for stat in stats.values())
+        return user / self.clock_ticks, system / self.clock_ticks
+
+    def finish(self):
+        """Final accounting, once the command has exited and been waited for"""
+        if self.cgroup:
+            user, system = self._cpu_totals({})
+            try:
+                with open(os.path.join(self.cgroup, 'memory.peak')) as f:
+                    self.rss = max(int(f.read()), self.rss)
+            except (IOError, OSError, ValueError):
+                pass
+            self._remove_cgroup()
+        else:
+            end_rusage = resource.getrusage(resource.RUSAGE_CHILDREN)
+            user = end_rusage.ru_utime - self._start_rusage.ru_utime
+            system = end_rusage.ru_stime - self._start_rusage.ru_stime
+        self.cpu_user, self.cpu_sys = max(user, self.cpu_user), max(system, self.cpu_sys)
+
+        fs_used = filesystem_used(self.disk_path)
+        if fs_used is not None and self._start_fs_used is not None:
+            self.disk = max(fs_used - self._start_fs_used, self.disk)
+
+        by_name = defaultdict(lambda: {'user': 0.0, 'sys': 0.0})
+        for comm, utime, stime in self._last_cpu.values():
+            by_name[comm]['user'] += utime / self.clock_ticks
+            by_name[comm]['sys'] += stime / self.clock_ticks
+        # processes too short-lived to be sampled still show up in the totals
+        unsampled = {'user': self.cpu_user - sum(cpu['user'] for cpu in by_name.values()),
+                     'sys': self.cpu_sys - sum(cpu['sys'] for cpu in by_name.values())}
+        if unsampled['user'] + unsampled['sys'] > 0.01:
+            by_name['(unsampled)'] = {key: max(value, 0.0) for key, value in unsampled.items()}
+        self.cpu_by_name = {comm: {'user': round(cpu['user'], 3), 'sys': round(cpu['sys'], 3)}
+                            for comm, cpu in by_name.items()}
+
+    def _remove_cgroup(self):
+        try:
+            os.rmdir(self.cgroup)
+        except OSError as e:
+            # something the command started is still running in it
+            get_logger(__name__).debug("could not remove %s: %s", self.cgroup, e)
+        self.cgroup = None
@@ -0,0 +1,129 @@
+'''
+Cache of the nature of packages ("non-library", "plugin library", "dso library" or
+"run-exports library"), as post.library_nature determines it for the overlinking checks.
+
+Finding it out means going through the files of the package for DSOs and looking up its
+run_exports in the build index.  The run requirements it is done for (libgcc-ng, openssl, zlib,
+...) are mostly the same for every output and variant of a recipe, and from one build to the
+next.  Natures are kept in memory for the run, keyed by channel, dist and the md5 of the package
+file, and the ones of packages with an md5 are also saved to a JSON file next to the package
+cache (``library_nature_cache``, by default ``<first pkgs_dir>/cache/conda-build-library-nature.json``)
+for later builds.
+'''
+from __future__ import absolute_import, division, print_function
+
+import json
+import os
+import time
+
+from conda_build.conda_interface import pkgs_dirs
+from conda_build.utils import get_logger, rm_rf
+
+CACHE_FILE = 'conda-build-library-nature.json'
+# bump when the way natures are determined changes; older files are ignored
+SCHEMA_VERSION = 1
+# the file keeps the natures stored most recently, up to this many
+MAX_ENTRIES = 20000
+
+_caches = {}
+
+
+def cache_key(dist, record=None):
+    """Identify a package by its channel, dist name and (from its record) md5"""
+    return str(dist.channel), dist.dist_name, (record or {}).get('md5')
+
+
+def _persisted_key(key):
+    return '::'.join(key)
+
+
+class NatureCache(object):
+    def __init__(self, path=None):
+        self.path = path
+        self._natures = {}
+        self._on_disk = None
+        self.hits = 0
+        self.misses = 0
+
+    def _load(self):
+        if self._on_disk is not None:
+            return self._on_disk
+        self._on_disk = {}
+        if self.path:
+            try:
+                with open(self.path) as f:
+                    data = json.load(f)
+                if data['version'] == SCHEMA_VERSION:
+                    self._on_disk = data['natures']
+            except (IOError, OSError, ValueError, KeyError, TypeError):
+                pass
+        return self._on_disk
+
+    def get(self, key):
+        """The nature of the package identified by key, or None if it is not known"""
+        nature = self._natures.get(key)
+        if nature is None and key[2]:
+            nature = (self._load().get(_persisted_key(key)) or (None,))[0]
+            if nature is not None:
+                self._natures[key] = nature
+        if nature is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return nature
+
+    def get_many(self, keys):
+        """The known natures of keys, as a dict"""
+        natures = {}
+        for key in keys:
+            nature = self.get(key)
+            if nature is not None:
+                natures[key] = nature
+        return natures
+
+    def update(self, natures):
+        """Remember natures ({key: nature}), and save the ones of packages with an md5"""
+        self._natures.update(natures)
+        now = time.time()
+        persisted = {_persisted_key(key): [nature, now]
+                     for key, nature in natures.items() if key[2]}
+        if persisted and self.path:
+            self._save(persisted)
+
+    def _save(self, persisted):
+        # start from what is on disk now, so as to keep what other builds stored meanwhile
+        self._on_disk = None
+        on_disk = self._load()
+        on_disk.update(persisted)
+        if len(on_disk) > MAX_ENTRIES:
+            newest = sorted(on_disk.items(), key=lambda item: item[1][1])[-MAX_ENTRIES:]
+            on_disk.clear()
+            on_disk.update(newest)
+        tmp = '{}.{}.tmp'.format(self.path, os.getpid())
+        try:
+            if not os.path.isdir(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            with open(tmp, 'w') as f:
+                json.dump({'version': SCHEMA_VERSION, 'natures': on_disk}, f)
+            try:
+                os.rename(tmp, self.path)
+            except OSError:
+                # windows won't rename over an existing file
+                rm_rf(self.path)
+                os.rename(tmp, self.path)
+        except (IOError, OSError) as e:
+            get_logger(__name__).debug("could not save package natures to %s: %s", self.path, e)
+            rm_rf(tmp)
+
+
+def cache_path(config):
+    if config.library_nature_cache:
+        return config.library_nature_cache
+    return os.path.join(pkgs_dirs[0], 'cache', CACHE_FILE) if pkgs_dirs else None
+
+
+def get_nature_cache(path=None):
+    """The NatureCache of this process saving to path (or to nowhere, when it is None)"""
+    if path not in _caches:
+        _caches[path] = NatureCache(path)
+    return _caches[path]
@@ -1,40 +1,44 @@
 from __future__ import absolute_import, division, print_function
 
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import fnmatch
 from functools import partial
 import glob2
 from glob2 import glob
-import io
 import locale
 import re
 import os
 import shutil
 import stat
-from subprocess import call, check_output, CalledProcessError
+from subprocess import call, check_output, CalledProcessError, Popen, PIPE
 import sys
+import tempfile
+import time
 try:
     from os import readlink
 except ImportError:
     readlink = False
 
-from conda_build.os_utils import external
-from conda_build.conda_interface import PY3
-from conda_build.conda_interface import lchmod
-from conda_build.conda_interface import linked_data
+from conda_build.os_utils import dso_cache, external
+from conda_build.conda_interface import PY3, StringIO
+from conda_build.conda_interface import lchmod, linked_data
 from conda_build.conda_interface import walk_prefix
 from conda_build.conda_interface import pkgs_dirs
 from conda_build.conda_interface import TemporaryDirectory
 from conda_build.conda_interface import md5_file
 
-from conda_build import utils
+from conda_build import trace, utils
 from conda_build.os_utils.liefldd import (get_exports_memoized, get_linkages_memoized,
                                           get_runpaths)
-from conda_build.os_utils.pyldd import codefile_type
+from conda_build.os_utils.pyldd import codefile_type, get_elf_rpath, set_elf_rpath
 from conda_build.os_utils.ldd import get_package_obj_files
 from conda_build.index import get_run_exports, get_build_index
-from conda_build.inspect_pkg import which_package
+from conda_build.inspect_pkg import get_prefix_owners, which_package
+from conda_build.package_nature import cache_key, get_nature_cache
+from conda_build.package_nature import cache_path as nature_cache_path
 from conda_build.exceptions import (OverLinkingError, OverDependingError)
+from conda_build.file_table import get_file_table
 
 if sys.platform == 'darwin':
     from conda_build.os_utils import macho
@@ -51,67 +55,90 @@ filetypes_for_platform = {
 }
 
 
-def fix_shebang(f, prefix, build_python, osx_is_app=False):
-    path = os.path.join(prefix, f)
-    if codefile_type(path):
-        return
-    elif os.path.islink(path):
-        return
-    elif not os.path.isfile(path):
-        return
+SHEBANG_PAT = re.compile(br'^#!.+$', re.M)
+PYTHON_PAT = re.compile(br'\/python[w]?(?:$|\s|\Z)', re.M)
 
-    if os.stat(path).st_size == 0:
-        return
 
-    bytes_ = False
+def _python_shebang(prefix, build_python, osx_is_app=False):
+    """The shebang fix_shebang gives the python scripts of prefix"""
+    return ('#!' + ('/bin/bash ' + prefix + '/bin/pythonw'
+                    if sys.platform == 'darwin' and osx_is_app else
+                    prefix + '/bin/' + os.path.basename(build_python))).encode('utf-8')
 
-    os.chmod(path, 0o775)
-    with io.open(path, mode='r+', encoding=locale.getpreferredencoding()) as fi:
+
+def _replace_file(path, data, mode):
+    """Replace the content of path with data in one step (a rename), keeping its mode"""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.' + os.path.basename(path) + '.')
+    try:
+        with os.fdopen(fd, 'wb') as fo:
+            fo.write(data)
+        os.chmod(tmp, stat.S_IMODE(mode))
+        os.rename(tmp, path)
+    except:
+        utils.rm_rf(tmp)
+        raise
+
+
+def _shebang_candidate(f, prefix, file_table):
+    """Make f executable if it is a (non-empty, non-code) file, and tell if it may be a script"""
+    info = file_table.get(f)
+    if info.codefile or info.is_link or not info.is_file or info.size == 0:
+        return False
+    os.chmod(os.path.join(prefix, f), 0o775)
+    # unreadable files are tried again now that they are readable
+    return info.kind == 'script' or bool(info.error)
+
+
+def _fix_python_shebang(path, shebang):
+    """Give the python script at path shebang, if it has another one.  Returns whether it did.
+    Only the first line of the file is read unless it is rewritten."""
+    with open(path, 'rb') as fi:
+        first_line = fi.readline()
+        line = first_line[:-1] if first_line.endswith(b'\n') else first_line
         try:
-            data = fi.read(100)
-            fi.seek(0)
+            line.decode(locale.getpreferredencoding())
         except UnicodeDecodeError:  # file is binary
-            return
+            return False
+        if not SHEBANG_PAT.match(line) or not PYTHON_PAT.search(line) or line == shebang:
+            return False
+        data = shebang + first_line[len(line):] + fi.read()
+        mode = os.fstat(fi.fileno()).st_mode
+    _replace_file(path, data, mode)
+    return True
 
-        SHEBANG_PAT = re.compile(r'^#!.+$', re.M)
 
-        # regexp on the memory mapped file so we only read it into
-        # memory if the regexp matches.
-        try:
-            mm = utils.mmap_mmap(fi.fileno(), 0, tagname=None, flags=utils.mmap_MAP_PRIVATE)
-        except OSError:
-            mm = fi.read()
-        try:
-            m = SHEBANG_PAT.match(mm)
-        except TypeError:
-            SHEBANG_PAT = re.compile(br'^#!.+$', re.M)
-            bytes_ = True
-            m = SHEBANG_PAT.match(mm)
-
-        if m:
-            python_pattern = (re.compile(br'\/python[w]?(?:$|\s|\Z)', re.M) if bytes_ else
-                            re.compile(r'\/python[w]?(:$|\s|\z)', re.M))
-            if not python_pattern.search(m.group()):
-                return
-        else:
-            return
+def fix_shebang(f, prefix, build_python, osx_is_app=False, file_table=None):
+    if not _shebang_candidate(f, prefix, file_table or get_file_table(prefix)):
+        return
+    if _fix_python_shebang(os.path.join(prefix, f), _python_shebang(prefix, build_python, osx_is_app)):
+        print("updating shebang:", f)
 
-        data = mm[:]
 
-    py_exec = '#!' + ('/bin/bash ' + prefix + '/bin/pythonw'
-               if sys.platform == 'darwin' and osx_is_app else
-               prefix + '/bin/' + os.path.basename(build_python))
-    if bytes_ and hasattr(py_exec, 'encode'):
-        py_exec = py_exec.encode()
-    new_data = SHEBANG_PAT.sub(py_exec, data, count=1)
-    if new_data == data:
-        return
-    print("updating shebang:", f)
-    with io.open(path, 'w', encoding=locale.getpreferredencoding()) as fo:
-        try:
-            fo.write(new_data)
-        except TypeError:
-            fo.write(new_data.decode())
+def fix_shebangs(files, prefix, build_python, osx_is_app=False, file_table=None, workers=None):
+    """fix_shebang the files of bin/ among files, on a pool of threads.  Returns those changed."""
+    start = time.time()
+    file_table = file_table or get_file_table(prefix)
+    shebang = _python_shebang(prefix, build_python, osx_is_app)
+    bin_files = [f for f in files if f.startswith('bin/')]
+
+    def fix(f):
+        return (_shebang_candidate(f, prefix, file_table) and
+                _fix_python_shebang(os.path.join(prefix, f), shebang))
+
+    workers = min(int(workers or utils.cpu_count()), len(bin_files))
+    with trace.span('fix shebangs', files=len(bin_files), workers=workers):
+        if workers < 2:
+            fixed = [fix(f) for f in bin_files]
+        else:
+            with ThreadPoolExecutor(workers) as executor:
+                fixed = list(executor.map(fix, bin_files))
+    changed = [f for f, fixed_ in zip(bin_files, fixed) if fixed_]
+    for f in changed:
+        print("updating shebang:", f)
+    if changed:
+        print("updated the shebangs of {} of {} files in bin/ in {:.2f}s".format(
+            len(changed), len(bin_files), time.time() - start))
+    return changed
 
 
 def write_pth(egg_path, config):
@@ -218,7 +245,57 @@ def rm_share_info_dir(files, prefix):
             os.unlink(fn)
 
 
-def compile_missing_pyc(files, cwd, python_exe, skip_compile_pyc=()):
+# Run by each byte-compiling worker, with the host python (2 or 3).  File names come one per
+#    line on stdin; a line per file that failed to compile goes to stdout.
+_PY_COMPILE_WORKER = """
+import py_compile, sys
+PY3 = sys.version_info[0] >= 3
+stdin = getattr(sys.stdin, 'buffer', sys.stdin)
+stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+encoding = sys.getfilesystemencoding()
+for line in stdin.read().splitlines():
+    fn = line.decode(encoding, 'surrogateescape') if PY3 else line
+    try:
+        py_compile.compile(fn, doraise=True)
+    except Exception as e:
+        msg = '%s: %s' % (type(e).__name__, ' '.join(str(e).split()))
+        stdout.write(line + b'\\t' + (msg.encode('utf-8', 'replace') if PY3 else msg) + b'\\n')
+stdout.flush()
+"""
+# below this many files per worker, starting another worker costs more than it saves
+_MIN_PYC_FILES_PER_WORKER = 100
+
+
+def _fsencode(fn):
+    return os.fsencode(fn) if hasattr(os, 'fsencode') else fn
+
+
+def _run_pyc_worker(python_exe, cwd, files):
+    proc = Popen([python_exe, '-Wi', '-c', _PY_COMPILE_WORKER], cwd=cwd, stdin=PIPE,
+                 stdout=PIPE)
+    out, _ = proc.communicate(b'\n'.join(_fsencode(fn) for fn in files))
+    errors = []
+    for line in out.decode('utf-8', 'replace').splitlines():
+        fn, _, msg = line.partition('\t')
+        errors.append((fn, msg))
+    if proc.returncode:
+        # the worker died part way through its shard: which of its files were compiled is not
+        #    known, so all of the ones it did not report are counted as failed
+        reported = set(fn for fn, _ in errors)
+        msg = 'compiling worker exited with status {}'.format(proc.returncode)
+        errors.extend((fn, msg) for fn in files if fn not in reported)
+    return errors
+
+
+@trace.traced('compile pyc', args=lambda files, cwd, *a, **kw: {'files': len(files)})
+def compile_missing_pyc(files, cwd, python_exe, skip_compile_pyc=(), workers=None):
+    """Byte-compile the .py files among files that have no .pyc yet, with python_exe.
+
+    The files are sharded, in sorted order, over up to workers (default: one per CPU) python
+    processes that are given their files on stdin.  Returns the number of files compiled and
+    failed (the files of a worker that dies count as failed), the workers used and the time
+    taken, or None when there was nothing to do.
+    """
     if not os.path.isfile(python_exe):
         return
     compile_files = []
@@ -227,7 +304,7 @@ def compile_missing_pyc(files, cwd, python_exe, skip_compile_pyc=()):
     for skip in skip_compile_pyc_n:
         skipped_files.update(set(fnmatch.filter(files, skip)))
     unskipped_files = set(files) - skipped_files
-    for fn in unskipped_files:
+    for fn in sorted(unskipped_files):
         # omit files in Library/bin, Scripts, and the root prefix - they are not generally imported
         if sys.platform == 'win32':
             if any([fn.lower().startswith(start) for start in ['library/bin', 'library\\bin',
@@ -241,33 +318,24 @@ def compile_missing_pyc(files, cwd, python_exe, skip_compile_pyc=()):
                 os.path.dirname(fn) + cache_prefix + os.path.basename(fn) + 'c' not in files):
             compile_files.append(fn)
 
-    if compile_files:
-        if not os.path.isfile(python_exe):
-            print('compiling .pyc files... failed as no python interpreter was found')
-        else:
-            print('compiling .pyc files...')
-            # We avoid command lines longer than 8190
-            if sys.platform == 'win32':
-                limit = 8190
-            else:
-                limit = 32760
-            limit -= len(compile_files) * 2
-            lower_limit = len(max(compile_files, key=len)) + 1
-            if limit < lower_limit:
-                limit = lower_limit
-            groups = [[]]
-            args = [python_exe, '-Wi', '-m', 'py_compile']
-            args_len = length = len(' '.join(args)) + 1
-            for f in compile_files:
-                length_this = len(f) + 1
-                if length_this + length > limit:
-                    groups.append([])
-                    length = args_len
-                else:
-                    length += length_this
-                groups[len(groups) - 1].append(f)
-            for group in groups:
-                call(args + group, cwd=cwd)
+    if not compile_files:
+        return
+    workers = max(1, min(int(workers or utils.cpu_count()),
+                         len(compile_files) // _MIN_PYC_FILES_PER_WORKER))
+    print('compiling .pyc files ({} files, {} workers)...'.format(len(compile_files), workers))
+    start, times = time.time(), os.times()
+    # contiguous shards keep the files of a package together
+    shards = [compile_files[i * len(compile_files) // workers:
+                            (i + 1) * len(compile_files) // workers] for i in range(workers)]
+    with ThreadPoolExecutor(workers) as executor:
+        results = list(executor.map(partial(_run_pyc_worker, python_exe, cwd), shards))
+    errors = sorted(error for result in results for error in result)
+    for fn, msg in errors:
+        print('  failed to compile {}: {}'.format(fn, msg))
+    end_times = os.times()
+    return {'files': len(compile_files), 'failed': len(errors), 'workers': workers,
+            'elapsed': time.time() - start,
+            'cpu_user': end_times[2] - times[2], 'cpu_sys': end_times[3] - times[3]}
 
 
 def check_dist_info_version(name, version, files):
@@ -284,19 +352,23 @@ def check_dist_info_version(name, version, files):
                     return
 
 
+@trace.traced(args=lambda name, version, files, prefix, *a, **kw: trace.file_args(files, prefix))
 def post_process(name, version, files, prefix, config, preserve_egg_dir=False, noarch=False, skip_compile_pyc=()):
     rm_pyo(files, prefix)
+    pyc_stats = None
     if noarch:
         rm_pyc(files, prefix)
     else:
         python_exe = (config.build_python if os.path.isfile(config.build_python) else
                       config.host_python)
-        compile_missing_pyc(files, cwd=prefix, python_exe=python_exe,
-                            skip_compile_pyc=skip_compile_pyc)
+        pyc_stats = compile_missing_pyc(files, cwd=prefix, python_exe=python_exe,
+                                        skip_compile_pyc=skip_compile_pyc,
+                                        workers=config.pyc_compile_workers)
     remove_easy_install_pth(files, prefix, config, preserve_egg_dir=preserve_egg_dir)
     rm_py_along_so(prefix)
     rm_share_info_dir(files, prefix)
     check_dist_info_version(name, version, files)
+    return pyc_stats
 
 
 def find_lib(link, prefix, files, path=None):
@@ -416,28 +488,19 @@ def mk_relative_osx(path, host_prefix, build_prefix, files, rpaths=('lib',)):
         assert_relative_osx(path, host_prefix)
 
 
-def mk_relative_linux(f, prefix, rpaths=('lib',)):
+def _relative_linux_rpath(f, prefix, existing, rpaths, messages):
     'Respects the original values and converts abs to $ORIGIN-relative'
-
-    elf = os.path.join(prefix, f)
-    origin = os.path.dirname(elf)
-
-    patchelf = external.find_executable('patchelf', prefix)
-    try:
-        existing = check_output([patchelf, '--print-rpath', elf]).decode('utf-8').splitlines()[0]
-    except CalledProcessError:
-        print('patchelf: --print-rpath failed for %s\n' % (elf))
-        return
-    existing = existing.split(os.pathsep)
+    origin = os.path.dirname(os.path.join(prefix, f))
     new = []
-    for old in existing:
+    for old in existing.split(os.pathsep):
         if old.startswith('$ORIGIN'):
             new.append(old)
         elif old.startswith('/'):
             # Test if this absolute path is outside of prefix. That is fatal.
             relpath = os.path.relpath(old, prefix)
             if relpath.startswith('..' + os.sep):
-                print('Warning: rpath {0} is outside prefix {1} (removing it)'.format(old, prefix))
+                messages.append('Warning: rpath {0} is outside prefix {1} (removing it)'.format(
+                    old, prefix))
             else:
                 relpath = '$ORIGIN/' + os.path.relpath(old, origin)
                 if relpath not in new:
@@ -457,9 +520,88 @@ def mk_relative_linux(f, prefix, rpaths=('lib',)):
                 rpath = '$ORIGIN/' + rel_stdlib
             if rpath not in new:
                 new.append(rpath)
-    rpath = ':'.join(new)
-    print('patchelf: file: %s\n    setting rpath to: %s' % (elf, rpath))
-    call([patchelf, '--force-rpath', '--set-rpath', rpath, elf])
+    return ':'.join(new)
+
+
+def _relocate_elf(f, prefix, rpaths, patchelf):
+    """Work out the new rpath of f and set it in place if it fits.
+
+    Returns (rpath, how, messages), with how one of 'pyldd' (done), 'patchelf' (still to
+    do) or None (the rpath could not be read).
+    """
+    elf = os.path.join(prefix, f)
+    messages = []
+    try:
+        existing = get_elf_rpath(elf)
+    except EnvironmentError:
+        existing = None
+    if existing is None:
+        try:
+            existing = check_output([patchelf, '--print-rpath', elf]).decode('utf-8').splitlines()[0]
+        except CalledProcessError:
+            messages.append('patchelf: --print-rpath failed for %s\n' % (elf))
+            return None, None, messages
+    rpath = _relative_linux_rpath(f, prefix, existing, rpaths, messages)
+    try:
+        in_place = set_elf_rpath(elf, rpath)
+    except EnvironmentError:
+        in_place = False
+    return rpath, 'pyldd' if in_place else 'patchelf', messages
+
+
+# files per patchelf command line
+_PATCHELF_BATCH = 200
+
+
+def _patchelf_set_rpath(patchelf, rpath, elfs):
+    """Set the rpath of elfs with one patchelf call, and return those it failed for"""
+    if not call([patchelf, '--force-rpath', '--set-rpath', rpath] + elfs):
+        return []
+    # one bad file fails the whole call (as does a patchelf that takes a single file)
+    return [elf for elf in elfs if call([patchelf, '--force-rpath', '--set-rpath', rpath, elf])]
+
+
+@trace.traced('relocate elf', args=lambda files, prefix, *a, **kw: {'files': len(files)})
+def mk_relative_linux_files(files, prefix, rpaths=('lib',), workers=None):
+    """Make the rpaths of the ELF files among files (relative to prefix) $ORIGIN-relative.
+
+    The rpaths are read and, when the new one fits over the old one, rewritten in-process on a
+    pool of threads.  The files that need more room are passed to patchelf, a batch of files
+    with the same new rpath per call.  What was done to each file is printed in files' order.
+    """
+    if not files:
+        return
+    patchelf = external.find_executable('patchelf', prefix)
+    with ThreadPoolExecutor(int(workers or utils.cpu_count())) as executor:
+        results = list(executor.map(
+            partial(_relocate_elf, prefix=prefix, rpaths=rpaths, patchelf=patchelf), files))
+        batches = defaultdict(list)
+        for f, (rpath, how, _) in zip(files, results):
+            if how == 'patchelf':
+                batches[rpath].append(os.path.join(prefix, f))
+        calls = [(rpath, elfs[i:i + _PATCHELF_BATCH]) for rpath, elfs in sorted(batches.items())
+                 for i in range(0, len(elfs), _PATCHELF_BATCH)]
+        failed = set(elf for result in executor.map(
+            lambda batch: _patchelf_set_rpath(patchelf, *batch), calls) for elf in result)
+
+    for f, (rpath, how, messages) in zip(files, results):
+        elf = os.path.join(prefix, f)
+        for message in messages:
+            print(message)
+        if how:
+            print('%s: file: %s\n    setting rpath to: %s' % (how, elf, rpath))
+            if elf in failed:
+                print('patchelf: --set-rpath failed for %s' % (elf))
+    if len(files) > 1:
+        print('Set the rpath of {} files: {} in place, {} with {} patchelf calls'.format(
+            sum(1 for _, how, _ in results if how),
+            sum(1 for _, how, _ in results if how == 'pyldd'),
+            sum(1 for _, how, _ in results if how == 'patchelf'), len(calls)))
+
+
+def mk_relative_linux(f, prefix, rpaths=('lib',)):
+    'Respects the original values and converts abs to $ORIGIN-relative'
+    mk_relative_linux_files([f], prefix, rpaths=rpaths, workers=1)
 
 
 def assert_relative_osx(path, prefix):
@@ -468,14 +610,7 @@ def assert_relative_osx(path, prefix):
             raise RuntimeError("library at %s appears to have an absolute path embedded" % path)
 
 
-def determine_package_nature(pkg, prefix, subdir, bldpkgs_dir, output_folder, channel_urls):
-    dsos = []
-    run_exports = None
-    lib_prefix = pkg.name.startswith('lib')
-    codefiles = get_package_obj_files(pkg, prefix)
-    dsos = [f for f in codefiles for ext in ('.dylib', '.so', '.dll') if ext in f]
-    # we don't care about the actual run_exports value, just whether or not run_exports are present.  We can use channeldata
-    #    and it'll be a more reliable source (no disk race condition nonsense)
+def _get_channeldata(subdir, bldpkgs_dir, output_folder, channel_urls):
     _, _, channeldata = get_build_index(subdir=subdir,
                                         bldpkgs_dir=bldpkgs_dir,
                                         output_folder=output_folder,
@@ -483,6 +618,20 @@ def determine_package_nature(pkg, prefix, subdir, bldpkgs_dir, output_folder, ch
                                         debug=False,
                                         verbose=False,
                                         clear_cache=False)
+    return channeldata
+
+
+def determine_package_nature(pkg, prefix, subdir, bldpkgs_dir, output_folder, channel_urls,
+                             channeldata=None):
+    dsos = []
+    run_exports = None
+    lib_prefix = pkg.name.startswith('lib')
+    codefiles = get_package_obj_files(pkg, prefix)
+    dsos = [f for f in codefiles for ext in ('.dylib', '.so', '.dll') if ext in f]
+    # we don't care about the actual run_exports value, just whether or not run_exports are present.  We can use channeldata
+    #    and it'll be a more reliable source (no disk race condition nonsense)
+    if channeldata is None:
+        channeldata = _get_channeldata(subdir, bldpkgs_dir, output_folder, channel_urls)
     channel_used = pkg.channel
     channeldata = channeldata.get(channel_used)
 
@@ -501,12 +650,7 @@ def determine_package_nature(pkg, prefix, subdir, bldpkgs_dir, output_folder, ch
     return (dsos, run_exports, lib_prefix)
 
 
-def library_nature(pkg, prefix, subdir, bldpkgs_dirs, output_folder, channel_urls):
-    '''
-    Result :: "non-library", "plugin library", "dso library", "run-exports library"
-    .. in that order, i.e. if have both dsos and run_exports, it's a run_exports_library.
-    '''
-    dsos, run_exports, _ = determine_package_nature(pkg, prefix, subdir, bldpkgs_dirs, output_folder, channel_urls)
+def _nature_of(dsos, run_exports):
     if run_exports:
         return "run-exports library"
     elif len(dsos):
@@ -521,14 +665,41 @@ def library_nature(pkg, prefix, subdir, bldpkgs_dirs, output_folder, channel_url
     return "non-library"
 
 
+def library_natures(packages, prefix, subdir, bldpkgs_dirs, output_folder, channel_urls,
+                    nature_cache=None):
+    '''
+    library_nature of each of packages, as a dict.  Natures found in nature_cache (by default
+    the in-memory one of this process) are not determined again; for the others, the build
+    index is only fetched once.
+    '''
+    if nature_cache is None:
+        nature_cache = get_nature_cache()
+    records = linked_data(prefix)
+    keys = {pkg: cache_key(pkg, records.get(pkg)) for pkg in packages}
+    known = nature_cache.get_many(set(keys.values()))
+    natures = {pkg: known[keys[pkg]] for pkg in packages if keys[pkg] in known}
+    missing = [pkg for pkg in packages if pkg not in natures]
+    if missing:
+        channeldata = _get_channeldata(subdir, bldpkgs_dirs, output_folder, channel_urls)
+        for pkg in missing:
+            natures[pkg] = _nature_of(*determine_package_nature(pkg, prefix, subdir, bldpkgs_dirs, output_folder,
+                                                                channel_urls, channeldata=channeldata)[:2])
+        nature_cache.update({keys[pkg]: natures[pkg] for pkg in missing})
+    return natures
+
+
+def library_nature(pkg, prefix, subdir, bldpkgs_dirs, output_folder, channel_urls, nature_cache=None):
+    '''
+    Result :: "non-library", "plugin library", "dso library", "run-exports library"
+    .. in that order, i.e. if have both dsos and run_exports, it's a run_exports_library.
+    '''
+    return library_natures([pkg], prefix, subdir, bldpkgs_dirs, output_folder, channel_urls,
+                           nature_cache=nature_cache)[pkg]
+
+
 def dists_from_names(names, prefix):
-    results = []
-    pkgs = linked_data(prefix)
-    for name in names:
-        for pkg in pkgs:
-            if pkg.quad[0] == name:
-                results.append(pkg)
-    return results
+    owners = get_prefix_owners(prefix)
+    return [pkg for name in names for pkg in owners.dists_by_name(name)]
 
 
 class FakeDist:
@@ -590,17 +761,63 @@ DEFAULT_WIN_WHITELIST = ['**/KERNEL32.dll',
                          '**/api-ms-win*.dll']
 
 
-def _collect_needed_dsos(sysroots, files, run_prefix, sysroot_substitution, build_prefix, build_prefix_substitution):
+# the liefldd analyses that _analyze_dsos runs, and the type of their results
+_DSO_ANALYSES = {'linkages': (get_linkages_memoized, set),
+                 'exports': (get_exports_memoized, list)}
+# below this many DSOs, starting a process pool costs more than it saves
+_MIN_DSOS_FOR_POOL = 8
+
+
+def _analyze_dso(task):
+    """Run in a worker: one DSO analysis, returned as a tuple, and what it printed"""
+    name, path, kw = task
+    out = StringIO()
+    stdout, sys.stdout = sys.stdout, out
+    try:
+        return tuple(_DSO_ANALYSES[name][0](path, **kw)), out.getvalue()
+    except Exception:
+        # redone in the parent, so that it fails (or warns) there as it always has
+        return None, out.getvalue()
+    finally:
+        sys.stdout = stdout
+
+
+def _analyze_dsos(tasks, workers=None):
+    """Run the (name, path, kwargs) DSO analyses of tasks on a process pool.
+
+    The results are handed to the memoized liefldd functions, so that calling them afterwards,
+    in whatever order, returns at once.  What the analyses print is printed in task order; those
+    that fail are left to be redone (and fail) in-process.
+    """
+    workers = min(int(workers or utils.cpu_count()), len(tasks))
+    if workers < 2 or len(tasks) < _MIN_DSOS_FOR_POOL:
+        return
+    try:
+        with ProcessPoolExecutor(workers) as executor:
+            results = list(executor.map(_analyze_dso, tasks))
+    except Exception as e:
+        utils.get_logger(__name__).debug("DSO analysis pool failed, analyzing in-process: %s", e)
+        return
+    for (name, path, kw), (result, output) in zip(tasks, results):
+        if result is not None:
+            sys.stdout.write(output)
+            func, result_type = _DSO_ANALYSES[name]
+            func.seed(result_type(result), path, **kw)
+
+
+def _collect_needed_dsos(sysroots, files, run_prefix, sysroot_substitution, build_prefix, build_prefix_substitution,
+                         workers=None, file_table=None):
     all_needed_dsos = set()
     needed_dsos_for_file = dict()
     sysroot = sysroots[0] if sysroots else ''
-    for f in files:
+    linkages_kw = dict(resolve_filenames=True, recurse=False, sysroot=sysroot, envroot=run_prefix)
+    file_table = file_table or get_file_table(run_prefix)
+    code_files = [f for f in files if file_table.get(f).codefile]
+    _analyze_dsos([('linkages', os.path.join(run_prefix, f), linkages_kw) for f in code_files],
+                  workers)
+    for f in code_files:
         path = os.path.join(run_prefix, f)
-        if not codefile_type(path):
-            continue
-        needed = get_linkages_memoized(path, resolve_filenames=True, recurse=False,
-                                       sysroot=sysroot,
-                                       envroot=run_prefix)
+        needed = get_linkages_memoized(path, **linkages_kw)
         if sysroot:
             needed = [n.replace(sysroot, sysroot_substitution) if n.startswith(sysroot)
                       else n for n in needed]
@@ -614,55 +831,74 @@ def _collect_needed_dsos(sysroots, files, run_prefix, sysroot_substitution, buil
     return all_needed_dsos, needed_dsos_for_file
 
 
-def _map_file_to_package(files, run_prefix, build_prefix, all_needed_dsos, pkg_vendored_dist, ignore_list_syms, sysroot_substitution):
+def _lib_candidates(prefix, all_needed_dsos):
+    """(path, in-prefix path, dynamic, static) of the libraries below prefix worth looking at"""
+    for subdir2, _, filez in os.walk(prefix):
+        for file in filez:
+            fp = os.path.join(subdir2, file)
+            dynamic_lib = any(glob2.fnmatch.fnmatch(fp, ext) for ext in ('*.so*', '*.dylib*', '*.dll')) and \
+                          codefile_type(fp, skip_symlinks=False) is not None
+            static_lib = any(glob2.fnmatch.fnmatch(fp, ext) for ext in ('*.a', '*.lib'))
+            # Looking at all the files is very slow.
+            if not dynamic_lib and not static_lib:
+                continue
+            rp = os.path.relpath(fp, prefix)
+            if dynamic_lib and rp not in all_needed_dsos:
+                continue
+            yield fp, rp, dynamic_lib, static_lib
+
+
+def _map_file_to_package(files, run_prefix, build_prefix, all_needed_dsos, pkg_vendored_dist, ignore_list_syms, sysroot_substitution,
+                         workers=None):
     # Form a mapping of file => package
     prefix_owners = {}
     contains_dsos = {}
     contains_static_libs = {}
     # Used for both dsos and static_libs
     all_lib_exports = {}
-    for prefix in (run_prefix, build_prefix):
-        for subdir2, _, filez in os.walk(prefix):
-            for file in filez:
-                fp = os.path.join(subdir2, file)
-                dynamic_lib = any(glob2.fnmatch.fnmatch(fp, ext) for ext in ('*.so*', '*.dylib*', '*.dll')) and \
-                              codefile_type(fp, skip_symlinks=False) is not None
-                static_lib = any(glob2.fnmatch.fnmatch(fp, ext) for ext in ('*.a', '*.lib'))
-                # Looking at all the files is very slow.
-                if not dynamic_lib and not static_lib:
-                    continue
-                rp = os.path.relpath(fp, prefix)
-                if dynamic_lib and rp not in all_needed_dsos:
-                    continue
-                if rp in all_lib_exports:
-                    continue
-                owners = prefix_owners[rp] if rp in prefix_owners else []
-                # Self-vendoring, not such a big deal but may as well report it?
-                if not len(owners):
-                    if rp in files:
-                        owners.append(pkg_vendored_dist)
-                new_pkgs = list(which_package(rp, prefix))
-                # Cannot filter here as this means the DSO (eg libomp.dylib) will not be found in any package
-                # [owners.append(new_pkg) for new_pkg in new_pkgs if new_pkg not in owners
-                #  and not any([glob2.fnmatch.fnmatch(new_pkg.name, i) for i in ignore_for_statics])]
-                for new_pkg in new_pkgs:
-                    if new_pkg not in owners:
-                        owners.append(new_pkg)
-                prefix_owners[rp] = owners
-                if len(prefix_owners[rp]):
-                    exports = set(e for e in get_exports_memoized(fp) if not
-                                  any(glob2.fnmatch.fnmatch(e, pattern) for pattern in ignore_list_syms))
-                    all_lib_exports[rp] = exports
-                    # Check codefile_type to filter out linker scripts.
-                    if dynamic_lib:
-                        contains_dsos[prefix_owners[rp][0]] = True
-                    elif static_lib:
-                        if sysroot_substitution in fp:
-                            if (prefix_owners[rp][0].name.startswith('gcc_impl_linux') or
-                               prefix_owners[rp][0].name == 'llvm'):
-                                continue
-                            print("sysroot in {}, owner is {}".format(fp, prefix_owners[rp][0]))
-                        contains_static_libs[prefix_owners[rp][0]] = True
+    candidates = [(prefix, get_prefix_owners(prefix), list(_lib_candidates(prefix, all_needed_dsos)))
+                  for prefix in (run_prefix, build_prefix)]
+    # Get the exports the loop below needs (those of the first owned copy of each library)
+    #    all at once.
+    exported = set()
+    tasks = []
+    for _, owners_index, libs in candidates:
+        for fp, rp, _, _ in libs:
+            if rp not in exported and (rp in files or owners_index.owners(rp)):
+                exported.add(rp)
+                tasks.append(('exports', fp, {}))
+    _analyze_dsos(tasks, workers)
+    for prefix, owners_index, libs in candidates:
+        for fp, rp, dynamic_lib, static_lib in libs:
+            if rp in all_lib_exports:
+                continue
+            owners = prefix_owners[rp] if rp in prefix_owners else []
+            # Self-vendoring, not such a big deal but may as well report it?
+            if not len(owners):
+                if rp in files:
+                    owners.append(pkg_vendored_dist)
+            new_pkgs = owners_index.owners(rp)
+            # Cannot filter here as this means the DSO (eg libomp.dylib) will not be found in any package
+            # [owners.append(new_pkg) for new_pkg in new_pkgs if new_pkg not in owners
+            #  and not any([glob2.fnmatch.fnmatch(new_pkg.name, i) for i in ignore_for_statics])]
+            for new_pkg in new_pkgs:
+                if new_pkg not in owners:
+                    owners.append(new_pkg)
+            prefix_owners[rp] = owners
+            if len(prefix_owners[rp]):
+                exports = set(e for e in get_exports_memoized(fp) if not
+                              any(glob2.fnmatch.fnmatch(e, pattern) for pattern in ignore_list_syms))
+                all_lib_exports[rp] = exports
+                # Check codefile_type to filter out linker scripts.
+                if dynamic_lib:
+                    contains_dsos[prefix_owners[rp][0]] = True
+                elif static_lib:
+                    if sysroot_substitution in fp:
+                        if (prefix_owners[rp][0].name.startswith('gcc_impl_linux') or
+                           prefix_owners[rp][0].name == 'llvm'):
+                            continue
+                        print("sysroot in {}, owner is {}".format(fp, prefix_owners[rp][0]))
+                    contains_static_libs[prefix_owners[rp][0]] = True
     return prefix_owners, contains_dsos, contains_static_libs, all_lib_exports
 
 
@@ -794,10 +1030,12 @@ def _lookup_in_prefix_packages(errors, needed_dso, files, run_prefix, whitelist,
 
 def _show_linking_messages(files, errors, needed_dsos_for_file, build_prefix, run_prefix, pkg_name,
                            error_overlinking, runpath_whitelist, verbose, requirements_run, lib_packages,
-                           lib_packages_used, whitelist, sysroots, sysroot_prefix, sysroot_substitution, subdir):
+                           lib_packages_used, whitelist, sysroots, sysroot_prefix, sysroot_substitution, subdir,
+                           file_table=None):
+    file_table = file_table or get_file_table(run_prefix)
     for f in files:
         path = os.path.join(run_prefix, f)
-        filetype = codefile_type(path)
+        filetype = file_table.get(f).codefile
         if not filetype or filetype not in filetypes_for_platform[subdir.split('-')[0]]:
             continue
         warn_prelude = "WARNING ({},{})".format(pkg_name, f)
@@ -836,9 +1074,11 @@ def check_overlinking_impl(pkg_name, pkg_version, build_str, build_number, subdi
                            run_prefix, build_prefix,
                            missing_dso_whitelist, runpath_whitelist,
                            error_overlinking, error_overdepending, verbose,
-                           exception_on_error, files, bldpkgs_dirs, output_folder, channel_urls):
+                           exception_on_error, files, bldpkgs_dirs, output_folder, channel_urls,
+                           workers=None, nature_cache=None, file_table=None):
     verbose = True
     errors = []
+    file_table = file_table or get_file_table(run_prefix)
 
     sysroot_substitution = '$SYSROOT/'
     build_prefix_substitution = '$PATH/'
@@ -848,8 +1088,8 @@ def check_overlinking_impl(pkg_name, pkg_version, build_str, build_number, subdi
     ignore_list = utils.ensure_list(ignore_run_exports)
     if subdir.startswith('linux'):
         ignore_list.append('libgcc-ng')
-    package_nature = {package: library_nature(package, run_prefix, subdir, bldpkgs_dirs, output_folder, channel_urls)
-                      for package in packages}
+    package_nature = library_natures(packages, run_prefix, subdir, bldpkgs_dirs, output_folder, channel_urls,
+                                     nature_cache=nature_cache)
     lib_packages = set([package for package in packages
                         if package.quad[0] not in ignore_list and
                         package_nature[package] != 'non-library'])
@@ -879,14 +1119,15 @@ def check_overlinking_impl(pkg_name, pkg_version, build_str, build_number, subdi
     # LIEF is very slow at decoding some DSOs, so we only let it look at ones that we link to (and ones we
     # have built).
     all_needed_dsos, needed_dsos_for_file = _collect_needed_dsos(sysroots, files, run_prefix, sysroot_substitution,
-                                                                 build_prefix, build_prefix_substitution)
+                                                                 build_prefix, build_prefix_substitution,
+                                                                 workers=workers, file_table=file_table)
 
     prefix_owners, _, _, all_lib_exports = _map_file_to_package(
-        files, run_prefix, build_prefix, all_needed_dsos, pkg_vendored_dist, ignore_list_syms, sysroot_substitution)
+        files, run_prefix, build_prefix, all_needed_dsos, pkg_vendored_dist, ignore_list_syms, sysroot_substitution,
+        workers=workers)
 
     for f in files:
-        path = os.path.join(run_prefix, f)
-        filetype = codefile_type(path)
+        filetype = file_table.get(f).codefile
         if not filetype or filetype not in filetypes_for_platform[subdir.split('-')[0]]:
             continue
         needed = needed_dsos_for_file[f]
@@ -902,7 +1143,8 @@ def check_overlinking_impl(pkg_name, pkg_version, build_str, build_number, subdi
     whitelist += missing_dso_whitelist
     _show_linking_messages(files, errors, needed_dsos_for_file, build_prefix, run_prefix, pkg_name,
                            error_overlinking, runpath_whitelist, verbose, requirements_run, lib_packages,
-                           lib_packages_used, whitelist, sysroots, sysroot_prefix, sysroot_substitution, subdir)
+                           lib_packages_used, whitelist, sysroots, sysroot_prefix, sysroot_substitution, subdir,
+                           file_table=file_table)
 
     if lib_packages_used != lib_packages:
         info_prelude = "   INFO ({})".format(pkg_name)
@@ -931,38 +1173,57 @@ def check_overlinking_impl(pkg_name, pkg_version, build_str, build_number, subdi
             sys.exit(1)
 
 
+@trace.traced('check overlinking', args=lambda m, files: {'files': len(files)})
 def check_overlinking(m, files):
-    return check_overlinking_impl(m.get_value('package/name'),
-                                  m.get_value('package/version'),
-                                  m.get_value('build/string'),
-                                  m.get_value('build/number'),
-                                  m.config.target_subdir,
-                                  m.get_value('build/ignore_run_exports'),
-                                  [req.split(' ')[0] for req in m.meta.get('requirements', {}).get('run', [])],
-                                  [req.split(' ')[0] for req in m.meta.get('requirements', {}).get('build', [])],
-                                  [req.split(' ')[0] for req in m.meta.get('requirements', {}).get('host', [])],
-                                  m.config.host_prefix,
-                                  m.config.build_prefix,
-                                  m.meta.get('build', {}).get('missing_dso_whitelist', []),
-                                  m.meta.get('build', {}).get('runpath_whitelist', []),
-                                  m.config.error_overlinking,
-                                  m.config.error_overdepending,
-                                  m.config.verbose,
-                                  True,
-                                  files,
-                                  m.config.bldpkgs_dir,
-                                  m.config.output_folder,
-                                  m.config.channel_urls)
-
-
-def post_process_shared_lib(m, f, files):
+    cache = dso_cache.activate(m.config)
+    # read again, in one go, the files relocation changed
+    file_table = get_file_table(m.config.host_prefix)
+    file_table.update(files)
+    try:
+        return check_overlinking_impl(m.get_value('package/name'),
+                                      m.get_value('package/version'),
+                                      m.get_value('build/string'),
+                                      m.get_value('build/number'),
+                                      m.config.target_subdir,
+                                      m.get_value('build/ignore_run_exports'),
+                                      [req.split(' ')[0] for req in m.meta.get('requirements', {}).get('run', [])],
+                                      [req.split(' ')[0] for req in m.meta.get('requirements', {}).get('build', [])],
+                                      [req.split(' ')[0] for req in m.meta.get('requirements', {}).get('host', [])],
+                                      m.config.host_prefix,
+                                      m.config.build_prefix,
+                                      m.meta.get('build', {}).get('missing_dso_whitelist', []),
+                                      m.meta.get('build', {}).get('runpath_whitelist', []),
+                                      m.config.error_overlinking,
+                                      m.config.error_overdepending,
+                                      m.config.verbose,
+                                      True,
+                                      files,
+                                      m.config.bldpkgs_dir,
+                                      m.config.output_folder,
+                                      m.config.channel_urls,
+                                      workers=m.config.dso_analysis_workers,
+                                      nature_cache=get_nature_cache(nature_cache_path(m.config)),
+                                      file_table=file_table)
+    finally:
+        if cache and m.config.debug:
+            print(cache.summary())
+
+
+def post_process_shared_lib(m, f, files, elf_files=None):
+    """Make the shared library (or executable) f relocatable.
+
+    ELF files are appended to elf_files, when given, for mk_relative_linux_files to do in one go.
+    """
     path = os.path.join(m.config.host_prefix, f)
-    codefile_t = codefile_type(path)
+    codefile_t = get_file_table(m.config.host_prefix).get(f).codefile
     if not codefile_t:
         return
     rpaths = m.get_value('build/rpaths', ['lib'])
     if sys.platform.startswith('linux') and codefile_t == 'elffile':
-        mk_relative_linux(f, m.config.host_prefix, rpaths=rpaths)
+        if elf_files is not None:
+            elf_files.append(f)
+        else:
+            mk_relative_linux(f, m.config.host_prefix, rpaths=rpaths)
     elif sys.platform == 'darwin' and codefile_t == 'machofile':
         mk_relative_osx(path, m.config.host_prefix, m.config.build_prefix, files=files, rpaths=rpaths)
 
@@ -991,6 +1252,7 @@ def fix_permissions(files, prefix):
                 log.warn(str(e))
 
 
+@trace.traced(args=lambda m, files, build_python: trace.file_args(files, m.config.host_prefix))
 def post_build(m, files, build_python):
     print('number of files:', len(files))
 
@@ -1005,19 +1267,25 @@ def post_build(m, files, build_python):
                       bool(m.get_value('build/osx_is_app', False)))
         check_symlinks(files, m.config.host_prefix, m.config.croot)
         prefix_files = utils.prefix_files(m.config.host_prefix)
-
-        for f in files:
-            if f.startswith('bin/'):
-                fix_shebang(f, prefix=m.config.host_prefix, build_python=build_python,
-                            osx_is_app=osx_is_app)
-            if binary_relocation is True or (isinstance(binary_relocation, list) and
-                                             f in binary_relocation):
-                post_process_shared_lib(m, f, prefix_files)
+        file_table = get_file_table(m.config.host_prefix)
+        file_table.update(files)
+
+        with trace.span('relocate', files=len(files)):
+            fix_shebangs(files, m.config.host_prefix, build_python, osx_is_app=osx_is_app,
+                         file_table=file_table)
+            elf_files = []
+            for f in files:
+                if binary_relocation is True or (isinstance(binary_relocation, list) and
+                                                 f in binary_relocation):
+                    post_process_shared_lib(m, f, prefix_files, elf_files=elf_files)
+            mk_relative_linux_files(elf_files, m.config.host_prefix,
+                                    rpaths=m.get_value('build/rpaths', ['lib']))
     # disable overlinking check on win right now, until Ray has time for it.
     if not utils.on_win:
         check_overlinking(m, files)
 
 
+@trace.traced('check symlinks')
 def check_symlinks(files, prefix, croot):
     if readlink is False:
         return  # Not on Unix system
@@ -30,7 +30,7 @@ from .conda_interface import conda_43
 from .conda_interface import specs_from_url
 from .conda_interface import memoized
 
-from conda_build import exceptions, utils, environ
+from conda_build import exceptions, utils, environ, trace
 from conda_build.metadata import MetaData, combine_top_level_metadata_with_output
 import conda_build.source as source
 from conda_build.variants import (get_package_variants, list_of_dicts_to_dict_of_lists,
@@ -140,7 +140,8 @@ def get_env_dependencies(m, env, variant, exclude_pattern=None,
                                                   disable_pip=m.config.disable_pip,
                                                   max_env_retry=m.config.max_env_retry,
                                                   output_folder=m.config.output_folder,
-                                                  channel_urls=tuple(m.config.channel_urls))
+                                                  channel_urls=tuple(m.config.channel_urls),
+                                                  solve_cache_dir=m.config.solve_cache_dir)
         except (UnsatisfiableError, DependencyNeedsBuildingError) as e:
             # we'll get here if the environment is unsatisfiable
             if hasattr(e, 'packages'):
@@ -454,6 +455,7 @@ def _simplify_to_exact_constraints(metadata):
     metadata.meta['requirements'] = requirements
 
 
+@trace.traced('finalize', cat='render', args=lambda m, *a, **kw: {'name': m.name()})
 def finalize_metadata(m, parent_metadata=None, permit_unsatisfiable_variants=False):
     """Fully render a recipe.  Fill in versions for build/host dependencies."""
     if not parent_metadata:
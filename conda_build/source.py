@@ -13,6 +13,7 @@ import time
 from .conda_interface import download, TemporaryDirectory
 from .conda_interface import hashsum_file
 
+from conda_build import trace
 from conda_build.os_utils import external
 from conda_build.conda_interface import url_path, CondaHTTPError
 from conda_build.utils import (decompressible_exts, tar_xf, safe_print_unicode, copy_into, on_win, ensure_list,
@@ -36,6 +37,8 @@ def append_hash_to_fn(fn, hash_value):
     return ext_re.sub(r"\1_{}\2".format(hash_value[:10]), fn)
 
 
+@trace.traced('download', args=lambda cache_folder, recipe_path, source_dict, *a, **kw: {
+    'url': source_dict.get('url')})
 def download_to_cache(cache_folder, recipe_path, source_dict, verbose=False):
     ''' Download a source to the local cache. '''
     log = get_logger(__name__)
@@ -548,6 +551,7 @@ def _get_patch_file_details(path):
     return (files, is_git_format)
 
 
+@trace.traced('patch', args=lambda src_dir, path, *a, **kw: {'patch': basename(path)})
 def apply_patch(src_dir, path, config, git=None):
     if not isfile(path):
         sys.exit('Error: no such patch: %s' % path)
@@ -625,6 +629,7 @@ def apply_patch(src_dir, path, config, git=None):
                 raise
 
 
+@trace.traced('source', args=lambda metadata: {'name': metadata.name()})
 def provide(metadata):
     """
     given a recipe_dir:
@@ -0,0 +1,143 @@
+'''
+Local history of build statistics, used to estimate how long a build will take.
+
+Every entry of the stats that ``build_tree`` collects (and writes to ``--stats-file``) is kept
+as a row of a small sqlite database, keyed the same way: the phase, the package name and
+version and the variant, e.g. ``buildlibfoo-1.2-python_3.7``.  ``estimate`` looks a phase up
+by that key and falls back to other versions of the same package, so that a version bump
+still gets an estimate.
+
+Unless ``stats_history`` says otherwise, the database is ``<croot>/stats_history.sqlite``.
+'''
+from __future__ import absolute_import, division, print_function
+
+import contextlib
+import json
+import os
+import sqlite3
+import time
+
+from conda_build.utils import get_logger
+
+DB_FILE = 'stats_history.sqlite'
+# number of recent records an estimate is made from
+RECENT = 5
+
+HistoryError = sqlite3.Error
+
+_schema = '''
+CREATE TABLE IF NOT EXISTS stats (
+    key TEXT NOT NULL,
+    recorded REAL NOT NULL,
+    elapsed REAL,
+    cpu_user REAL,
+    cpu_sys REAL,
+    rss INTEGER,
+    disk INTEGER
+);
+CREATE INDEX IF NOT EXISTS stats_key ON stats (key, recorded);
+'''
+
+
+def history_path(config):
+    return config.stats_history or os.path.join(config.croot, DB_FILE)
+
+
+@contextlib.contextmanager
+def _connect(path):
+    dirname = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    # concurrent builds sharing a croot wait for each other's writes rather than failing
+    conn = sqlite3.connect(path, timeout=60)
+    try:
+        conn.executescript(_schema)
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def record(path, stats, recorded=None):
+    """Add the per-phase entries of a stats dict to the history at path"""
+    recorded = time.time() if recorded is None else recorded
+    rows = [(key, recorded, step.get('elapsed'), step.get('cpu_user'), step.get('cpu_sys'),
+             step.get('rss'), step.get('disk'))
+            for key, step in stats.items()
+            if key != 'total' and isinstance(step, dict) and step.get('elapsed') is not None]
+    if not rows:
+        return 0
+    with _connect(path) as conn:
+        conn.executemany('INSERT INTO stats VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+    return len(rows)
+
+
+def record_stats_file(path, stats_file):
+    """Add a file written by --stats-file to the history, dated by the file's mtime"""
+    with open(stats_file) as f:
+        stats = json.load(f)
+    return record(path, stats, recorded=os.path.getmtime(stats_file))
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def _summarize(rows, match):
+    elapsed = [row[0] for row in rows if row[0] is not None]
+    cpu = [(row[1] or 0) + (row[2] or 0) for row in rows]
+    return {'elapsed': round(_median(elapsed), 1) if elapsed else None,
+            'cpu': round(_median(cpu), 1),
+            'rss': max(row[3] or 0 for row in rows),
+            'disk': max(row[4] or 0 for row in rows),
+            'samples': len(rows),
+            'match': match}
+
+
+class StatsHistory(object):
+    """Read access to the history, for estimating the phases of builds not done yet"""
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        if os.path.isfile(path):
+            try:
+                self._conn = sqlite3.connect(path, timeout=60)
+            except sqlite3.Error as e:
+                get_logger(__name__).warn("Could not read stats history %s: %s", path, e)
+
+    def close(self):
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+
+    def _recent(self, where, arg):
+        query = ('SELECT elapsed, cpu_user, cpu_sys, rss, disk FROM stats WHERE {} '
+                 'ORDER BY recorded DESC LIMIT ?'.format(where))
+        try:
+            return self._conn.execute(query, (arg, RECENT)).fetchall()
+        except sqlite3.Error as e:
+            get_logger(__name__).debug("stats history query failed: %s", e)
+            return []
+
+    def estimate(self, key, fallback_prefix=None):
+        """Estimate a phase from its recent records.
+
+        key is the stats key of the phase (see ``build.stats_key``).  When it has never been
+        recorded, records whose key is fallback_prefix followed by a version are used instead
+        (match is then 'other version').  Returns None when nothing is known.
+        """
+        if self._conn is None:
+            return None
+        rows = self._recent('key = ?', key)
+        if rows:
+            return _summarize(rows, 'exact')
+        if fallback_prefix:
+            # package names can't contain glob characters; versions start with a digit
+            rows = self._recent('key GLOB ?', fallback_prefix + '[0-9]*')
+            if rows:
+                return _summarize(rows, 'other version')
+        return None
@@ -0,0 +1,134 @@
+'''
+Timeline of a conda-build run, in the Chrome trace-event format.
+
+While recording, every phase of the build that is wrapped in ``span`` (or a function decorated
+with ``traced``) adds a complete ("X") event with its start, duration and arguments.  Spans
+nest by time on each thread, so the written file shows render, solve, link, source, build
+script, post-processing, packaging and test phases as a flame chart in chrome://tracing or
+https://ui.perfetto.dev.
+
+Nothing is recorded, and spans cost next to nothing, unless ``record`` is active; that is what
+``--trace-file`` turns on.  Worker processes record their spans with ``collect`` and hand them
+back to be added to the recording with ``merge``.
+'''
+from __future__ import absolute_import, division, print_function
+
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+_lock = threading.Lock()
+_events = None
+
+
+def recording():
+    return _events is not None
+
+
+def _now():
+    return int(time.time() * 1e6)
+
+
+@contextlib.contextmanager
+def record(path):
+    """Record spans for the duration of the block, then write them to path"""
+    global _events
+    _events = [{'name': 'process_name', 'ph': 'M', 'pid': os.getpid(), 'tid': 0,
+                'args': {'name': 'conda-build'}}]
+    try:
+        with span('conda-build', cat='session'):
+            yield
+    finally:
+        events, _events = _events, None
+        write(path, events)
+
+
+@contextlib.contextmanager
+def collect(events, name='conda-build worker'):
+    """Record spans for the duration of the block into the list events, or none if it is None.
+
+    This is for worker processes: a forked worker would otherwise add its spans to its copy of
+    the parent's recording, where they are lost.  Return events to the parent for ``merge``.
+    """
+    global _events
+    if events is not None:
+        events.append({'name': 'process_name', 'ph': 'M', 'pid': os.getpid(), 'tid': 0,
+                       'args': {'name': name}})
+    saved, _events = _events, events
+    try:
+        yield
+    finally:
+        _events = saved
+
+
+def merge(events):
+    """Add the events a worker recorded with ``collect`` to the recording, if there is one"""
+    with _lock:
+        if _events is not None:
+            _events.extend(events)
+
+
+def write(path, events):
+    dirname = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    with open(path, 'w') as f:
+        # arguments are whatever the build passed in; anything exotic is written as a string
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, default=str)
+
+
+@contextlib.contextmanager
+def span(name, cat='build', **args):
+    """Time the block as a span called name.
+
+    Yields the span's arguments, so that counts only known at the end of the block can be added
+    to them.
+    """
+    if _events is None:
+        yield args
+        return
+    start = _now()
+    try:
+        yield args
+    except BaseException as e:
+        args['error'] = '{}: {}'.format(type(e).__name__, e)
+        raise
+    finally:
+        event = {'name': name, 'cat': cat, 'ph': 'X', 'ts': start, 'dur': _now() - start,
+                 'pid': os.getpid(), 'tid': threading.current_thread().ident, 'args': args}
+        with _lock:
+            if _events is not None:
+                _events.append(event)
+
+
+def traced(name=None, cat='build', args=None):
+    """Decorate a function so that each call is a span.
+
+    ``args`` is called with the function's arguments and returns the span's arguments; it is
+    only evaluated while recording.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*a, **kw):
+            if _events is None:
+                return func(*a, **kw)
+            with span(name or func.__name__, cat=cat, **(args(*a, **kw) if args else {})):
+                return func(*a, **kw)
+        return wrapper
+    return decorator
+
+
+def file_args(files, prefix):
+    """Count files (relative to prefix) and their bytes, for a span's arguments"""
+    if _events is None:
+        return {}
+    size = 0
+    for f in files:
+        try:
+            size += os.lstat(os.path.join(prefix, f)).st_size
+        except OSError:
+            pass
+    return {'files': len(files), 'bytes': size}
@@ -0,0 +1,188 @@
+'''
+Deferred deletion of build prefixes, test prefixes and work directories.
+
+Deleting a prefix with many small files can take tens of seconds, and a build does it after
+every output and between variants.  ``discard`` instead renames the directory into a trash
+folder in the croot, which is one atomic rename on the same filesystem, and deletes it on
+background threads while the build goes on.  When the rename is not possible (another
+filesystem, files held open on Windows), the path is deleted in place as before.
+
+Each process trashes into its own ``<croot>/.trash/<pid>-<random>`` folder, and holds
+``<pid>-<random>.lock`` while it runs.  Pending deletions are finished when the process exits;
+trash left behind by a process that died is deleted by the next one to start, once its lock
+can be taken.
+'''
+from __future__ import absolute_import, division, print_function
+
+import atexit
+from concurrent.futures import ThreadPoolExecutor
+import os
+import shutil
+import stat
+import threading
+import time
+import uuid
+
+import filelock
+
+from conda_build import utils
+
+TRASH_DIR = '.trash'
+WORKERS = 4
+
+_trashes = {}
+_trashes_lock = threading.Lock()
+
+
+def _make_writable(func, path, exc_info):
+    try:
+        os.chmod(path, stat.S_IREAD | stat.S_IWRITE | stat.S_IEXEC)
+        func(path)
+    except (IOError, OSError):
+        pass
+
+
+def _delete(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, onerror=_make_writable)
+    elif os.path.lexists(path):
+        os.unlink(path)
+
+
+class Trash(object):
+    def __init__(self, root):
+        self.root = root
+        name = '{}-{}'.format(os.getpid(), uuid.uuid4().hex[:8])
+        self.path = os.path.join(root, name)
+        self._executor = ThreadPoolExecutor(WORKERS)
+        self._futures = []
+        self._lock = threading.Lock()
+        self.discarded = 0
+        self.fallbacks = 0
+        self.delete_time = 0.0
+        self.rename_time = 0.0
+
+        if not os.path.isdir(root):
+            os.makedirs(root)
+        # lock before the folder exists, so that no other process takes it for abandoned
+        self._owner = filelock.FileLock(self.path + '.lock')
+        self._owner.acquire()
+        os.makedirs(self.path)
+        self._resume_abandoned()
+
+    def _resume_abandoned(self):
+        """Delete what processes that died before emptying their trash left behind"""
+        for entry in os.listdir(self.root):
+            path = os.path.join(self.root, entry)
+            if path == self.path or not os.path.isdir(path):
+                continue
+            # the lock file comes first; without one, the folder is somebody's that is not ready
+            if not os.path.isfile(path + '.lock'):
+                continue
+            lock = filelock.FileLock(path + '.lock')
+            try:
+                lock.acquire(timeout=0)
+            except filelock.Timeout:
+                continue  # still in use by a running build
+            self._submit(self._delete_abandoned, path, lock)
+
+    def _delete_abandoned(self, path, lock):
+        try:
+            _delete(path)
+        finally:
+            lock.release()
+            utils.rm_rf(lock.lock_file)
+
+    def _submit(self, func, *args):
+        with self._lock:
+            self._futures = [future for future in self._futures if not future.done()]
+            self._futures.append(self._executor.submit(func, *args))
+
+    def _timed_delete(self, path):
+        start = time.time()
+        try:
+            _delete(path)
+        finally:
+            with self._lock:
+                self.delete_time += time.time() - start
+
+    def discard(self, path, config=None):
+        """Make path go away now, and delete it in the background where possible"""
+        if not os.path.lexists(path):
+            return
+        start = time.time()
+        dest = os.path.join(self.path, uuid.uuid4().hex + '-' + os.path.basename(path))
+        try:
+            os.rename(path, dest)
+        except OSError:
+            with self._lock:
+                self.fallbacks += 1
+            utils.rm_rf(path, config=config)
+            return
+        with self._lock:
+            self.discarded += 1
+            self.rename_time += time.time() - start
+        # also forget about any environment conda knows of at this path
+        utils.rm_rf(path, config=config)
+        self._submit(self._timed_delete, dest)
+
+    def pending(self):
+        with self._lock:
+            return sum(1 for future in self._futures if not future.done())
+
+    def wait(self):
+        """Block until everything discarded so far is deleted"""
+        with self._lock:
+            futures = list(self._futures)
+        for future in futures:
+            try:
+                future.result()
+            except (IOError, OSError) as e:
+                utils.get_logger(__name__).debug("background delete failed: %s", e)
+
+    def close(self):
+        self.wait()
+        self._executor.shutdown()
+        _delete(self.path)
+        self._owner.release()
+        utils.rm_rf(self._owner.lock_file)
+
+    def summary(self):
+        return {'discarded': self.discarded, 'fallbacks': self.fallbacks,
+                'pending': self.pending(), 'rename_time': self.rename_time,
+                'delete_time': self.delete_time}
+
+
+def get_trash(config):
+    """Return the Trash of this process for config's croot, or None when it is turned off"""
+    if not getattr(config, 'background_delete', False):
+        return None
+    # a forked worker inherits the parent's trashes, but none of their threads
+    key = os.getpid(), os.path.join(config.croot, TRASH_DIR)
+    with _trashes_lock:
+        if key not in _trashes:
+            try:
+                _trashes[key] = Trash(key[1])
+            except (IOError, OSError) as e:
+                utils.get_logger(__name__).warn("Not deleting in the background: %s", e)
+                _trashes[key] = None
+        return _trashes[key]
+
+
+def discard(path, config):
+    """Remove path: in the background if config allows it, else right away"""
+    trash = get_trash(config)
+    if trash:
+        trash.discard(path, config=config)
+    else:
+        utils.rm_rf(path, config=config)
+
+
+@atexit.register
+def _finish():
+    for (pid, _), trash in _trashes.items():
+        if trash and pid == os.getpid():
+            pending = trash.pending()
+            if pending:
+                print("Waiting for {} background deletions to finish".format(pending))
+            trash.close()
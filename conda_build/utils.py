@@ -1,6 +1,7 @@
 from __future__ import absolute_import, division, print_function
 
 from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import contextlib
 import fnmatch
 import hashlib
@@ -10,6 +11,7 @@ import libarchive
 import logging
 import logging.config
 import mmap
+from multiprocessing import cpu_count
 import operator
 import os
 from os.path import (dirname, getmtime, getsize, isdir, join, isfile, abspath, islink,
@@ -230,8 +232,47 @@ class PopenWrapper(object):
         self.returncode = None
         self.disk = 0
         self.processes = 1
+        self.cpu_user = 0
+        self.cpu_sys = 0
+        self.cpu_by_name = None
+        self.series = None
+
+        from conda_build.os_utils import sampler
+        if sampler.available():
+            self.out, self.err = self._execute_sampled(sampler, *args, **kwargs)
+        else:
+            self.out, self.err = self._execute(*args, **kwargs)
 
-        self.out, self.err = self._execute(*args, **kwargs)
+    def _execute_sampled(self, sampler, *args, **kwargs):
+        # Linux: account through cgroups and /proc, which is cheap enough to do every 100ms
+        time_int = kwargs.pop('time_int', 0.1)
+        resources = sampler.ResourceSampler(kwargs.get('cwd') or os.getcwd())
+        resources.start()
+        start_time = time.time()
+        _popen = subprocess.Popen(*args, **kwargs)
+        resources.attach(_popen.pid)
+        try:
+            while self.returncode is None:
+                resources.sample()
+                time.sleep(time_int)
+                self.returncode = _popen.poll()
+        except KeyboardInterrupt:
+            _popen.kill()
+            raise
+        finally:
+            self.elapsed = time.time() - start_time
+            resources.finish()
+
+        self.rss, self.vms = resources.rss, resources.vms
+        self.processes = max(resources.processes, 1)
+        self.cpu_user, self.cpu_sys = resources.cpu_user, resources.cpu_sys
+        self.disk = resources.disk
+        self.cpu_by_name = resources.cpu_by_name
+        self.series = resources.series
+        get_logger(__name__).debug("took %d samples in %.3fs; %d processes ran",
+                                   resources.samples, resources.sample_time,
+                                   resources.processes_seen)
+        return _popen.stdout, _popen.stderr
 
     def _execute(self, *args, **kwargs):
         try:
@@ -360,6 +401,10 @@ def _func_defaulting_env_to_os_environ(func, *popenargs, **kwargs):
                     'cpu_sys': proc.cpu_sys,
                     'rss': proc.rss,
                     'vms': proc.vms})
+        if proc.cpu_by_name is not None:
+            stats['cpu_by_name'] = proc.cpu_by_name
+            # (seconds since start, rss, cpu seconds, disk, processes)
+            stats['series'] = proc.series
     else:
         if func == 'call':
             subprocess.check_call(_args, **kwargs)
@@ -396,9 +441,10 @@ def bytes2human(n):
     return "%sB" % n
 
 
-def get_recipe_abspath(recipe):
+def get_recipe_abspath(recipe, members=None):
     """resolve recipe dir as absolute path.  If recipe is a tarball rather than a folder,
-    extract it and return the extracted directory.
+    extract it and return the extracted directory.  If members is given, only those paths
+    are extracted from the tarball.
 
     Returns the absolute path, and a boolean flag that is true if a tarball has been extracted
     and needs cleanup.
@@ -409,7 +455,10 @@ def get_recipe_abspath(recipe):
     if isfile(recipe):
         if recipe.lower().endswith(decompressible_exts) or recipe.lower().endswith(CONDA_TARBALL_EXTENSIONS):
             recipe_dir = tempfile.mkdtemp()
-            tar_xf(recipe, recipe_dir)
+            if members:
+                tar_xf_members(recipe, recipe_dir, members)
+            else:
+                tar_xf(recipe, recipe_dir)
             # At some stage the old build system started to tar up recipes.
             recipe_tarfile = os.path.join(recipe_dir, 'info', 'recipe.tar')
             if isfile(recipe_tarfile):
@@ -490,6 +539,93 @@ def _copy_with_shell_fallback(src, dst):
                 raise OSError("Failed to copy {} to {}.  Error was: {}".format(src, dst, e))
 
 
+# from linux/fs.h - _IOW(0x94, 9, int)
+_FICLONE = 0x40049409
+
+
+def reflink(src, dst):
+    """Make dst a copy-on-write clone of the regular file src (e.g. on btrfs or xfs).
+
+    Returns False, leaving dst in an unspecified state, where the filesystem can't do that.
+    """
+    if not sys.platform.startswith('linux'):
+        return False
+    import fcntl
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+        except (IOError, OSError):
+            return False
+    shutil.copystat(src, dst)
+    return True
+
+
+def reflink_or_copy(src, dst):
+    """Copy a regular file, sharing its blocks with src where the filesystem allows it.
+
+    Tries a reflink and then copy_file_range, both of which avoid pulling the data through
+    userspace, before falling back to a plain copy.  Permission bits and timestamps are preserved
+    either way.
+    """
+    if reflink(src, dst):
+        return
+    if hasattr(os, 'copy_file_range'):
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            remaining = os.fstat(fsrc.fileno()).st_size
+            try:
+                while remaining > 0:
+                    copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                    if not copied:
+                        break
+                    remaining -= copied
+            except OSError:
+                pass
+        if remaining == 0:
+            shutil.copystat(src, dst)
+            return
+    _copy_with_shell_fallback(src, dst)
+
+
+def copy_prefix_files(src_root, dst_root, files, threads=None):
+    """Copy ``files`` (paths relative to src_root) into dst_root in one go.
+
+    This is the bulk version of calling ``copy_into(..., symlinks=True)`` for each file:
+    symlinks are recreated, with targets inside src_root pointing into dst_root instead, and
+    existing files in dst_root are replaced.  Regular files are reflinked when the filesystem
+    supports it, and otherwise copied on ``threads`` threads (the CPU count by default).  The
+    copies never share inodes with the originals, so either side can be modified in place
+    afterwards.  Returns 'reflink' or 'copy', whichever was used.
+    """
+    regular = []
+    for d in sorted(set(os.path.dirname(f) for f in files)):
+        if d and not isdir(join(dst_root, d)):
+            os.makedirs(join(dst_root, d))
+    for f in files:
+        src, dst = join(src_root, f), join(dst_root, f)
+        if islink(dst) or (os.path.lexists(dst) and not isdir(dst)):
+            os.remove(dst)
+        if islink(src):
+            src_base, dst_base = get_prefix_replacement_paths(src, dst)
+            os.symlink(os.readlink(src).replace(src_base, dst_base), dst)
+        elif isdir(src):
+            if not isdir(dst):
+                os.makedirs(dst)
+        else:
+            regular.append((src, dst))
+    if not regular:
+        return 'reflink'
+    # try the first file to find out whether this filesystem can share blocks at all
+    if reflink(*regular[0]):
+        for src, dst in regular[1:]:
+            if not reflink(src, dst):
+                reflink_or_copy(src, dst)
+        return 'reflink'
+    with ThreadPoolExecutor(threads or cpu_count()) as executor:
+        # list() so that the first error is raised here
+        list(executor.map(lambda args: reflink_or_copy(*args), regular))
+    return 'copy'
+
+
 def get_prefix_replacement_paths(src, dst):
     ssplit = src.split(os.path.sep)
     dsplit = dst.split(os.path.sep)
@@ -718,6 +854,37 @@ def tar_xf(tarball, dir_path):
         libarchive.extract_file(tarball, flags)
 
 
+def tar_xf_members(tarball, dir_path, members):
+    """Extract only the files (or folders, recursively) named in members from tarball.
+
+    The archive is still read through once, but nothing else is written to disk.  Returns the
+    paths of the entries that were extracted.
+    """
+    flags = libarchive.extract.EXTRACT_TIME | \
+            libarchive.extract.EXTRACT_PERM | \
+            libarchive.extract.EXTRACT_SECURE_NODOTDOT | \
+            libarchive.extract.EXTRACT_SECURE_SYMLINKS | \
+            libarchive.extract.EXTRACT_SECURE_NOABSOLUTEPATHS
+    if not os.path.isabs(tarball):
+        tarball = os.path.join(os.getcwd(), tarball)
+    members = tuple(m.rstrip('/') for m in members)
+    extracted = []
+
+    def wanted(entries):
+        for entry in entries:
+            name = entry.pathname
+            if name.startswith('./'):
+                name = name[2:]
+            if any(name == m or name.startswith(m + '/') for m in members):
+                extracted.append(name)
+                yield entry
+
+    with tmp_chdir(dir_path):
+        with libarchive.file_reader(tarball) as archive:
+            libarchive.extract.extract_entries(wanted(archive), flags)
+    return extracted
+
+
 def file_info(path):
     return {'size': getsize(path),
             'md5': md5_file(path),
@@ -1062,6 +1229,137 @@ def expand_globs(path_list, root_dir):
     return sorted(files)
 
 
+_glob_magic = re.compile('[*?[]')
+_compiled_globs = {}
+
+
+def has_glob_magic(path):
+    return _glob_magic.search(path) is not None
+
+
+def _compile_glob_part(part):
+    """Regex matching one path component against a glob component, like fnmatch does"""
+    regex = _compiled_globs.get(part)
+    if regex is None:
+        regex = _compiled_globs[part] = re.compile(fnmatch.translate(os.path.normcase(part)))
+    return regex
+
+
+class PrefixFileIndex(object):
+    """Files of a prefix (relative paths, as given by prefix_files) indexed for selecting them.
+
+    The paths are kept in a trie of their components.  Finding what is below a directory, or
+    what matches a glob, walks only the matching branches (like glob does on disk) instead of
+    testing every file, and glob components are compiled once and shared by all indexes.  An
+    index can be layered over another (``base``), so that files common to many outputs of a
+    build are indexed once.  ``files`` holds the paths indexed here, not those of the base.
+    """
+    _FILE = ''  # key under which a trie node records that its path is itself a file
+
+    def __init__(self, files=(), base=None):
+        self.files = set(files)
+        self._root = {}
+        self._roots = (base._roots if base else []) + [self._root]
+        for path in self.files:
+            node = self._root
+            for part in os.path.normpath(path).split(os.sep):
+                node = node.setdefault(part, {})
+            node[self._FILE] = True
+
+    def _find(self, parts):
+        nodes = []
+        for node in self._roots:
+            for part in parts:
+                node = node.get(part)
+                if node is None:
+                    break
+            else:
+                nodes.append(node)
+        return nodes
+
+    def _walk(self, path, node, skip_hidden=False):
+        """(path, node) of everything below node"""
+        todo = [(path, node)]
+        while todo:
+            path, node = todo.pop()
+            for name, child in node.items():
+                if name == self._FILE or (skip_hidden and name.startswith('.')):
+                    continue
+                child_path = os.path.join(path, name) if path else name
+                yield child_path, child
+                todo.append((child_path, child))
+
+    def _below(self, path, node):
+        return [child_path for child_path, child in self._walk(path, node) if self._FILE in child]
+
+    def glob(self, pattern, root_dir=None):
+        """Paths (files and directories) matching pattern, with the semantics of glob.glob.
+
+        As with glob, a pattern ending in a separator matches directories only.  Symlinks to
+        directories are files of the index; given the root_dir of the files, those that lead to
+        a directory on disk count as directories too.
+        """
+        dirs_only = pattern.endswith(('/', os.sep))
+        parts = os.path.normpath(pattern.replace('/', os.sep)).split(os.sep)
+        matches = [('', root) for root in self._roots]
+        for i, part in enumerate(parts):
+            last = i == len(parts) - 1
+            found = []
+            for path, node in matches:
+                if part == '**':
+                    # any number of directories, or everything below when it comes last
+                    if path or not last:
+                        found.append((path, node))
+                    if last:
+                        found.extend(self._walk(path, node, skip_hidden=True))
+                    else:
+                        found.extend((child_path, child) for child_path, child in
+                                     self._walk(path, node, skip_hidden=True)
+                                     if self._FILE not in child)
+                elif not has_glob_magic(part):
+                    child = node.get(part)
+                    if child is not None:
+                        found.append((os.path.join(path, part) if path else part, child))
+                else:
+                    regex = _compile_glob_part(part)
+                    for name, child in node.items():
+                        if (name != self._FILE and regex.match(os.path.normcase(name)) and
+                                (part.startswith('.') or not name.startswith('.'))):
+                            found.append((os.path.join(path, name) if path else name, child))
+            matches = found
+        if dirs_only:
+            matches = [(path, node) for path, node in matches
+                       if any(name != self._FILE for name in node) or
+                       (root_dir and os.path.isdir(os.path.join(root_dir, path)))]
+        return sorted(set(path for path, _ in matches))
+
+    def select(self, path_list, root_dir):
+        """Same as expand_globs(path_list, root_dir), looking in the index instead of on disk"""
+        files = []
+        for path in path_list:
+            if os.path.isabs(path):
+                if not path.startswith(root_dir + os.sep):
+                    files.extend(expand_globs([path], root_dir))
+                    continue
+                path = path[len(root_dir) + 1:]
+            parts = os.path.normpath(path.replace('/', os.sep)).split(os.sep)
+            nodes = self._find(parts)
+            if nodes:
+                path = os.sep.join(parts)
+                for node in nodes:
+                    if self._FILE in node:
+                        files.append(path)
+                    else:
+                        files.extend(self._below(path, node))
+            else:
+                glob_files = self.glob(path, root_dir)
+                if not glob_files:
+                    log = get_logger(__name__)
+                    log.error('Glob {} did not match in root_dir {}'.format(path, root_dir))
+                files.extend(glob_files)
+        return sorted(set(files))
+
+
 def find_recipe(path):
     """recurse through a folder, locating meta.yaml.  Raises error if more than one is found.
 
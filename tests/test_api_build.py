@@ -26,8 +26,8 @@ import pytest
 import yaml
 import tarfile
 
-from conda_build import api, exceptions, __version__
-from conda_build.build import VersionOrder
+from conda_build import api, build_journal, exceptions, __version__
+from conda_build.build import VersionOrder, find_built_packages, package_key
 from conda_build.render import finalize_metadata
 from conda_build.utils import (copy_into, on_win, check_call_env, convert_path_for_cygwin_or_msys2,
                                package_has_file, check_output_env, get_conda_operation_locks, rm_rf,
@@ -39,7 +39,7 @@ from conda_build.conda_interface import reset_context
 from conda.exceptions import ClobberError, CondaMultiError
 from conda_build.conda_interface import conda_46
 
-from .utils import is_valid_dir, metadata_dir, fail_dir, add_mangling
+from .utils import is_valid_dir, metadata_dir, fail_dir, add_mangling, subpackage_dir
 
 # define a few commonly used recipes - use os.path.join(metadata_dir, recipe) elsewhere
 empty_sections = os.path.join(metadata_dir, "empty_sections")
@@ -161,6 +161,34 @@ def test_no_include_recipe_config_arg(testing_metadata):
     assert not package_has_file(output_file, "info/recipe/meta.yaml")
 
 
+def test_trace_file(testing_metadata):
+    trace_file = os.path.join(testing_metadata.config.croot, 'trace.json')
+    api.build(testing_metadata, trace_file=trace_file)
+    with open(trace_file) as f:
+        events = json.load(f)['traceEvents']
+    names = set(event['name'] for event in events)
+    assert {'conda-build', 'build', 'bundle_conda', 'post_build', 'compress', 'test'} <= names
+    compress = [event for event in events if event['name'] == 'compress'][0]
+    assert compress['args']['files'] > 0 and compress['args']['bytes'] > 0
+
+
+def test_resume_skips_finished_recipes(testing_config):
+    recipe = os.path.join(metadata_dir, 'empty_sections')
+    outputs = api.build(recipe, config=testing_config, notest=True)
+    # a run that completes leaves nothing to resume
+    assert not os.listdir(os.path.join(testing_config.croot, build_journal.JOURNAL_DIR))
+
+    # pretend the run was interrupted right after this recipe
+    journal = build_journal.get_build_journal(testing_config, [recipe])
+    journal.rendered(recipe, ['[]'])
+    journal.variant_done(recipe, '[]', outputs)
+    journal.recipe_done(recipe)
+    mtimes = [os.path.getmtime(output) for output in outputs]
+
+    assert api.build(recipe, config=testing_config, notest=True, resume=True) == outputs
+    assert [os.path.getmtime(output) for output in outputs] == mtimes
+
+
 def test_no_include_recipe_meta_yaml(testing_metadata, testing_config):
     # first, make sure that the recipe is there by default.  This test copied from above, but copied
     # as a sanity check here.
@@ -381,6 +409,35 @@ def test_skip_existing_url(testing_metadata, testing_workdir, capfd):
     assert "are already built" in output
 
 
+def test_find_built_packages(testing_metadata, testing_workdir):
+    api.build(testing_metadata, notest=True)
+    other = testing_metadata.copy()
+    other.meta['package']['version'] = '2.0'
+
+    built = find_built_packages([testing_metadata, other], 'host')
+    assert built == {package_key(testing_metadata)}
+
+    testing_metadata.config.skip_existing = other.config.skip_existing = True
+    paths = api.get_output_file_paths([(testing_metadata, None, None), (other, None, None)])
+    assert len(paths) == 2
+    assert any(path.startswith('Skipped: test_find_built_packages') for path in paths)
+    assert any(path.endswith('test_find_built_packages-2.0-1.tar.bz2') for path in paths)
+
+
+def test_skip_existing_looks_up_a_recipe_once(testing_config, monkeypatch):
+    recipe = os.path.join(subpackage_dir, '_order')
+    api.build(recipe, config=testing_config, notest=True)
+    lookups = []
+
+    def counting_find_built_packages(metadata_list, env, include_local=True):
+        lookups.append(sorted(m.name() for m in metadata_list))
+        return find_built_packages(metadata_list, env, include_local=include_local)
+    monkeypatch.setattr('conda_build.build.find_built_packages', counting_find_built_packages)
+    testing_config.skip_existing = True
+    assert not api.build(recipe, config=testing_config, notest=True)
+    assert lookups == [['a', 'b']]
+
+
 def test_failed_tests_exit_build(testing_workdir, testing_config):
     """https://github.com/conda/conda-build/issues/1112"""
     with pytest.raises(SystemExit) as exc:
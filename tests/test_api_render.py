@@ -3,6 +3,7 @@ This module tests the test API.  These are high-level integration tests.  Lower
 should go in test_render.py
 """
 
+import json
 import os
 import re
 
@@ -10,10 +11,10 @@ import mock
 import pytest
 import yaml
 
-from conda_build import api, render
+from conda_build import api, build, render, stats_history
 from conda_build.conda_interface import subdir, reset_context, cc_conda_build
 
-from .utils import metadata_dir, thisdir
+from .utils import metadata_dir, subpackage_dir, thisdir
 
 
 def test_render_need_download(testing_workdir, testing_config):
@@ -218,3 +219,37 @@ def test_merge_build_host_build_key(testing_workdir, testing_metadata):
 def test_merge_build_host_empty_host_section(testing_config):
     m = api.render(os.path.join(metadata_dir, '_empty_host_avoids_merge'))[0][0]
     assert not any('bzip2' in dep for dep in m.meta['requirements']['run'])
+
+
+def test_plan(testing_workdir, testing_metadata):
+    testing_metadata.final = True
+    testing_metadata.config.stats_history = os.path.join(testing_workdir, 'history.sqlite')
+    build_key = build.stats_key(testing_metadata, 'build', recipe=True)
+    stats_history.record(testing_metadata.config.stats_history,
+                         {build_key: {'elapsed': 12.0, 'cpu_user': 10.0, 'cpu_sys': 1.0,
+                                      'rss': 1000, 'disk': 0}})
+
+    plan = api.plan(testing_metadata)
+    assert len(plan) == 1
+    output = plan[0]
+    assert output['name'] == 'test_plan'
+    assert output['path'] == api.get_output_file_paths(testing_metadata)[0]
+    assert output['skip'] is None
+    assert 'test_plan 1.0 1' in output['environments']['test']
+    assert output['estimates']['build']['elapsed'] == 12.0
+    assert output['estimates']['test'] is None
+    assert output['estimated_time'] == 12.0
+    json.dumps(plan)
+
+
+def test_plan_outputs_find_recipe_estimates(testing_workdir, testing_config):
+    # the build script runs once for the recipe; every output gets its estimate
+    recipe = os.path.join(subpackage_dir, '_order')
+    testing_config.stats_history = os.path.join(testing_workdir, 'history.sqlite')
+    top = render.render_recipe(recipe, config=testing_config)[0][0]
+    stats_history.record(testing_config.stats_history,
+                         {build.stats_key(top, 'build', recipe=True): {'elapsed': 12.0}})
+
+    plan = api.plan(recipe, config=testing_config)
+    assert sorted(output['name'] for output in plan) == ['a', 'b']
+    assert all(output['estimates']['build']['elapsed'] == 12.0 for output in plan)
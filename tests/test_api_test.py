@@ -55,3 +55,32 @@ def test_api_extra_dep(testing_metadata):
     # missing click dep will fail tests
     with pytest.raises(SystemExit):
         api.test(output, config=testing_metadata.config)
+
+
+def test_test_packages_in_parallel(testing_workdir, testing_metadata):
+    recipe = os.path.join(metadata_dir, 'has_prefix_files')
+    metadata = api.render(recipe, config=testing_metadata.config)[0][0]
+    passing = api.build(metadata, notest=True, anaconda_upload=False)[0]
+    testing_metadata.meta['test']['commands'] = ['exit 1']
+    failing = api.build(testing_metadata, notest=True, anaconda_upload=False)[0]
+
+    stats = {}
+    results = api.test_packages([passing, failing], move_broken=False,
+                                config=testing_metadata.config, stats=stats, test_workers=2)
+    assert list(results) == [passing, failing]
+    assert results[passing]['passed'] and not results[failing]['passed']
+    for result in results.values():
+        assert os.path.isfile(result['log'])
+    with open(results[failing]['log']) as f:
+        assert 'TESTS FAILED' in f.read()
+    assert stats['test_run_' + os.path.basename(passing)]['elapsed'] > 0
+
+
+def test_test_packages_raises_errors_other_than_test_failures(testing_config, monkeypatch):
+    from conda_build import build
+
+    def broken_test(*args, **kwargs):
+        raise AttributeError('a bug in conda-build')
+    monkeypatch.setattr(build, 'test', broken_test)
+    with pytest.raises(AttributeError):
+        api.test_packages(['some-package'], config=testing_config)
@@ -69,6 +69,19 @@ def test_write_about_json_without_conda_on_path(testing_workdir, testing_metadat
     assert 'conda_build_version' in about
 
 
+def test_write_solved_envs_only_when_asked(testing_metadata):
+    entry = {'env': 'host', 'subdir': 'linux-64', 'specs': ['zlib'], 'link': []}
+    testing_metadata.config.solved_envs[testing_metadata.config.host_prefix] = entry
+    output_file = os.path.join(testing_metadata.config.info_dir, 'solved_envs.json')
+    build.write_solved_envs(testing_metadata)
+    assert not os.path.exists(output_file)
+
+    testing_metadata.config.write_lockfile = True
+    build.write_solved_envs(testing_metadata)
+    with open(output_file) as f:
+        assert json.load(f) == {'host': entry}
+
+
 def test_get_short_path(testing_metadata):
     # Test for regular package
     assert build.get_short_path(testing_metadata, "test/file") == "test/file"
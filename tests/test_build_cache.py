@@ -0,0 +1,126 @@
+import os
+import time
+
+import pytest
+
+from conda_build import build_cache
+
+
+def _make_pkg(folder, name, size=10):
+    path = os.path.join(folder, name)
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    return path
+
+
+def test_parse_size():
+    assert build_cache.parse_size(None) is None
+    assert build_cache.parse_size(2048) == 2048
+    assert build_cache.parse_size('500') == 500
+    assert build_cache.parse_size('2K') == 2048
+    assert build_cache.parse_size('1.5G') == int(1.5 * (1 << 30))
+    with pytest.raises(ValueError):
+        build_cache.parse_size('lots')
+
+
+def test_store_and_fetch(testing_workdir):
+    cache = build_cache.BuildCache(os.path.join(testing_workdir, 'cache'), locking=False)
+    pkg = _make_pkg(testing_workdir, 'pkg-1.0-0.tar.bz2')
+    digest = 'ab' * 32
+    assert cache.fetch(digest) is None
+    cache.store(digest, [pkg], dist='pkg-1.0-0')
+    cached = cache.fetch(digest)
+    assert list(cached) == ['pkg-1.0-0.tar.bz2']
+    assert os.path.isfile(cached['pkg-1.0-0.tar.bz2'])
+    assert cache.summary() == {'hits': 1, 'misses': 1, 'stored': 1, 'evicted': 0}
+
+
+def test_incomplete_entry_is_a_miss(testing_workdir):
+    cache = build_cache.BuildCache(os.path.join(testing_workdir, 'cache'), locking=False)
+    pkg = _make_pkg(testing_workdir, 'pkg-1.0-0.tar.bz2')
+    digest = 'cd' * 32
+    cache.store(digest, [pkg])
+    os.remove(cache.fetch(digest)['pkg-1.0-0.tar.bz2'])
+    assert cache.fetch(digest) is None
+
+
+def test_fetch_copies_to_destinations(testing_workdir):
+    cache = build_cache.BuildCache(os.path.join(testing_workdir, 'cache'), locking=False)
+    digest = 'ce' * 32
+    cache.store(digest, [_make_pkg(testing_workdir, 'pkg-1.0-0.tar.bz2')])
+    os.makedirs('out')
+    dest = os.path.join(testing_workdir, 'out', 'pkg-1.0-0.tar.bz2')
+    assert cache.fetch(digest, {'other-1.0-0.tar.bz2': dest}) is None
+    assert not os.path.exists(dest)
+    assert cache.fetch(digest, {'pkg-1.0-0.tar.bz2': dest})
+    assert os.path.isfile(dest)
+
+
+def test_evict_by_size_drops_least_recently_used(testing_workdir):
+    cache = build_cache.BuildCache(os.path.join(testing_workdir, 'cache'), locking=False)
+    digests = [c * 64 for c in 'abc']
+    for n, digest in enumerate(digests):
+        cache.store(digest, [_make_pkg(testing_workdir, 'pkg-{}-0.tar.bz2'.format(n), 1000)])
+        entry_file = os.path.join(cache._entry_dir(digest), build_cache.ENTRY_FILE)
+        os.utime(entry_file, (time.time() - 100 + n, time.time() - 100 + n))
+    cache.max_size = 2500
+    cache.evict()
+    assert cache.fetch(digests[0]) is None
+    assert cache.fetch(digests[1]) and cache.fetch(digests[2])
+
+
+def test_evict_by_age(testing_workdir):
+    cache = build_cache.BuildCache(os.path.join(testing_workdir, 'cache'), max_age=1,
+                                   locking=False)
+    digest = 'ef' * 32
+    cache.store(digest, [_make_pkg(testing_workdir, 'pkg-1.0-0.tar.bz2')])
+    entry_file = os.path.join(cache._entry_dir(digest), build_cache.ENTRY_FILE)
+    old = time.time() - 2 * 86400
+    os.utime(entry_file, (old, old))
+    cache.evict()
+    assert cache.fetch(digest) is None
+    assert cache.evicted == 1
+
+
+def test_get_build_cache_is_off_by_default(testing_config):
+    assert build_cache.get_build_cache(testing_config) is None
+    testing_config.build_cache_dir = os.path.join(testing_config.croot, 'build_cache')
+    cache = build_cache.get_build_cache(testing_config)
+    assert cache is build_cache.get_build_cache(testing_config)
+
+
+class _Metadata(object):
+    def __init__(self, path, source):
+        self.path = path
+        self.meta = {'package': {'name': 'pkg'}, 'source': source}
+        self.config = type('Config', (object, ), {'host_subdir': 'linux-64'})()
+
+    def get_section(self, section):
+        return self.meta.get(section, {})
+
+    def get_hash_contents(self):
+        return {}
+
+    def dist(self):
+        return 'pkg-1.0-0'
+
+
+def test_input_digest_pins_sources(testing_workdir):
+    os.makedirs(os.path.join(testing_workdir, 'recipe'))
+    os.makedirs(os.path.join(testing_workdir, 'src'))
+    with open(os.path.join(testing_workdir, 'src', 'setup.py'), 'w') as f:
+        f.write('version = 1\n')
+    m = _Metadata(os.path.join(testing_workdir, 'recipe'), {'path': '../src'})
+    digest = build_cache.input_digest(m, [({}, m)])
+    assert digest and build_cache.input_digest(m, [({}, m)]) == digest
+    with open(os.path.join(testing_workdir, 'src', 'setup.py'), 'w') as f:
+        f.write('version = 2\n')
+    assert build_cache.input_digest(m, [({}, m)]) != digest
+
+    for source, pinned in (({'url': 'https://example.com/pkg.tar.gz'}, False),
+                           ({'url': 'https://example.com/pkg.tar.gz', 'sha256': 'ab' * 32}, True),
+                           ({'git_url': 'https://example.com/pkg.git', 'git_rev': 'master'}, False),
+                           ({'git_url': 'https://example.com/pkg.git', 'git_rev': 'ab' * 20}, True),
+                           ([{'hg_url': 'https://example.com/pkg'}], False)):
+        m.meta['source'] = source
+        assert (build_cache.input_digest(m, [({}, m)]) is not None) == pinned, source
@@ -0,0 +1,46 @@
+import os
+
+from conda_build import build_journal
+
+
+def test_variant_key(testing_metadata):
+    assert build_journal.variant_key(testing_metadata) == '[]'
+    testing_metadata.get_used_loop_vars = lambda: {'python', 'numpy'}
+    testing_metadata.config.variant.update(python='3.7', numpy=1.16)
+    assert build_journal.variant_key(testing_metadata) == '[["numpy", "1.16"], ["python", "3.7"]]'
+
+
+def test_journal_round_trip(testing_workdir, testing_config):
+    recipe = os.path.join(testing_workdir, 'recipe')
+    pkg_a, pkg_b = (os.path.join(testing_workdir, fn) for fn in ('a-1.0-0.tar.bz2',
+                                                               'b-1.0-0.tar.bz2'))
+    for pkg in (pkg_a, pkg_b):
+        open(pkg, 'w').close()
+
+    journal = build_journal.get_build_journal(testing_config, [recipe + '/'])
+    journal.rendered(recipe, ['["a"]', '["b"]'])
+    journal.variant_done(recipe, '["a"]', [pkg_a])
+
+    testing_config.resume = True
+    resumed = build_journal.get_build_journal(testing_config, [recipe])
+    assert resumed.path == journal.path
+    assert resumed.finished_variant(recipe, '["a"]') == [pkg_a]
+    assert resumed.finished_variant(recipe, '["b"]') is None
+    # not every variant is done yet
+    assert resumed.finished_recipe(recipe) is None
+
+    resumed.variant_done(recipe, '["b"]', [pkg_b])
+    resumed.recipe_done(recipe)
+    assert sorted(build_journal.get_build_journal(testing_config, [recipe])
+                  .finished_recipe(recipe)) == [pkg_a, pkg_b]
+
+    # packages that went away have to be built again
+    os.remove(pkg_b)
+    assert build_journal.get_build_journal(testing_config, [recipe]).finished_recipe(recipe) is None
+
+    resumed.remove()
+    assert not build_journal.get_build_journal(testing_config, [recipe]).load()
+
+
+def test_no_journal_for_metadata(testing_metadata):
+    assert build_journal.get_build_journal(testing_metadata.config, [testing_metadata]) is None
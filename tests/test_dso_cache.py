@@ -0,0 +1,66 @@
+import os
+import shutil
+
+from conda_build.os_utils import dso_cache, liefldd
+
+
+def _write(path, content):
+    with open(path, 'w') as f:
+        f.write(content)
+    return os.stat(path)
+
+
+def test_dso_cache_hits(testing_workdir):
+    cache = dso_cache.DSOCache(os.path.join(testing_workdir, 'cache.sqlite'))
+    st = _write('libfoo.so', 'foo')
+    assert cache.get('libfoo.so', st, 'exports') is dso_cache.MISSING
+    cache.put('libfoo.so', st, 'exports', ['foo', 'bar'])
+    cache.put('libfoo.so', st, 'linkages', {'libc.so.6'})
+    assert cache.get('libfoo.so', st, 'exports') == ['foo', 'bar']
+    assert cache.get('libfoo.so', st, 'linkages') == {'libc.so.6'}
+
+    # another process, and a copy of the file found by its content
+    other = dso_cache.DSOCache(cache.path)
+    shutil.copy('libfoo.so', 'libfoo-copy.so')
+    assert other.get('libfoo-copy.so', os.stat('libfoo-copy.so'), 'exports') == ['foo', 'bar']
+    assert other.get('libfoo-copy.so', os.stat('libfoo-copy.so'), 'exports') == ['foo', 'bar']
+    assert (other.hits, other.content_hits, other.misses) == (1, 1, 0)
+
+    st = _write('libfoo.so', 'changed')
+    assert cache.get('libfoo.so', st, 'exports') is dso_cache.MISSING
+    assert (cache.hits, cache.content_hits, cache.misses) == (2, 0, 2)
+    assert '50% hit rate' in cache.summary()
+
+
+def test_dso_cache_evicts_least_recently_used(testing_workdir):
+    cache = dso_cache.DSOCache(os.path.join(testing_workdir, 'cache.sqlite'), max_size=1000)
+    for n in range(20):
+        st = _write('lib{}.so'.format(n), str(n))
+        cache.put('lib{}.so'.format(n), st, 'exports', ['x' * 80])
+    cache.evict()
+    kept = [n for n in range(20) if cache.get('lib{}.so'.format(n), os.stat('lib{}.so'.format(n)),
+                                             'exports') is not dso_cache.MISSING]
+    assert kept == list(range(20 - len(kept), 20)) and 0 < len(kept) < 20
+
+
+def test_memoized_by_arg0_dso_cache(testing_workdir, testing_config, monkeypatch):
+    calls = []
+
+    def exports(filename, arch='native'):
+        calls.append(filename)
+        return ['foo']
+
+    testing_config.dso_cache = os.path.join(testing_workdir, 'cache.sqlite')
+    _write('libfoo.so', 'foo')
+    try:
+        dso_cache.activate(testing_config)
+        assert liefldd.memoized_by_arg0_dso_cache(exports)('libfoo.so') == ['foo']
+        # a new process would start with an empty memo
+        assert liefldd.memoized_by_arg0_dso_cache(exports)('libfoo.so') == ['foo']
+        assert calls == ['libfoo.so']
+        testing_config.dso_cache_max_size = 0
+        assert dso_cache.activate(testing_config) is None
+        assert liefldd.memoized_by_arg0_dso_cache(exports)('libfoo.so') == ['foo']
+        assert calls == ['libfoo.so', 'libfoo.so']
+    finally:
+        monkeypatch.setattr(dso_cache, '_active', None)
@@ -0,0 +1,168 @@
+import json
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+from conda_build import env_templates
+
+
+def _make_template(prefix):
+    os.makedirs(os.path.join(prefix, 'bin'))
+    os.makedirs(os.path.join(prefix, 'lib'))
+    os.makedirs(os.path.join(prefix, 'conda-meta'))
+    with open(os.path.join(prefix, 'lib', 'libfoo.so'), 'wb') as f:
+        f.write(b'\x7fELF no prefix in here')
+    with open(os.path.join(prefix, 'bin', 'foo'), 'w') as f:
+        f.write('#!{}/bin/python\nprint("foo")\n'.format(prefix))
+    os.chmod(os.path.join(prefix, 'bin', 'foo'), 0o755)
+    os.symlink(os.path.join(prefix, 'lib', 'libfoo.so'), os.path.join(prefix, 'lib', 'libabs.so'))
+    os.symlink('libfoo.so', os.path.join(prefix, 'lib', 'librel.so'))
+    record = {'paths_data': {'paths': [
+        {'_path': 'lib/libfoo.so', 'path_type': 'hardlink'},
+        {'_path': 'bin/foo', 'path_type': 'hardlink', 'prefix_placeholder': '/opt/anaconda1anaconda2'},
+    ]}}
+    with open(os.path.join(prefix, 'conda-meta', 'foo-1.0-0.json'), 'w') as f:
+        json.dump(record, f)
+
+
+def test_template_prefix_matches_length(testing_workdir):
+    cache = env_templates.TemplateCache(os.path.join(testing_workdir, 't'), locking=False)
+    key = env_templates.template_key({'LINK': ['foo-1.0-0']}, 'linux-64', 120)
+    template = cache.template_prefix(key, 120)
+    assert len(template) == 120
+    assert template.startswith(os.path.join(cache.root, key[:16]))
+    assert cache.template_prefix(key, 10) is None
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason="templates are not used on Windows")
+def test_clone_prefix(testing_workdir):
+    src = os.path.join(testing_workdir, 'template_placehold')
+    dst = os.path.join(testing_workdir, 'prefix_placeholder')
+    assert len(src) == len(dst)
+    _make_template(src)
+    counts = env_templates.clone_prefix(src, dst)
+    assert counts == {'hardlinked': 1, 'copied': 2, 'symlinks': 2}
+    assert os.stat(os.path.join(dst, 'lib', 'libfoo.so')).st_ino == \
+        os.stat(os.path.join(src, 'lib', 'libfoo.so')).st_ino
+    with open(os.path.join(dst, 'bin', 'foo')) as f:
+        assert f.readline() == '#!{}/bin/python\n'.format(dst)
+    assert os.access(os.path.join(dst, 'bin', 'foo'), os.X_OK)
+    assert os.readlink(os.path.join(dst, 'lib', 'libabs.so')) == \
+        os.path.join(dst, 'lib', 'libfoo.so')
+    assert os.readlink(os.path.join(dst, 'lib', 'librel.so')) == 'libfoo.so'
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason="templates are not used on Windows")
+def test_materialize_links_once(testing_workdir):
+    cache = env_templates.TemplateCache(os.path.join(testing_workdir, 't'), locking=False)
+    linked = []
+
+    def link(actions):
+        linked.append(actions['PREFIX'])
+        _make_template(actions['PREFIX'])
+
+    actions = {'LINK': ['foo-1.0-0']}
+    for n in range(2):
+        prefix = os.path.join(testing_workdir, 'env{}'.format(n), '_h_env' + '_placehold' * 10)
+        actions['PREFIX'] = prefix
+        assert cache.materialize(prefix, actions, 'linux-64', link)
+        with open(os.path.join(prefix, 'bin', 'foo')) as f:
+            assert prefix in f.read()
+        assert not os.path.exists(os.path.join(prefix, env_templates.MARKER_FILE))
+    assert len(linked) == 1 and len(linked[0]) == len(prefix)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason="templates are not used on Windows")
+def test_materialize_from_threads_links_once(testing_workdir):
+    cache = env_templates.TemplateCache(os.path.join(testing_workdir, 't'), locking=False)
+    linked = []
+
+    def link(actions):
+        linked.append(actions['PREFIX'])
+        time.sleep(0.2)
+        _make_template(actions['PREFIX'])
+
+    def materialize(n):
+        prefix = os.path.join(testing_workdir, 'env{}'.format(n), '_h_env' + '_placehold' * 10)
+        assert cache.materialize(prefix, {'LINK': ['foo-1.0-0'], 'PREFIX': prefix}, 'linux-64',
+                                 link)
+
+    threads = [threading.Thread(target=materialize, args=(n,)) for n in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(linked) == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+class _Dist(str):
+    @property
+    def name(self):
+        return self.rsplit('-', 2)[0]
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason="templates are not used on Windows")
+def test_materialize_links_layer_on_pooled_env(testing_workdir):
+    cache = env_templates.TemplateCache(os.path.join(testing_workdir, 't'), locking=False)
+    linked = []
+
+    def link(actions):
+        linked.append((actions['PREFIX'], sorted(actions['LINK'])))
+        if actions['LINK'] == ['foo-1.0-0']:
+            _make_template(actions['PREFIX'])
+        else:
+            for dist in actions['LINK']:
+                with open(os.path.join(actions['PREFIX'], 'conda-meta', dist + '.json'), 'w') as f:
+                    json.dump({}, f)
+
+    prefixes = []
+    for n, pkg in enumerate(('mypkg-1.0-py27_0', 'mypkg-1.0-py36_0')):
+        prefix = os.path.join(testing_workdir, 'env{}'.format(n), '_test_env' + '_placehold' * 10)
+        actions = {'PREFIX': prefix, 'LINK': [_Dist('foo-1.0-0'), _Dist(pkg)]}
+        assert cache.materialize(prefix, actions, 'linux-64', link, layer=('mypkg',))
+        prefixes.append(prefix)
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert [link_dists for _, link_dists in linked] == [['foo-1.0-0'], ['mypkg-1.0-py27_0'],
+                                                        ['mypkg-1.0-py36_0']]
+    assert [prefix for prefix, _ in linked[1:]] == prefixes
+    assert sorted(os.listdir(os.path.join(prefixes[1], 'conda-meta'))) == \
+        ['foo-1.0-0.json', 'mypkg-1.0-py36_0.json']
+    template = linked[0][0]
+    assert os.listdir(os.path.join(template, 'conda-meta')) == ['foo-1.0-0.json']
+
+
+def test_evict_keeps_most_recently_used(testing_workdir):
+    cache = env_templates.TemplateCache(os.path.join(testing_workdir, 't'), max_count=2,
+                                        locking=False)
+    for n in range(3):
+        template = os.path.join(cache.root, 'template{}'.format(n))
+        os.makedirs(template)
+        marker = os.path.join(template, env_templates.MARKER_FILE)
+        with open(marker, 'w') as f:
+            json.dump({}, f)
+        os.utime(marker, (time.time() - 100 + n, time.time() - 100 + n))
+    cache.evict()
+    assert [os.path.basename(path) for _, path in cache.templates()] == ['template1', 'template2']
+    assert cache.evicted == 1
+
+
+def test_get_template_cache_is_off_by_default(testing_config):
+    assert env_templates.get_template_cache(testing_config) is None
+    testing_config.env_template_dir = os.path.join(testing_config.croot, 'templates')
+    cache = env_templates.get_template_cache(testing_config)
+    assert cache is env_templates.get_template_cache(testing_config)
+
+
+def test_get_test_env_pool(testing_config):
+    assert env_templates.get_test_env_pool(testing_config) is None
+    testing_config.test_env_pool = True
+    pool = env_templates.get_test_env_pool(testing_config)
+    assert pool.root == os.path.join(testing_config.croot, 'test_env_pool')
+    testing_config.env_template_dir = os.path.join(testing_config.croot, 'templates')
+    assert env_templates.get_test_env_pool(testing_config) is \
+        env_templates.get_template_cache(testing_config)
@@ -8,3 +8,72 @@ def test_environment_creation_preserves_PATH(testing_workdir, testing_config):
     environ.create_env(testing_workdir, ['python'], env='host', config=testing_config,
                        subdir=testing_config.build_subdir)
     assert os.environ['PATH'] == ref_path
+
+
+def test_create_envs_links_each_env(testing_workdir, testing_config):
+    subdir = testing_config.build_subdir
+    envs = []
+    for env in ('host', 'build'):
+        prefix = os.path.join(testing_workdir, env)
+        actions = environ.get_install_actions(prefix, ('python', ), env, subdir=subdir,
+                                              bldpkgs_dirs=tuple(testing_config.bldpkgs_dirs),
+                                              output_folder=testing_config.output_folder,
+                                              channel_urls=tuple(testing_config.channel_urls))
+        envs.append(dict(prefix=prefix, specs_or_actions=actions, env=env, subdir=subdir))
+    timings = environ.create_envs(envs, testing_config)
+    for env in ('host', 'build'):
+        assert os.path.isdir(os.path.join(testing_workdir, env, 'conda-meta'))
+        assert set(timings[env]) == {'fetch', 'link'}
+
+
+class _FakeDist(str):
+    @property
+    def dist_name(self):
+        return str(self)
+
+
+def _fake_index():
+    return {_FakeDist('zlib-1.2.11-0'): {'channel': 'defaults', 'md5': 'a' * 32, 'depends': []},
+            _FakeDist('xz-5.2.4-0'): {'channel': 'defaults', 'md5': 'b' * 32, 'depends': []}}
+
+
+def test_solved_env_lock_roundtrip(testing_workdir):
+    index = _fake_index()
+    actions = {'PREFIX': '/old/prefix', 'op_order': ('LINK', ), 'LINK': sorted(index)}
+    entry = environ._actions_to_lock(actions, index, ('zlib', 'xz'), 'host', 'linux-64', (), False)
+    restored = environ._actions_from_lock(entry, '/new/prefix', index)
+    assert restored['PREFIX'] == '/new/prefix'
+    assert restored['LINK'] == actions['LINK']
+    assert restored['op_order'] == ('LINK', )
+
+    # a locked package that changed or went away invalidates the lock
+    changed = _fake_index()
+    changed[_FakeDist('zlib-1.2.11-0')]['md5'] = 'c' * 32
+    assert environ._actions_from_lock(entry, '/new/prefix', changed) is None
+    assert environ._actions_from_lock(entry, '/new/prefix', {}) is None
+
+
+def test_solve_cache_checks_index_fingerprint(testing_workdir):
+    index = _fake_index()
+    actions = {'PREFIX': '/old/prefix', 'LINK': sorted(index)}
+    entry = environ._actions_to_lock(actions, index, ('zlib', ), 'build', 'linux-64', (), False,
+                                     with_fingerprint=True)
+    assert environ._actions_from_lock(entry, '/p', index, check_fingerprint=True)
+    newer = _fake_index()
+    newer[_FakeDist('zlib-1.2.12-0')] = {'channel': 'defaults', 'md5': 'd' * 32, 'depends': []}
+    assert environ._actions_from_lock(entry, '/p', newer, check_fingerprint=True) is None
+    # the same entry is still fine as an explicit lock
+    assert environ._actions_from_lock(entry, '/p', newer)
+
+
+def test_load_lockfile(testing_workdir):
+    import json
+    index = _fake_index()
+    actions = {'PREFIX': '/old/prefix', 'LINK': sorted(index)}
+    entry = environ._actions_to_lock(actions, index, ('zlib', ), 'host', 'linux-64', (), False)
+    lockfile = os.path.join(testing_workdir, 'solved_envs.json')
+    with open(lockfile, 'w') as f:
+        json.dump({'host': entry}, f)
+    environ.load_lockfile(lockfile)
+    assert environ._get_locked_or_cached_actions('/p', ('zlib', ), 'host', 'linux-64',
+                                                 ('some_channel', ), False, index)
@@ -0,0 +1,71 @@
+import os
+
+import pytest
+
+from conda_build import file_table
+from conda_build.conda_interface import prefix_placeholder
+from conda_build.utils import on_win
+
+
+def _write(path, content, mode='w'):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, mode) as f:
+        f.write(content)
+
+
+def test_file_table_classifies_files(testing_workdir):
+    prefix = testing_workdir
+    _write(os.path.join(prefix, 'bin', 'script'), '#!/usr/bin/env python\nprint(1)\n')
+    _write(os.path.join(prefix, 'lib', 'libfoo.so'), b'\x7fELF\x02\x01\x01\x00' + prefix.encode(), 'wb')
+    _write(os.path.join(prefix, 'etc', 'foo.conf'), 'home = {}\n'.format(prefix))
+    _write(os.path.join(prefix, 'etc', 'placeholder.conf'), prefix_placeholder)
+    _write(os.path.join(prefix, 'etc', 'empty'), '')
+    files = ['bin/script', 'lib/libfoo.so', 'etc/foo.conf', 'etc/placeholder.conf', 'etc/empty']
+
+    table = file_table.FileTable(prefix)
+    assert table.update(files, workers=2) == len(files)
+    assert table.update(files) == 0
+    assert [table.get(f).kind for f in files] == ['script', 'elffile', 'text', 'text', 'empty']
+    assert table.get('lib/libfoo.so').codefile == 'elffile'
+    assert table.get('lib/libfoo.so').mode == 'binary'
+    assert table.get('etc/foo.conf').prefix_hits == (prefix, )
+    assert table.get('etc/placeholder.conf').prefix_hits == (prefix_placeholder, )
+    assert table.get('etc/empty').size == 0
+    assert table.get('missing').kind == 'missing'
+
+    # changed files are read again, the others are not
+    _write(os.path.join(prefix, 'etc', 'foo.conf'), 'home = elsewhere\n')
+    assert table.update(files) == 1
+    assert table.get('etc/foo.conf').prefix_hits == ()
+    assert table.classified == len(files) + 2
+
+
+def test_file_table_sees_rewrites_with_the_mtime_restored(testing_workdir):
+    table = file_table.FileTable(testing_workdir)
+    path = os.path.join(testing_workdir, 'lib', 'libfoo.so')
+    _write(path, b'\x7fELF' + b'/old/rpath', 'wb')
+    st = os.stat(path)
+    before = table.get('lib/libfoo.so').sha256
+    # a same-size rewrite in place, by a tool that puts the mtime back
+    _write(path, b'\x7fELF' + b'/new/rpath', 'wb')
+    if hasattr(st, 'st_mtime_ns'):
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    else:
+        os.utime(path, (st.st_atime, st.st_mtime))
+    assert table.get('lib/libfoo.so').sha256 != before
+    assert table.update(['lib/libfoo.so']) == 0
+    assert table.update(['lib/libfoo.so'], fresh=True) == 1
+
+
+@pytest.mark.skipif(on_win, reason="symlinks")
+def test_file_table_symlinks(testing_workdir):
+    table = file_table.FileTable(testing_workdir)
+    _write(os.path.join(testing_workdir, 'lib', 'libfoo.so.1'), b'\x7fELF\x02\x01\x01\x00', 'wb')
+    os.symlink('libfoo.so.1', os.path.join(testing_workdir, 'lib', 'libfoo.so'))
+    os.symlink('nowhere', os.path.join(testing_workdir, 'lib', 'libbar.so'))
+    info = table.get('lib/libfoo.so')
+    assert (info.kind, info.codefile, info.is_link, info.size) == ('elffile', None, True, 8)
+    assert info.sha256 == table.get('lib/libfoo.so.1').sha256
+    assert table.get('lib/libbar.so').kind == 'symlink'
+    assert not table.get('lib/libbar.so').is_file
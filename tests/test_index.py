@@ -10,7 +10,7 @@ import shutil
 import tarfile
 
 from conda_build import api
-from conda_build.index import update_index
+from conda_build.index import update_index, update_index_for_package
 from conda_build.conda_interface import subdir
 from .utils import metadata_dir
 
@@ -429,3 +429,34 @@ def test_patch_instructions_with_missing_subdir(testing_workdir):
     url = "https://anaconda.org/conda-forge/{0}/20180828/download/noarch/{0}-20180828-0.tar.bz2".format(pkg)
     patch_instructions = download(url, os.path.join(os.getcwd(), "patches.tar.bz2"))
     api.update_index('.', patch_generator=patch_instructions)
+
+
+def test_update_index_for_package(testing_metadata):
+    out_files = api.build(testing_metadata)
+    channel = testing_metadata.config.croot
+    pkg_subdir = os.path.basename(os.path.dirname(out_files[0]))
+    repodata_path = join(channel, pkg_subdir, 'repodata.json')
+    with open(repodata_path) as f:
+        expected = json.load(f)['packages']
+    # only a full index would pick this one up
+    shutil.copy(out_files[0], join(channel, pkg_subdir, 'not_indexed-1.0-0.tar.bz2'))
+    with open(repodata_path, 'w') as f:
+        json.dump({'info': {'subdir': pkg_subdir}, 'packages': {}}, f)
+
+    update_index_for_package(out_files[0])
+    with open(repodata_path) as f:
+        assert json.load(f)['packages'] == expected
+
+
+def test_update_index_for_package_in_new_channel(testing_metadata, testing_workdir):
+    out_files = api.build(testing_metadata, notest=True)
+    channel = join(testing_workdir, 'channel')
+    pkg_subdir = os.path.basename(os.path.dirname(out_files[0]))
+    os.makedirs(join(channel, pkg_subdir))
+    pkg = join(channel, pkg_subdir, os.path.basename(out_files[0]))
+    shutil.copy(out_files[0], pkg)
+
+    update_index_for_package(pkg)
+    with open(join(channel, pkg_subdir, 'repodata.json')) as f:
+        assert list(json.load(f)['packages']) == [os.path.basename(pkg)]
+    assert isfile(join(channel, 'noarch', 'repodata.json'))
@@ -1,9 +1,11 @@
+import os
 import re
 import sys
 
 import pytest
 
-from conda_build import api
+from conda_build import api, inspect_pkg
+from conda_build.conda_interface import Dist
 
 
 def test_inspect_linkages():
@@ -39,3 +41,34 @@ def test_channel_installable():
 #     api.update_index(platform)
 
 #     assert not api.test_installable(channel=to_url(testing_workdir))
+
+
+def test_prefix_owners(testing_workdir, monkeypatch):
+    prefix = os.path.join(testing_workdir, 'prefix')
+    os.makedirs(os.path.join(prefix, 'conda-meta'))
+    records = {Dist('libfoo-1.0-0'): {'files': ['lib/libfoo.so', 'include/foo.h']},
+               Dist('foo-tools-1.0-0'): {'files': ['bin/foo', 'include/foo.h']}}
+    for fn in ('libfoo-1.0-0.json', 'foo-tools-1.0-0.json'):
+        with open(os.path.join(prefix, 'conda-meta', fn), 'w') as f:
+            f.write('{}')
+    calls = []
+    monkeypatch.setattr(inspect_pkg, 'linked_data', lambda p: calls.append(p) or records)
+    cache_dir = os.path.join(testing_workdir, 'cache')
+
+    owners = inspect_pkg.get_prefix_owners(prefix, cache_dir=cache_dir)
+    assert owners.owners(os.path.join('lib', 'libfoo.so')) == [Dist('libfoo-1.0-0')]
+    assert (sorted(owners.owners('include/foo.h'), key=str) ==
+            sorted([Dist('foo-tools-1.0-0'), Dist('libfoo-1.0-0')], key=str))
+    assert owners.owners('lib/libbar.so') == []
+    assert owners.dists_by_name('foo-tools') == [Dist('foo-tools-1.0-0')]
+    assert list(inspect_pkg.which_package('bin/foo', prefix)) == [Dist('foo-tools-1.0-0')]
+    assert len(calls) == 1
+
+    # a fresh index for the same records comes from the cache, until a record changes
+    assert inspect_pkg.PrefixOwners(prefix, inspect_pkg._conda_meta_signature(prefix),
+                                    cache_dir=cache_dir).owners('bin/foo') == [Dist('foo-tools-1.0-0')]
+    assert len(calls) == 1
+    os.remove(os.path.join(prefix, 'conda-meta', 'foo-tools-1.0-0.json'))
+    del records[Dist('foo-tools-1.0-0')]
+    assert inspect_pkg.get_prefix_owners(prefix, cache_dir=cache_dir).owners('bin/foo') == []
+    assert len(calls) == 2
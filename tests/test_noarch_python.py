@@ -0,0 +1,54 @@
+import os
+import sys
+
+import pytest
+
+from conda_build import noarch_python
+
+
+@pytest.mark.skipif(sys.platform.startswith('win'), reason="scripts are in Scripts on win32")
+def test_populate_files_moves_scripts(testing_workdir, capsys):
+    prefix = os.path.join(testing_workdir, 'prefix')
+    os.makedirs(os.path.join(prefix, 'bin'))
+    for fn in ('foo', 'bar'):
+        with open(os.path.join(prefix, 'bin', fn), 'w') as fo:
+            fo.write('#!/usr/bin/env python\nimport {}\n'.format(fn))
+        os.chmod(os.path.join(prefix, 'bin', fn), 0o755)
+
+    class _Metadata(object):
+        def dist(self):
+            return 'pkg-1.0-py_0'
+
+    d = noarch_python.populate_files(_Metadata(), ['bin/foo', 'bin/bar'], prefix)
+    assert d['python-scripts'] == ['foo', 'bar']
+    for fn in ('foo', 'bar'):
+        assert not os.path.exists(os.path.join(prefix, 'bin', fn))
+        dst = os.path.join(prefix, 'python-scripts', fn)
+        with open(dst) as fi:
+            assert fi.read() == '#!/usr/bin/env python\nimport {}\n'.format(fn)
+        assert os.stat(dst).st_mode & 0o777 == 0o755
+    assert 'moved 2 scripts to python-scripts' in capsys.readouterr()[0]
+
+
+@pytest.mark.skipif(sys.platform.startswith('win'), reason="scripts get CRLF newlines on win32")
+def test_rewrite_script_normalizes_newlines(testing_workdir):
+    os.makedirs(os.path.join(testing_workdir, 'bin'))
+    src = os.path.join(testing_workdir, 'bin', 'tool')
+    with open(src, 'wb') as fo:
+        fo.write(b'#!/usr/bin/env python\r\nimport tool\r\n')
+    os.chmod(src, 0o755)
+    assert noarch_python.rewrite_scripts(['tool'], testing_workdir) == ['tool']
+    dst = os.path.join(testing_workdir, 'python-scripts', 'tool')
+    with open(dst, 'rb') as fi:
+        assert fi.read() == b'#!/usr/bin/env python\nimport tool\n'
+    assert os.stat(dst).st_mode & 0o777 == 0o755
+    assert not os.path.exists(src)
+
+
+def test_rewrite_script_rejects_binaries(testing_workdir):
+    os.makedirs(os.path.join(testing_workdir, 'Scripts' if noarch_python.ISWIN else 'bin'))
+    with open(os.path.join(testing_workdir, 'Scripts' if noarch_python.ISWIN else 'bin', 'tool'),
+              'wb') as fo:
+        fo.write(b'\x7fELF\x02\x01\x01\x00' + b'\x00' * 100)
+    with pytest.raises(SystemExit):
+        noarch_python.rewrite_scripts(['tool'], testing_workdir)
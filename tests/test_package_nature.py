@@ -0,0 +1,56 @@
+import json
+import os
+
+from conda_build import package_nature, post
+
+
+class _Dist(object):
+    def __init__(self, name, channel='defaults'):
+        self.name = name
+        self.channel = channel
+        self.dist_name = name + '-1.0-0'
+
+
+def test_nature_cache_persists_packages_with_md5(testing_workdir):
+    path = os.path.join(testing_workdir, 'cache', package_nature.CACHE_FILE)
+    cache = package_nature.NatureCache(path)
+    zlib = package_nature.cache_key(_Dist('zlib'), {'md5': 'abc'})
+    local = package_nature.cache_key(_Dist('mypkg', 'local'))
+    assert cache.get_many([zlib, local]) == {}
+    cache.update({zlib: 'dso library', local: 'non-library'})
+    assert cache.get_many([zlib, local]) == {zlib: 'dso library', local: 'non-library'}
+
+    with open(path) as f:
+        assert list(json.load(f)['natures']) == ['defaults::zlib-1.0-0::abc']
+    other = package_nature.NatureCache(path)
+    assert other.get_many([zlib, local]) == {zlib: 'dso library'}
+    # a rebuild of the same dist is another package
+    assert other.get(package_nature.cache_key(_Dist('zlib'), {'md5': 'def'})) is None
+
+
+def test_library_natures_are_determined_once(testing_workdir, monkeypatch):
+    zlib, openssl = _Dist('zlib'), _Dist('openssl')
+    monkeypatch.setattr(post, 'linked_data', lambda prefix: {zlib: {'md5': '1'}, openssl: {'md5': '2'}})
+    index_fetches = []
+    monkeypatch.setattr(post, '_get_channeldata', lambda *args: index_fetches.append(args) or {})
+    determined = []
+
+    def determine_package_nature(pkg, prefix, subdir, bldpkgs_dir, output_folder, channel_urls,
+                                 channeldata=None):
+        determined.append(pkg.name)
+        return (['lib/libz.so'] if pkg is zlib else [], {'weak': ['openssl']} if pkg is openssl else None,
+                True)
+    monkeypatch.setattr(post, 'determine_package_nature', determine_package_nature)
+
+    cache = package_nature.NatureCache(os.path.join(testing_workdir, package_nature.CACHE_FILE))
+    args = [zlib, openssl], 'prefix', 'linux-64', ['bldpkgs'], 'output', ()
+    expected = {zlib: 'dso library', openssl: 'run-exports library'}
+    assert post.library_natures(*args, nature_cache=cache) == expected
+    assert post.library_natures(*args, nature_cache=cache) == expected
+    assert sorted(determined) == ['openssl', 'zlib']
+    assert len(index_fetches) == 1
+
+    # a later build finds them on disk
+    cache = package_nature.NatureCache(cache.path)
+    assert post.library_nature(zlib, *args[1:], nature_cache=cache) == 'dso library'
+    assert len(determined) == 2
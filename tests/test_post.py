@@ -5,6 +5,7 @@ import sys
 import pytest
 
 from conda_build import post, api
+from conda_build.os_utils.pyldd import elffile, elfrpath, get_elf_rpath, set_elf_rpath
 from conda_build.utils import on_win, package_has_file
 
 from .utils import add_mangling, metadata_dir
@@ -23,6 +24,39 @@ def test_compile_missing_pyc(testing_workdir):
     assert not os.path.isfile(os.path.join(tmp, add_mangling(bad_file)))
 
 
+def test_compile_missing_pyc_workers(testing_workdir):
+    files = [os.path.join('pkg', 'm{}.py'.format(i)) for i in range(250)]
+    os.makedirs(os.path.join(testing_workdir, 'pkg', 'skipped'))
+    files += [os.path.join('pkg', 'skipped', 'm.py'), os.path.join('pkg', 'bad.py')]
+    for f in files:
+        with open(os.path.join(testing_workdir, f), 'w') as fh:
+            fh.write('x = 1\n' if 'bad' not in f else 'x = (\n')
+
+    result = post.compile_missing_pyc(files, cwd=testing_workdir, python_exe=sys.executable,
+                                      skip_compile_pyc=['pkg/skipped/*'], workers=3)
+    assert result['files'] == 251 and result['failed'] == 1 and result['workers'] == 2
+    for f in files[:250]:
+        assert os.path.isfile(os.path.join(testing_workdir, add_mangling(f)))
+    for f in files[250:]:
+        assert not os.path.isfile(os.path.join(testing_workdir, add_mangling(f)))
+
+
+@pytest.mark.skipif(on_win, reason="the stand-in python is a shell script")
+def test_compile_missing_pyc_worker_dies(testing_workdir):
+    files = [os.path.join('pkg', 'm{}.py'.format(i)) for i in range(3)]
+    os.makedirs(os.path.join(testing_workdir, 'pkg'))
+    for f in files:
+        with open(os.path.join(testing_workdir, f), 'w') as fh:
+            fh.write('x = 1\n')
+    python_exe = os.path.join(testing_workdir, 'python')
+    with open(python_exe, 'w') as fh:
+        fh.write('#!/bin/sh\nexit 3\n')
+    os.chmod(python_exe, 0o755)
+
+    result = post.compile_missing_pyc(files, cwd=testing_workdir, python_exe=python_exe)
+    assert result['files'] == 3 and result['failed'] == 3
+
+
 @pytest.mark.skipif(on_win, reason="no linking on win")
 def test_hardlinks_to_copies(testing_workdir):
     with open('test1', 'w') as f:
@@ -60,6 +94,29 @@ def test_fix_shebang(testing_config):
     assert os.stat(fname).st_mode == 33277  # file with permissions 0o775
 
 
+@pytest.mark.skipif(on_win, reason="fix_shebang is not executed on win32")
+def test_fix_shebangs(testing_workdir, capsys):
+    prefix = os.path.join(testing_workdir, 'prefix')
+    os.makedirs(os.path.join(prefix, 'bin'))
+    scripts = {'bin/tool': '#!/usr/bin/python\r\nimport tool\n',
+               'bin/script': '#!/bin/bash\necho python\n',
+               'bin/fixed': '#!{}/bin/python3.7\nimport fixed\n'.format(prefix),
+               'bin/data': 'not a script\n'}
+    for f, content in scripts.items():
+        with open(os.path.join(prefix, f), 'wb') as fo:
+            fo.write(content.encode())
+        os.chmod(os.path.join(prefix, f), 0o644)
+    assert post.fix_shebangs(sorted(scripts), prefix, '/usr/bin/python3.7') == ['bin/tool']
+    for f, content in scripts.items():
+        with open(os.path.join(prefix, f), 'rb') as fi:
+            expected = '#!{}/bin/python3.7\nimport tool\n'.format(prefix) if f == 'bin/tool' else content
+            assert fi.read().decode() == expected
+        assert os.stat(os.path.join(prefix, f)).st_mode & 0o777 == 0o775
+    out = capsys.readouterr()[0]
+    assert 'updating shebang: bin/tool' in out
+    assert 'updated the shebangs of 1 of 4 files in bin/' in out
+
+
 def test_postlink_script_in_output_explicit(testing_config):
     recipe = os.path.join(metadata_dir, '_post_link_in_output')
     pkg = api.build(recipe, config=testing_config, notest=True)[0]
@@ -72,3 +129,62 @@ def test_postlink_script_in_output_implicit(testing_config):
     pkg = api.build(recipe, config=testing_config, notest=True)[0]
     assert (package_has_file(pkg, 'bin/.out1-post-link.sh') or
             package_has_file(pkg, 'Scripts/.out1-post-link.bat'))
+
+
+def _elf_with_rpath(dest):
+    shutil.copy(sys.executable, dest)
+    if not get_elf_rpath(dest):
+        pytest.skip("the python executable has no rpath to rewrite")
+    return get_elf_rpath(dest)
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason="ELF rpaths are linux only")
+def test_set_elf_rpath_in_place(testing_workdir):
+    exe = os.path.join(testing_workdir, 'exe')
+    old = _elf_with_rpath(exe)
+    with open(exe, 'rb') as f:
+        before = f.read()
+    rp = elfrpath(before)
+    start = rp.strtab_offset + rp.current()[1]
+    assert not set_elf_rpath(exe, old + ':/a/longer/rpath')
+    with open(exe, 'rb') as f:
+        assert f.read() == before
+    assert set_elf_rpath(exe, '$ORIGIN')
+    assert get_elf_rpath(exe) == '$ORIGIN'
+    # nothing of the old rpath is left after the new one
+    with open(exe, 'rb') as f:
+        after = f.read()
+    assert after[start:start + len(old) + 1] == b'$ORIGIN'.ljust(len(old) + 1, b'\0')
+    # like patchelf --force-rpath, the rpath ends up as DT_RPATH
+    with open(exe, 'rb') as f:
+        elf = elffile(f)
+    assert elf.dt_rpath == ['$ORIGIN'] and not elf.dt_runpath
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason="ELF rpaths are linux only")
+def test_mk_relative_linux_files_in_place(testing_workdir, capsys):
+    files = [os.path.join('bin', 'exe1'), os.path.join('bin', 'exe2')]
+    os.makedirs(os.path.join(testing_workdir, 'bin'))
+    for f in files:
+        _elf_with_rpath(os.path.join(testing_workdir, f))
+    post.mk_relative_linux_files(files, testing_workdir, rpaths=['lib'])
+    for f in files:
+        assert get_elf_rpath(os.path.join(testing_workdir, f)) == '$ORIGIN/../lib'
+    assert '2 in place, 0 with 0 patchelf calls' in capsys.readouterr()[0]
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason="ELF files are linux only")
+def test_analyze_dsos_on_a_pool(testing_workdir, monkeypatch):
+    pytest.importorskip('lief')
+    from conda_build.os_utils import liefldd
+    paths = [os.path.join(testing_workdir, 'lib{}.so'.format(n)) for n in range(post._MIN_DSOS_FOR_POOL)]
+    for path in paths:
+        shutil.copy(sys.executable, path)
+    expected = liefldd.get_exports(sys.executable)
+    post._analyze_dsos([('exports', path, {}) for path in paths], workers=2)
+
+    def not_again(*args, **kw):
+        raise AssertionError("analyzed in-process")
+    monkeypatch.setattr(liefldd, 'get_exports', not_again)
+    for path in paths:
+        assert sorted(liefldd.get_exports_memoized(path)) == sorted(expected)
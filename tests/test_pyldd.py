@@ -0,0 +1,120 @@
+import glob
+import os
+import struct
+import sys
+
+import pytest
+
+from conda_build.os_utils import pyldd
+
+
+def _lc_str(cmd, string, endian):
+    payload = string.encode() + b'\0'
+    size = (12 + len(payload) + 7) // 8 * 8
+    return struct.pack(endian + 'LLL', cmd, size, 12) + payload.ljust(size - 12, b'\0')
+
+
+def _macho(dylibs, rpaths, endian='<'):
+    cmds = ([_lc_str(pyldd.LC_LOAD_DYLIB, dylib, endian) for dylib in dylibs] +
+            [_lc_str(pyldd.LC_RPATH, rpath, endian) for rpath in rpaths])
+    return (struct.pack(endian + 'L' * 8, pyldd.MH_MAGIC_64, 7, 3, 6, len(cmds),
+                        sum(len(cmd) for cmd in cmds), 0, 0) + b''.join(cmds))
+
+
+def _fat(*binaries):
+    header = struct.pack('>LL', pyldd.FAT_MAGIC, len(binaries))
+    offset = 4096
+    data = b''
+    for binary in binaries:
+        header += struct.pack('>LLLLL', 7, 3, offset + len(data), len(binary), 12)
+        data += binary
+    return header.ljust(offset, b'\0') + data
+
+
+def test_macho_load_commands(testing_workdir):
+    with open('libfoo.dylib', 'wb') as f:
+        f.write(_fat(_macho(['/usr/lib/libSystem.B.dylib'], [], endian='>'),
+                     _macho(['@rpath/libz.1.dylib', '/usr/lib/libSystem.B.dylib'], ['@loader_path/../lib/'])))
+    with open('libfoo.dylib', 'rb') as f:
+        cf = pyldd.codefile(f, 'any', ['/lib'])
+    assert cf.shared_libraries == [('/usr/lib/libSystem.B.dylib', '/usr/lib/libSystem.B.dylib')]
+    assert cf.rpaths_nontransitive == []
+    with open('libfoo.dylib', 'rb') as f:
+        cf = pyldd.codefile(f, 'x86_64', ['/lib'])
+    assert cf.shared_libraries == [('@rpath/libz.1.dylib', '$RPATH/libz.1.dylib'),
+                                   ('/usr/lib/libSystem.B.dylib', '/usr/lib/libSystem.B.dylib')]
+    assert cf.rpaths_transitive == ['/lib', '$SELFDIR/../lib']
+    assert cf.rpaths_nontransitive == ['$SELFDIR/../lib']
+
+
+def test_truncated_elf(testing_workdir):
+    with open(os.path.realpath(sys.executable), 'rb') as f:
+        data = f.read(200)
+    if pyldd.codefile_class_from_header('exe', data) is not pyldd.elffile:
+        pytest.skip("the python executable is not an ELF file")
+    with open('truncated', 'wb') as f:
+        f.write(data)
+    assert pyldd.inspect_linkages('truncated', recurse=False) == set()
+    assert pyldd.get_elf_rpath('truncated') is None
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason="ELF files")
+def test_elffile_agrees_with_lief():
+    lief = pytest.importorskip('lief')
+    files = [os.path.realpath(sys.executable)] + glob.glob(os.path.join(sys.prefix, 'lib', '*.so*'))[:20]
+    for filename in files:
+        if pyldd.codefile_type(filename, skip_symlinks=False) != 'elffile':
+            continue
+        with open(filename, 'rb') as f:
+            cf = pyldd.codefile(f)
+        binary = lief.parse(filename)
+        assert cf.dt_needed == list(binary.libraries), filename
+        if binary.has_interpreter:
+            assert cf.program_interpreter == binary.interpreter
+
+
+# the export trie of _foo, _foobar and _bar: the root has edges '_foo' (to 14) and '_bar' (to 23),
+#    the node of _foo an edge 'bar' (to 27); each terminal node has flags 0 and address 0x10
+_EXPORT_TRIE = (b'\x00\x02_foo\x00\x0e_bar\x00\x17' +
+                b'\x02\x00\x10\x01bar\x00\x1b' +
+                b'\x02\x00\x10\x00' +
+                b'\x02\x00\x10\x00')
+
+
+def _macho_with_symbols():
+    strings = b'\0_malloc\0_foo\0'
+    # _malloc is undefined and external, _foo defined in section 1
+    nlists = struct.pack('<LBBHQ', 1, 0x01, 0, 0, 0) + struct.pack('<LBBHQ', 9, 0x0f, 1, 0, 0x10)
+    trie_off = 32 + 48 + 24
+    dyld_info = struct.pack('<' + 'L' * 12, pyldd.LC_DYLD_INFO_ONLY, 48, 0, 0, 0, 0, 0, 0, 0, 0,
+                            trie_off, len(_EXPORT_TRIE))
+    symtab = struct.pack('<LLLLLL', pyldd.LC_SYMTAB, 24, trie_off + len(_EXPORT_TRIE), 2,
+                         trie_off + len(_EXPORT_TRIE) + len(nlists), len(strings))
+    header = struct.pack('<' + 'L' * 8, pyldd.MH_MAGIC_64, 7, 3, 6, 2, 48 + 24, 0, 0)
+    return header + dyld_info + symtab + _EXPORT_TRIE + nlists + strings
+
+
+def test_macho_symbols(testing_workdir):
+    with open('libfoo.dylib', 'wb') as f:
+        f.write(_macho_with_symbols())
+    assert sorted(pyldd.get_exports('libfoo.dylib', arch='x86_64')) == ['_bar', '_foo', '_foobar']
+    assert pyldd.get_symbols('libfoo.dylib', defined=False, arch='x86_64') == ['_malloc']
+    with open('libfoo.dylib', 'wb') as f:
+        f.write(_fat(_macho_with_symbols()))
+    assert sorted(pyldd.get_symbols('libfoo.dylib', arch='x86_64')) == ['_bar', '_foo', '_foobar', '_malloc']
+    with open('libfoo.a', 'wb') as f:
+        f.write(b'!<arch>\n')
+    assert pyldd.get_exports('libfoo.a') is None
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason="ELF files")
+def test_get_exports_agrees_with_lief():
+    lief = pytest.importorskip('lief')
+    files = [os.path.realpath(sys.executable)] + glob.glob(os.path.join(sys.prefix, 'lib', '*.so*'))[:20]
+    for filename in files:
+        if pyldd.codefile_type(filename, skip_symlinks=False) != 'elffile':
+            continue
+        binary = lief.parse(filename)
+        # newer LIEF lists functions rather than their names
+        exports = set(getattr(e, 'name', e) for e in binary.exported_functions)
+        assert set(pyldd.get_exports(filename)) == exports, filename
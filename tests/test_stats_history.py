@@ -0,0 +1,49 @@
+import json
+import os
+
+from conda_build import stats_history
+
+
+def _step(elapsed, rss=100):
+    return {'elapsed': elapsed, 'cpu_user': elapsed / 2.0, 'cpu_sys': 1.0, 'rss': rss,
+            'disk': 10}
+
+
+def test_estimate_from_recorded_stats(testing_workdir):
+    path = os.path.join(testing_workdir, 'history', 'stats.sqlite')
+    for recorded, elapsed in enumerate((10.0, 30.0, 20.0)):
+        stats = {'buildfoo-1.0-python_3.7': _step(elapsed, rss=elapsed * 10),
+                 'total': {'time': elapsed}}
+        assert stats_history.record(path, stats, recorded=recorded) == 1
+
+    history = stats_history.StatsHistory(path)
+    try:
+        estimate = history.estimate('buildfoo-1.0-python_3.7', 'buildfoo-')
+        assert estimate == {'elapsed': 20.0, 'cpu': 11.0, 'rss': 300, 'disk': 10,
+                            'samples': 3, 'match': 'exact'}
+        # a new version falls back to the old one, but not to packages whose name starts alike
+        assert history.estimate('buildfoo-1.1-python_3.7', 'buildfoo-')['match'] == \
+            'other version'
+        assert history.estimate('buildfoo-bar-1.0', 'buildfoo-bar-') is None
+        assert history.estimate('testfoo-1.0', 'testfoo-') is None
+    finally:
+        history.close()
+
+
+def test_estimate_without_history(testing_workdir):
+    history = stats_history.StatsHistory(os.path.join(testing_workdir, 'missing.sqlite'))
+    assert history.estimate('buildfoo-1.0', 'buildfoo-') is None
+
+
+def test_record_stats_file(testing_workdir):
+    stats_file = os.path.join(testing_workdir, 'stats.json')
+    with open(stats_file, 'w') as f:
+        json.dump({'buildfoo-1.0': _step(5.0), 'test_foofoo-1.0': _step(2.0),
+                   'total': {'time': 7.0}}, f)
+    path = os.path.join(testing_workdir, 'stats.sqlite')
+    assert stats_history.record_stats_file(path, stats_file) == 2
+    history = stats_history.StatsHistory(path)
+    try:
+        assert history.estimate('test_foofoo-1.0')['elapsed'] == 2.0
+    finally:
+        history.close()
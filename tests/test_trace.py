@@ -0,0 +1,78 @@
+import json
+import os
+import threading
+
+from conda_build import trace
+
+
+def _read(path):
+    with open(path) as f:
+        return [event for event in json.load(f)['traceEvents'] if event['ph'] == 'X']
+
+
+def test_spans_are_no_ops_when_not_recording():
+    assert not trace.recording()
+    with trace.span('anything', files=3) as args:
+        args['bytes'] = 10
+    assert not trace.recording()
+
+
+def test_record_nested_spans(testing_workdir):
+    path = os.path.join(testing_workdir, 'trace', 'build.json')
+
+    @trace.traced(args=lambda n: {'n': n})
+    def work(n):
+        with trace.span('inner', cat='script') as args:
+            args['files'] = n
+
+    with trace.record(path):
+        assert trace.recording()
+        work(2)
+        thread = threading.Thread(target=work, args=(3,))
+        thread.start()
+        thread.join()
+    assert not trace.recording()
+
+    events = _read(path)
+    assert [e['name'] for e in events] == ['inner', 'work', 'inner', 'work', 'conda-build']
+    inner, outer = events[:2]
+    assert outer['args'] == {'n': 2} and inner['args'] == {'files': 2}
+    assert outer['ts'] <= inner['ts'] and inner['ts'] + inner['dur'] <= outer['ts'] + outer['dur']
+    assert events[0]['tid'] != events[2]['tid']
+    assert events[-1]['cat'] == 'session'
+
+
+def test_record_marks_failed_spans(testing_workdir):
+    path = os.path.join(testing_workdir, 'trace.json')
+    try:
+        with trace.record(path):
+            with trace.span('failing'):
+                raise ValueError('boom')
+    except ValueError:
+        pass
+    events = _read(path)
+    assert events[0]['name'] == 'failing'
+    assert events[0]['args']['error'] == 'ValueError: boom'
+
+
+def test_file_args(testing_workdir):
+    with open('a', 'wb') as f:
+        f.write(b'12345')
+    assert trace.file_args(['a'], testing_workdir) == {}
+    with trace.record(os.path.join(testing_workdir, 'trace.json')):
+        assert trace.file_args(['a', 'missing'], testing_workdir) == {'files': 2, 'bytes': 5}
+
+
+def test_merge_events_collected_in_a_worker(testing_workdir):
+    path = os.path.join(testing_workdir, 'trace.json')
+    events = []
+    with trace.record(path):
+        with trace.collect(events, name='worker'):
+            with trace.span('in worker'):
+                pass
+        assert [e['name'] for e in events] == ['process_name', 'in worker']
+        with trace.collect(None):
+            with trace.span('not recorded'):
+                pass
+        trace.merge(events)
+    assert [e['name'] for e in _read(path)] == ['in worker', 'conda-build']
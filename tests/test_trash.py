@@ -0,0 +1,57 @@
+import os
+
+from conda_build import trash
+
+
+def _make_tree(path, files=20):
+    os.makedirs(os.path.join(path, 'lib', 'site-packages'))
+    for i in range(files):
+        with open(os.path.join(path, 'lib', 'site-packages', 'f{}.py'.format(i)), 'w') as f:
+            f.write('x = {}\n'.format(i))
+    os.chmod(os.path.join(path, 'lib', 'site-packages', 'f0.py'), 0o444)
+
+
+def test_discard_in_background(testing_workdir):
+    prefix = os.path.join(testing_workdir, 'prefix')
+    _make_tree(prefix)
+    can = trash.Trash(os.path.join(testing_workdir, 'trash'))
+    try:
+        can.discard(prefix)
+        assert not os.path.exists(prefix)
+        can.wait()
+        assert os.listdir(can.path) == []
+        assert can.summary()['discarded'] == 1
+    finally:
+        can.close()
+    assert os.listdir(can.root) == []
+
+
+def test_abandoned_trash_is_deleted(testing_workdir):
+    root = os.path.join(testing_workdir, 'trash')
+    # left behind by a build that died; nobody holds its lock
+    _make_tree(os.path.join(root, '12345-deadbeef', 'abc-prefix'))
+    open(os.path.join(root, '12345-deadbeef.lock'), 'w').close()
+    can = trash.Trash(root)
+    can.wait()
+    own = os.path.basename(can.path)
+    assert sorted(os.listdir(root)) == [own, own + '.lock']
+    can.close()
+
+
+
+def test_trash_without_lock_is_left_alone(testing_workdir):
+    root = os.path.join(testing_workdir, 'trash')
+    # a process that has not taken its lock yet would lose its folder if it was deleted
+    _make_tree(os.path.join(root, '12345-deadbeef', 'abc-prefix'))
+    can = trash.Trash(root)
+    can.wait()
+    assert os.path.isdir(os.path.join(root, '12345-deadbeef', 'abc-prefix'))
+    can.close()
+
+def test_discard_without_background_delete(testing_workdir, testing_config):
+    testing_config.background_delete = False
+    prefix = os.path.join(testing_workdir, 'prefix')
+    _make_tree(prefix)
+    trash.discard(prefix, testing_config)
+    assert not os.path.exists(prefix)
+    assert not os.path.exists(os.path.join(testing_config.croot, trash.TRASH_DIR))
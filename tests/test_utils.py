@@ -194,6 +194,33 @@ def test_expand_globs(testing_workdir):
                           os.path.sep.join(('sub1', 'ssub1', 'ghi'))])
 
 
+@pytest.mark.parametrize('patterns', [
+    [os.path.join('sub1', 'ssub1')],
+    ['abc', os.path.join('sub1', 'def')],
+    ['a*', '*/*f', '**/*i'],
+    ['sub1/**', '*', 'sub1/*/a?c', 'sub1/[ad]*', '.hidden/*', '*/.h*'],
+    ['**/abc', 'sub1/**/abc', '**/ssub1/*'],
+    ['*/', 'sub1/*/'],
+])
+def test_prefix_file_index_matches_expand_globs(testing_workdir, patterns):
+    for f in ('abc', 'acb', 'sub1/def', 'sub1/abc', 'sub1/ssub1/ghi', 'sub1/ssub1/abc',
+              'sub1/.hid', '.hidden/x', 'sub1/.dot/abc'):
+        f = os.path.join(testing_workdir, *f.split('/'))
+        if not os.path.isdir(os.path.dirname(f)):
+            os.makedirs(os.path.dirname(f))
+        with open(f, 'w') as _f:
+            _f.write('weee')
+    prefix_files = utils.prefix_files(testing_workdir)
+    expected = sorted(set(os.path.normpath(f) for f in
+                          utils.expand_globs(patterns, testing_workdir)))
+
+    assert utils.PrefixFileIndex(prefix_files).select(patterns, testing_workdir) == expected
+    # the same, with part of the files in a shared base index
+    base = utils.PrefixFileIndex(f for f in prefix_files if f.startswith('sub1'))
+    index = utils.PrefixFileIndex(prefix_files - base.files, base=base)
+    assert index.select(patterns, testing_workdir) == expected
+
+
 def test_filter_files():
     # Files that should be filtered out.
     files_list = ['.git/a', 'something/.git/a', '.git\\a', 'something\\.git\\a',
@@ -300,6 +327,20 @@ def test_subprocess_stats_call(testing_workdir):
         utils.check_call_env(['bash', '-c', 'exit 1'], cwd=testing_workdir)
 
 
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason="samples /proc")
+def test_subprocess_stats_sampled(testing_workdir):
+    stats = {}
+    script = ('for i in 1 2 3; do /bin/true; done; '
+              'python -c "sum(range(10 ** 7))"; '
+              'dd if=/dev/zero of=blob bs=1M count=20 2>/dev/null; sync; sleep 0.3')
+    utils.check_call_env(['bash', '-c', script], stats=stats, cwd=testing_workdir)
+    assert stats['cpu_user'] + stats['cpu_sys'] > 0
+    assert stats['rss'] > 0
+    assert 'python' in stats['cpu_by_name']
+    assert stats['series'] and stats['series'][-1][0] <= stats['elapsed']
+    assert stats['elapsed'] >= 0.3
+
+
 def test_try_acquire_locks(testing_workdir):
     # Acquiring two unlocked locks should succeed.
     lock1 = filelock.FileLock(os.path.join(testing_workdir, 'lock1'))
@@ -329,3 +370,48 @@ def test_get_lock(testing_workdir):
     # ...even when not normalized
     lock1_unnormalized = utils.get_lock(os.path.join(testing_workdir, 'foo', '..', 'lock1'))
     assert lock1.lock_file == lock1_unnormalized.lock_file
+
+
+def test_reflink_or_copy(testing_workdir):
+    makefile('src/file.txt', 'some content')
+    os.chmod('src/file.txt', 0o751)
+    utils.reflink_or_copy('src/file.txt', 'dst.txt')
+    with open('dst.txt') as f:
+        assert f.read() == 'some content'
+    assert stat.S_IMODE(os.stat('dst.txt').st_mode) == 0o751
+    assert os.stat('dst.txt').st_ino != os.stat('src/file.txt').st_ino
+
+
+@pytest.mark.skipif(utils.on_win, reason="symlinks are not reliable on Windows")
+@pytest.mark.parametrize('threads', [1, 4])
+def test_copy_prefix_files(testing_workdir, threads):
+    src = os.path.join(testing_workdir, 'src')
+    dst = os.path.join(testing_workdir, 'dst')
+    for n in range(10):
+        makefile(os.path.join(src, 'lib', 'sub{}'.format(n % 3), 'f{}'.format(n)), str(n))
+    os.symlink(os.path.join(src, 'lib', 'sub0', 'f0'), os.path.join(src, 'lib', 'abs'))
+    os.symlink('sub1', os.path.join(src, 'lib', 'rel'))
+    makefile(os.path.join(dst, 'lib', 'sub0', 'f0'), 'stale')
+    files = utils.prefix_files(src)
+    assert utils.copy_prefix_files(src, dst, files, threads=threads) in ('reflink', 'copy')
+    assert utils.prefix_files(dst) == files
+    with open(os.path.join(dst, 'lib', 'sub0', 'f0')) as f:
+        assert f.read() == '0'
+    assert os.readlink(os.path.join(dst, 'lib', 'abs')) == os.path.join(dst, 'lib', 'sub0', 'f0')
+    assert os.readlink(os.path.join(dst, 'lib', 'rel')) == 'sub1'
+
+
+def test_tar_xf_members(testing_workdir):
+    archive = os.path.join(os.path.dirname(__file__), 'archives', 'test_debug_pkg-1.0-0.tar.bz2')
+    extracted = utils.tar_xf_members(archive, testing_workdir,
+                                     ['info/index.json', 'info/recipe', 'info/test/'])
+    assert sorted(extracted) == ['info/index.json',
+                                 'info/recipe/conda_build_config.yaml',
+                                 'info/recipe/meta.yaml',
+                                 'info/recipe/meta.yaml.template',
+                                 'info/test/run_test.bat',
+                                 'info/test/run_test.sh',
+                                 'info/test/test_time_dependencies.json']
+    assert os.path.isfile(os.path.join(testing_workdir, 'info', 'recipe', 'meta.yaml'))
+    assert not os.path.exists(os.path.join(testing_workdir, 'info', 'files'))
+    assert not os.path.exists(os.path.join(testing_workdir, 'info', 'git'))